@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import VehicleProfile
 
-# Register your models here.
+
+@admin.register(VehicleProfile)
+class VehicleProfileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'tank_gallons', 'mpg', 'start_fuel', 'reserve', 'min_purchase')
+    search_fields = ('name',)
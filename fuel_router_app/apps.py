@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class FuelRouterAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fuel_router_app'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .models import FuelStation
+        from .station_snapshot import station_data_changed
+
+        # Edits made through the ORM bump the station data version so every process reloads its snapshot
+        post_save.connect(station_data_changed, sender=FuelStation, dispatch_uid='fuel_station_data_save')
+        post_delete.connect(station_data_changed, sender=FuelStation, dispatch_uid='fuel_station_data_delete')
@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .gazetteer import gazetteer_loaded, get_gazetteer
+from .instrumentation import propagate, stage
+from .route_optimizer import RouteOptimizer, geocode_ttl, route_key
+from .tiered_cache import get_cache, query_key
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Thread pool for the CPU-bound optimizer and map rendering, kept off the event loop."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'FUEL_ROUTER_OPTIMIZER_WORKERS', 4),
+            thread_name_prefix='fuel-optimizer',
+        )
+    return _executor
+
+
+def run_task(func: Callable) -> Any:
+    """Run an executor task the way Django runs a request: with stale database connections closed before and after.
+
+    Tasks may hit the database (snapshot version checks, ``DatabaseStations`` queries, the gazetteer), and each
+    executor thread keeps its own connection, which nothing else would ever close.
+    """
+    close_old_connections()
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(func: Callable, *args, **kwargs) -> Any:
+    # Carry the request's context (its trace) into the worker thread
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), propagate(partial(run_task, partial(func, *args, **kwargs)))
+    )
+
+
+class AsyncRouteOptimizer(RouteOptimizer):
+    """RouteOptimizer whose upstream calls are non-blocking and whose number crunching runs in a thread pool."""
+
+    async def ageocode_location(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        if not gazetteer_loaded():
+            # Built from the database on first use
+            await run_in_executor(get_gazetteer)
+        point = self.lookup_gazetteer(location)
+        if point is not None:
+            return point
+        return await get_cache('geocode').aget_or_set(
+            query_key(location), lambda: self._afetch_geocode(location), ttl_for=geocode_ttl
+        )
+
+    async def _afetch_geocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        with stage('geocode_upstream'):
+            return await self.geocoder.ageocode(location)
+
+    async def ageocode_locations(self, *locations: str) -> List[Tuple[Optional[float], Optional[float]]]:
+        """Geocode several locations concurrently."""
+        with stage('geocode'):
+            return list(await asyncio.gather(*(self.ageocode_location(location) for location in locations)))
+
+    async def aget_route(self, start_lat: float, start_lon: float, end_lat: float, end_lon: float) -> Dict[str, Union[float, List]]:
+        return await self.aget_route_via([(start_lat, start_lon), (end_lat, end_lon)])
+
+    async def aget_route_via(self, points: List[Tuple[float, float]], steps: bool = False) -> Dict[str, Union[float, List]]:
+        with stage('route'):
+            return await get_cache('route').aget_or_set(
+                route_key(points, steps=steps), lambda: self._afetch_route(points, steps)
+            )
+
+    async def _afetch_route(self, points: List[Tuple[float, float]], steps: bool = False) -> Dict[str, Union[float, List]]:
+        with stage('route_upstream'):
+            return await self.router.aroute(points, steps)
+
+    async def aget_routes(
+            self,
+            points: List[Tuple[float, float]],
+            alternatives: int = 0,
+            steps: bool = False
+    ) -> List[Dict[str, Union[float, List]]]:
+        if not alternatives:
+            return [await self.aget_route_via(points, steps)]
+        with stage('route'):
+            return await get_cache('route').aget_or_set(
+                route_key(points, alternatives, steps), lambda: self._afetch_routes(points, alternatives, steps)
+            )
+
+    async def _afetch_routes(
+            self,
+            points: List[Tuple[float, float]],
+            alternatives: int,
+            steps: bool = False
+    ) -> List[Dict[str, Union[float, List]]]:
+        with stage('route_upstream'):
+            return await self.router.aroutes(points, alternatives, steps)
+
+    async def aplan_alternatives(
+            self,
+            start_coords: Tuple[float, float],
+            end_coords: Tuple[float, float],
+            routes: List[Dict[str, Union[float, List]]],
+            vehicles: List,
+            optimization: str = 'greedy',
+            snapshot: Any = None
+    ) -> List[Dict]:
+        """``plan_alternatives`` with one optimizer pool task per alternative."""
+        snapshot = await run_in_executor(self.alternatives_snapshot, routes, vehicles, snapshot)
+        with stage('alternatives'):
+            plans = await asyncio.gather(*(
+                run_in_executor(self.plan_alternative, start_coords, end_coords, route, vehicles, optimization, snapshot)
+                for route in routes
+            ))
+        return self.rank_alternatives(list(plans))
+
+    async def aplan_fuel_stops(self, *args, **kwargs) -> Dict:
+        """``plan_fuel_stops`` run in the optimizer thread pool."""
+        return await run_in_executor(self.plan_fuel_stops, *args, **kwargs)
+
+    async def aplan_for_vehicles(self, *args, **kwargs) -> List[Dict]:
+        """``plan_for_vehicles`` run in the optimizer thread pool."""
+        return await run_in_executor(self.plan_for_vehicles, *args, **kwargs)
@@ -0,0 +1,317 @@
+"""
+Geocoding and routing backends.
+
+``RouteOptimizer`` talks to a geocoder and a router chosen in settings (``FUEL_ROUTER_GEOCODER`` and
+``FUEL_ROUTER_ROUTER``, shaped like Django's ``CACHES``). The default backends call Nominatim and OSRM through the
+pooled upstream clients. The offline ones need no network: a gazetteer file for geocoding, OSRM responses replayed
+from disk (recorded by ``OSRMRouter`` with ``record_dir``) and a synthetic router that draws straight-line routes,
+so tests, benchmarks and air-gapped deployments run the full request path at full speed.
+"""
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .distance import path_lengths
+from .fast_json import dumps, loads
+from .gazetteer import DEFAULT_PLACES_FILE, Gazetteer, place_key, read_places_file
+from .tiered_cache import coordinates_key
+from .upstream import get_upstream
+
+Point = Tuple[float, float]
+Route = Dict[str, Union[float, List]]
+
+METERS_PER_MILE = 1609.34
+
+DEFAULT_GEOCODER = {'BACKEND': 'fuel_router_app.backends.NominatimGeocoder'}
+DEFAULT_ROUTER = {'BACKEND': 'fuel_router_app.backends.OSRMRouter'}
+
+
+class Geocoder:
+    def geocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        """(lat, lon) of a free-text location, or (None, None) if it is unknown."""
+        raise NotImplementedError
+
+    async def ageocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        # Offline backends are pure CPU and fast enough to run on the event loop
+        return self.geocode(location)
+
+
+class Router:
+    def route(self, points: List[Point], steps: bool = False) -> Route:
+        """Route through ordered (lat, lon) points: distance (miles), duration (hours), geometry, legs, and the
+        turn-by-turn steps if asked for (an empty list otherwise)."""
+        raise NotImplementedError
+
+    async def aroute(self, points: List[Point], steps: bool = False) -> Route:
+        return self.route(points, steps)
+
+    def routes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        """The route through the points, then up to ``alternatives`` alternative routes (none by default)."""
+        return [self.route(points, steps)]
+
+    async def aroutes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        return self.routes(points, alternatives, steps)
+
+
+class NominatimGeocoder(Geocoder):
+    def __init__(self, upstream: str = 'nominatim'):
+        # Pooled, rate-limited client; the base URL is configured in settings.FUEL_ROUTER_UPSTREAMS
+        self.upstream = get_upstream(upstream)
+
+    def geocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        path, params = self.request(location)
+        response = self.upstream.get(path, params=params)
+        return self.parse(response.status_code, loads(response.content) if response.status_code == 200 else None)
+
+    async def ageocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        path, params = self.request(location)
+        response = await self.upstream.aget(path, params=params)
+        return self.parse(response.status_code, loads(response.content) if response.status_code == 200 else None)
+
+    def request(self, location: str) -> Tuple[str, Dict[str, Union[str, int]]]:
+        params = {
+            'q': location,
+            'format': 'json',
+            'limit': 10,
+            'countrycodes': 'us'  # Limit to USA
+        }
+        return 'search', params
+
+    def parse(self, status_code: int, data: Optional[List[Dict]]) -> Tuple[Optional[float], Optional[float]]:
+        if status_code != 200:
+            raise ValueError(f"Nominatim API request failed with status code {status_code}")
+
+        if not data:
+            return None, None
+
+        # Extract coordinates from the first non-empty result
+        for result in data:
+            if 'lat' in result and 'lon' in result:
+                return float(result['lat']), float(result['lon'])
+
+        return None, None
+
+
+class OSRMRouter(Router):
+    def __init__(self, upstream: str = 'osrm', record_dir: Optional[str] = None):
+        self.upstream = get_upstream(upstream)
+        self.record_dir = record_dir
+
+    def route(self, points: List[Point], steps: bool = False) -> Route:
+        return self.routes(points, steps=steps)[0]
+
+    async def aroute(self, points: List[Point], steps: bool = False) -> Route:
+        return (await self.aroutes(points, steps=steps))[0]
+
+    def routes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        path, params = self.request(points, alternatives, steps)
+        response = self.upstream.get(path, params=params)
+        data = loads(response.content)
+        self.record(points, data, alternatives, steps)
+        return parse_osrm_routes(data)
+
+    async def aroutes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        path, params = self.request(points, alternatives, steps)
+        response = await self.upstream.aget(path, params=params)
+        data = loads(response.content)
+        self.record(points, data, alternatives, steps)
+        return parse_osrm_routes(data)
+
+    def request(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> Tuple[str, Dict[str, str]]:
+        path = 'route/v1/driving/' + ';'.join(f'{lon},{lat}' for lat, lon in points)
+        params = {
+            'overview': 'full',
+            'geometries': 'geojson',
+            # Turn-by-turn steps are most of a long route's response; only ask for them when they are returned
+            'steps': 'true' if steps else 'false'
+        }
+        if alternatives:
+            # Same request, OSRM just returns up to this many extra routes after the best one
+            params['alternatives'] = str(alternatives)
+        return path, params
+
+    def record(self, points: List[Point], data: Dict, alternatives: int = 0, steps: bool = False) -> None:
+        """Save a successful raw OSRM response for ``ReplayRouter``."""
+        if not self.record_dir or data.get('code') != 'Ok':
+            return
+        os.makedirs(self.record_dir, exist_ok=True)
+        path = recording_path(self.record_dir, points, alternatives, steps)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(dumps(data))
+        os.replace(tmp_path, path)
+
+
+class GazetteerGeocoder(Geocoder):
+    """Offline geocoder over a CSV of places (``name,state,lat,lon``), matched on "name, state".
+
+    Queries may carry a street address or a trailing country ("…, Austin, TX, USA"); when the full query is not a
+    known place, its last "city, state" pair is tried, i.e. the result falls back to city level.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.gazetteer = Gazetteer.from_rows(read_places_file(path or DEFAULT_PLACES_FILE))
+
+    def geocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        point = self.gazetteer.lookup(location)
+        if point is None:
+            parts = place_key(location).split(', ')
+            point = self.gazetteer.places.get(place_key(', '.join(parts[-2:])))
+        return point if point is not None else (None, None)
+
+
+class SyntheticRouter(Router):
+    """Straight-line routes between the points, densified like an OSRM ``overview=full`` geometry.
+
+    Alternatives of a two-point route bow out through a midpoint pushed sideways by ``detour`` of the trip length,
+    alternately to the left and to the right, so they pass different stations.
+    """
+
+    def __init__(self, spacing_miles: float = 0.5, speed_mph: float = 55.0, detour: float = 0.1):
+        self.spacing_miles = spacing_miles
+        self.speed_mph = speed_mph
+        self.detour = detour
+
+    def route(self, points: List[Point], steps: bool = False) -> Route:
+        geometry: List[List[float]] = []
+        legs = []
+        for (start_lat, start_lon), (end_lat, end_lon) in zip(points, points[1:]):
+            direct = float(path_lengths(np.array([start_lat, end_lat]), np.array([start_lon, end_lon])).sum())
+            fractions = np.linspace(0.0, 1.0, max(int(direct / self.spacing_miles), 1) + 1)
+            lats = start_lat + (end_lat - start_lat) * fractions
+            lons = start_lon + (end_lon - start_lon) * fractions
+            length = float(path_lengths(lats, lons).sum())
+            leg = np.column_stack((lons, lats)).tolist()
+            # Consecutive legs share their joining point
+            geometry.extend(leg if not geometry else leg[1:])
+            legs.append({'distance': length, 'duration': length / self.speed_mph})
+
+        distance = sum(leg['distance'] for leg in legs)
+        return {
+            'distance': distance,
+            'duration': distance / self.speed_mph,
+            'geometry': geometry,
+            'steps': [],
+            'legs': legs,
+        }
+
+    def routes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        routes = [self.route(points)]
+        if len(points) != 2:
+            # Like OSRM, which only returns alternatives for routes without via points
+            return routes
+        (start_lat, start_lon), (end_lat, end_lon) = points
+        mid_lat, mid_lon = (start_lat + end_lat) / 2, (start_lon + end_lon) / 2
+        for i in range(alternatives):
+            # Perpendicular offset in degrees; good enough for a synthetic detour
+            side = (i // 2 + 1) * self.detour * (1 if i % 2 == 0 else -1)
+            via = (mid_lat + side * (end_lon - start_lon), mid_lon - side * (end_lat - start_lat))
+            route = self.route([points[0], via, points[1]])
+            route['legs'] = [{'distance': route['distance'], 'duration': route['duration']}]
+            routes.append(route)
+        return routes
+
+
+class ReplayRouter(Router):
+    """Serves OSRM responses recorded by ``OSRMRouter(record_dir=...)``; misses go to ``fallback`` if set."""
+
+    def __init__(self, directory: str, fallback: Optional[Dict] = None):
+        self.directory = directory
+        self.fallback = load_backend(fallback) if fallback else None
+
+    def route(self, points: List[Point], steps: bool = False) -> Route:
+        return self.routes(points, steps=steps)[0]
+
+    def routes(self, points: List[Point], alternatives: int = 0, steps: bool = False) -> List[Route]:
+        # A response recorded without steps cannot answer a request for them; one recorded with steps can answer
+        # a request without, once they are dropped
+        for recorded_steps in ((True,) if steps else (False, True)):
+            path = recording_path(self.directory, points, alternatives, recorded_steps)
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    routes = parse_osrm_routes(loads(file.read()))
+                if not steps:
+                    for route in routes:
+                        route['steps'] = []
+                return routes
+        if self.fallback is not None:
+            return self.fallback.routes(points, alternatives, steps)
+        raise ValueError("Could not calculate route (no recorded response)")
+
+
+def parse_osrm_routes(data: Dict) -> List[Route]:
+    """Every route of an OSRM response, best first."""
+    if data['code'] != 'Ok':
+        raise ValueError("Could not calculate route")
+
+    return [
+        {
+            'distance': route['distance'] / METERS_PER_MILE,  # Convert meters to miles
+            'duration': route['duration'] / 3600,  # Convert seconds to hours
+            'geometry': route['geometry']['coordinates'],
+            # Empty unless the request asked for steps
+            'steps': [step for leg in route['legs'] for step in leg.get('steps', ())],
+            'legs': [
+                {'distance': leg['distance'] / METERS_PER_MILE, 'duration': leg['duration'] / 3600}
+                for leg in route['legs']
+            ]
+        }
+        for route in data['routes']
+    ]
+
+
+def parse_osrm_route(data: Dict) -> Route:
+    return parse_osrm_routes(data)[0]
+
+
+def recording_path(directory: str, points: List[Point], alternatives: int = 0, steps: bool = False) -> str:
+    key = coordinates_key(*points)
+    if alternatives:
+        key += f'|alternatives={alternatives}'
+    if steps:
+        key += '|steps'
+    return os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def load_backend(config: Dict) -> Union[Geocoder, Router]:
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+_backends: Dict[str, Union[Geocoder, Router]] = {}
+_backends_lock = threading.Lock()
+
+
+def _get_backend(setting: str, default: Dict) -> Union[Geocoder, Router]:
+    backend = _backends.get(setting)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(setting)
+            if backend is None:
+                backend = load_backend(getattr(settings, setting, default))
+                _backends[setting] = backend
+    return backend
+
+
+def get_geocoder() -> Geocoder:
+    """Process-wide geocoder configured in ``settings.FUEL_ROUTER_GEOCODER``."""
+    return _get_backend('FUEL_ROUTER_GEOCODER', DEFAULT_GEOCODER)
+
+
+def get_router() -> Router:
+    """Process-wide router configured in ``settings.FUEL_ROUTER_ROUTER``."""
+    return _get_backend('FUEL_ROUTER_ROUTER', DEFAULT_ROUTER)
+
+
+@receiver(setting_changed)
+def _reset_backends(setting, **kwargs):
+    # Pick up backends swapped with override_settings
+    if setting in ('FUEL_ROUTER_GEOCODER', 'FUEL_ROUTER_ROUTER'):
+        with _backends_lock:
+            _backends.pop(setting, None)
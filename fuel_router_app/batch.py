@@ -0,0 +1,219 @@
+"""
+Fleet-wide trip planning in one request.
+
+Each distinct location is geocoded once and each distinct route (start, waypoints, end) is fetched once, however
+many trips share them. The fuel optimizer then runs in a process pool kept across requests: its workers receive the
+station snapshot once, at start-up, and the pool is replaced only when the snapshot is (a new station data
+version). Each worker reuses the corridor of a route for every trip on it. Results are yielded in completion order
+so the view can stream them.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db import connections
+
+from .instrumentation import propagate
+from .route_optimizer import RouteOptimizer
+from .station_snapshot import DatabaseStations, StationSnapshot, get_snapshot
+from .vehicle import Vehicle
+
+Coordinates = Tuple[float, float]
+RouteKey = Tuple[Coordinates, ...]
+
+
+# Corridors a pool worker keeps for the routes of later trips and batches
+MAX_WORKER_CORRIDORS = 256
+
+
+class BatchState:
+    """The stations trips are planned against, and the corridors built from them so far."""
+
+    def __init__(self, snapshot: Union[StationSnapshot, DatabaseStations]):
+        self.snapshot = snapshot
+        self.corridors: Dict[Tuple[RouteKey, float], object] = {}
+
+
+# Per-worker state of pool processes, installed by _init_worker; never set in the web process, where concurrent
+# batches plan against their own state
+_worker_state: Optional[BatchState] = None
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_key: Optional[Tuple] = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(snapshot: Union[StationSnapshot, DatabaseStations]) -> None:
+    global _worker_state
+    import django
+    django.setup()  # No-op when the worker was forked from an initialised process
+    _worker_state = BatchState(snapshot)
+
+
+def _stations_key(snapshot: Union[StationSnapshot, DatabaseStations]) -> Tuple:
+    workers = getattr(settings, 'FUEL_ROUTER_BATCH_WORKERS', 4)
+    start_method = getattr(settings, 'FUEL_ROUTER_BATCH_START_METHOD', None)
+    if isinstance(snapshot, DatabaseStations):
+        # Re-created at every version check; workers query the stations around each route themselves
+        return 'database', snapshot.version, workers, start_method
+    # One snapshot object per data version (override_snapshot may swap in others); the pool keeps it alive, so
+    # its id is not reused while the key is current
+    return 'memory', snapshot.version, id(snapshot), workers, start_method
+
+
+def get_pool(snapshot: Union[StationSnapshot, DatabaseStations]) -> ProcessPoolExecutor:
+    """The optimizer process pool for ``snapshot``, started on first use and replaced when the snapshot is."""
+    global _pool, _pool_key
+    key = _stations_key(snapshot)
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None:
+                # Batches still running on the old workers finish there
+                _pool.shutdown(wait=False)
+            context = multiprocessing.get_context(getattr(settings, 'FUEL_ROUTER_BATCH_START_METHOD', None))
+            # Forked workers must not inherit this thread's database connections
+            connections.close_all()
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'FUEL_ROUTER_BATCH_WORKERS', 4), mp_context=context,
+                initializer=_init_worker, initargs=(snapshot,),
+            )
+            _pool_key = key
+            # Start the workers now, before this thread opens another connection
+            _pool.submit(int).result()
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = _pool_key = None
+
+
+def _plan_trip(
+        route_key: RouteKey, route: Dict, vehicle: Vehicle, optimization: str, state: Optional[BatchState] = None
+) -> Dict:
+    """Run the optimizer for one trip against ``state``, by default the pool worker's."""
+    state = state or _worker_state
+    optimizer = RouteOptimizer()
+    width = optimizer.corridor_width(vehicle.usable_range)
+
+    corridor = state.corridors.get((route_key, width))
+    if corridor is None:
+        corridor = optimizer.build_corridor(route['geometry'], route['distance'], width, state.snapshot)
+        if len(state.corridors) >= MAX_WORKER_CORRIDORS:
+            state.corridors.clear()
+        state.corridors[(route_key, width)] = corridor
+
+    return optimizer.plan_fuel_stops(
+        route_key[0], route_key[-1], route['geometry'], route['distance'], optimization=optimization,
+        corridor=corridor, legs=route.get('legs'), **vehicle.planning_kwargs()
+    )
+
+
+def plan_batch(trips: List[Dict], route_service: Optional[RouteOptimizer] = None) -> Iterator[Dict]:
+    """Plan every trip, yielding one result dict per trip (with its ``index``) as soon as it is ready."""
+    route_service = route_service or RouteOptimizer()
+    upstream_workers = getattr(settings, 'FUEL_ROUTER_BATCH_UPSTREAM_WORKERS', 4)
+
+    # Geocode each distinct location once
+    locations = sorted({location for trip in trips for location in _locations(trip)})
+    with ThreadPoolExecutor(max_workers=upstream_workers) as pool:
+        geocoded = pool.map(propagate(lambda location: _safe(route_service.geocode_location, location)), locations)
+        geocoded = dict(zip(locations, geocoded))
+
+    pending, route_keys = [], set()
+    for index, trip in enumerate(trips):
+        for location in _locations(trip):
+            result = geocoded[location]
+            if isinstance(result, Exception) or None in result:
+                yield _error(index, trip, f"Could not geocode '{location}'")
+                break
+        else:
+            route_key = tuple(geocoded[location] for location in _locations(trip))
+            pending.append((index, trip, route_key))
+            route_keys.add(route_key)
+
+    # Route each distinct list of points once
+    route_keys = sorted(route_keys)
+    with ThreadPoolExecutor(max_workers=upstream_workers) as pool:
+        routed = pool.map(propagate(lambda key: _safe(route_service.get_route_via, list(key))), route_keys)
+        routes = dict(zip(route_keys, routed))
+
+    runnable = []
+    for index, trip, route_key in pending:
+        if isinstance(routes[route_key], Exception):
+            yield _error(index, trip, str(routes[route_key]))
+        else:
+            runnable.append((index, trip, route_key))
+    routes = {key: route for key, route in routes.items() if not isinstance(route, Exception)}
+
+    snapshot = get_snapshot()
+    workers = getattr(settings, 'FUEL_ROUTER_BATCH_WORKERS', 4)
+    if workers <= 0 or len(runnable) < 2:
+        if isinstance(snapshot, DatabaseStations) and runnable:
+            # The stations near any of the routes, loaded in one query, instead of one query per route
+            width = max(route_service.corridor_width(trip['vehicle'].usable_range) for _, trip, _ in runnable)
+            snapshot = snapshot.near_routes([route['geometry'] for route in routes.values()], width)
+        state = BatchState(snapshot)
+        for index, trip, route_key in runnable:
+            result = _safe(_plan_trip, *_task_args(trip, route_key, routes), state)
+            yield _trip_result(index, trip, route_key, routes, result)
+        return
+
+    pool = get_pool(snapshot)
+    # Each task carries its route; the workers hold only the stations
+    futures: Dict[Future, Tuple[int, Dict, RouteKey]] = {
+        pool.submit(_plan_trip, *_task_args(trip, route_key, routes)): (index, trip, route_key)
+        for index, trip, route_key in runnable
+    }
+    try:
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, trip, route_key = futures.pop(future)
+                error = future.exception()
+                yield _trip_result(index, trip, route_key, routes, error or future.result())
+    finally:
+        # The consumer stopped reading (e.g. the client disconnected): drop the work still queued
+        for future in futures:
+            future.cancel()
+
+
+def _locations(trip: Dict) -> List[str]:
+    return [trip['start'], *trip['waypoints'], trip['end']]
+
+
+def _task_args(trip: Dict, route_key: RouteKey, routes: Dict[RouteKey, Dict]) -> Tuple:
+    return route_key, routes[route_key], trip['vehicle'], trip['optimization']
+
+
+def _safe(func, *args):
+    """Call ``func``, returning the exception instead of raising it so one bad trip never fails the batch."""
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+
+def _error(index: int, trip: Dict, message: str) -> Dict:
+    return {'index': index, 'trip_id': trip.get('trip_id'), 'error': message}
+
+
+def _trip_result(index: int, trip: Dict, route_key: RouteKey, routes: Dict, result) -> Dict:
+    if isinstance(result, Exception):
+        return _error(index, trip, str(result))
+    return {
+        'index': index,
+        'trip_id': trip.get('trip_id'),
+        'start': trip['start'],
+        'end': trip['end'],
+        'total_distance': result['total_distance'],
+        'duration': routes[route_key]['duration'],
+        'vehicle': trip['vehicle'].as_dict(),
+        'total_cost': round(result['total_cost'], 4),
+        'fuel_stops': result['fuel_stops'],
+    }
@@ -0,0 +1,140 @@
+"""
+Synthetic data and timing helpers shared by the ``benchmark`` management command.
+
+Everything here runs without the database or network: station tables are generated straight into a
+``StationSnapshot`` and routes are random polylines across the continental US, or OSRM responses recorded by
+``OSRMRouter(record_dir=...)``.
+"""
+import glob
+import json
+import math
+import os
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from .distance import path_lengths
+from .station_snapshot import StationSnapshot
+
+# Continental US bounding box (lat, lon)
+US_BOUNDS = ((25.0, -124.0), (49.0, -67.0))
+
+
+def synthetic_snapshot(size: int, seed: int = 0) -> StationSnapshot:
+    """Snapshot of ``size`` stations spread uniformly over the continental US."""
+    rng = np.random.default_rng(seed)
+    (min_lat, min_lon), (max_lat, max_lon) = US_BOUNDS
+    return StationSnapshot(
+        opis_ids=np.arange(size, dtype=np.int64),
+        names=[f'Station {i}' for i in range(size)],
+        lats=rng.uniform(min_lat, max_lat, size),
+        lons=rng.uniform(min_lon, max_lon, size),
+        prices=np.round(rng.uniform(2.8, 4.6, size), 3),
+    )
+
+
+def synthetic_route(length: float, seed: int = 0, spacing: float = 0.5) -> Tuple[List[List[float]], float]:
+    """Meandering west-to-east route of roughly ``length`` miles as OSRM-style [lon, lat] pairs."""
+    rnd = random.Random(seed)
+    (min_lat, min_lon), (max_lat, max_lon) = US_BOUNDS
+    lat, lon = rnd.uniform(32.0, 42.0), min_lon + 2.0
+    heading = math.radians(90)
+    coordinates = [[lon, lat]]
+    for _ in range(int(length / spacing)):
+        heading += rnd.gauss(0, 0.05)
+        heading = min(max(heading, math.radians(45)), math.radians(135))
+        lat = min(max(lat + spacing * math.cos(heading) / 69.0, min_lat), max_lat)
+        lon = min(lon + spacing * math.sin(heading) / (69.0 * math.cos(math.radians(lat))), max_lon)
+        coordinates.append([lon, lat])
+
+    coords = np.asarray(coordinates)
+    return coordinates, float(path_lengths(coords[:, 1], coords[:, 0]).sum())
+
+
+def recorded_routes(directory: str) -> List[Tuple[List[List[float]], float]]:
+    """(geometry, miles) of every OSRM response recorded in ``directory``, shortest first."""
+    from .backends import parse_osrm_route
+
+    routes = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as file:
+            route = parse_osrm_route(json.load(file))
+        routes.append((route['geometry'], route['distance']))
+    return sorted(routes, key=lambda route: route[1])
+
+
+def timed(func, *args, **kwargs) -> Tuple[object, float]:
+    """Call ``func`` and return its result with the elapsed wall time in milliseconds."""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def measure(func: Callable[[], object], repeat: int = 5, number: int = 1) -> Dict[str, float]:
+    """Median and best wall time per call in milliseconds, over ``repeat`` rounds of ``number`` calls."""
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) * 1000 / number)
+    return {'median_ms': round(statistics.median(rounds), 4), 'min_ms': round(min(rounds), 4)}
+
+
+def compare(baseline: Dict, current: Dict, tolerance_pct: float = 10.0) -> Dict[str, Dict[str, float]]:
+    """Timing changes between two benchmark reports, keyed by the path of every ``*ms`` figure present in both."""
+    old, new = _timings(baseline), _timings(current)
+    changes = {}
+    for path in sorted(old.keys() & new.keys()):
+        change = 100 * (new[path] / old[path] - 1) if old[path] else 0.0
+        changes[path] = {
+            'baseline': old[path],
+            'current': new[path],
+            'change_pct': round(change, 1),
+            'regression': change > tolerance_pct,
+        }
+    return changes
+
+
+def _timings(report, path: str = '') -> Dict[str, float]:
+    found = {}
+    if isinstance(report, dict):
+        # Rows are identified by their parameters rather than their position
+        label = ','.join(f'{key}={report[key]}' for key in ('suite', 'stations', 'route_miles', 'case', 'renderer')
+                         if key in report)
+        for key, value in report.items():
+            child = f'{path}/{label}' if label else path
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key.endswith('ms'):
+                found[f'{child}/{key}'] = float(value)
+            elif isinstance(value, (dict, list)):
+                found.update(_timings(value, f'{child}/{key}'))
+    elif isinstance(report, list):
+        for item in report:
+            found.update(_timings(item, path))
+    return found
+
+
+def end_range(plan: Dict, tank_range: float, mpg: float) -> float:
+    """Miles of fuel left at the destination by a plan that leaves with a full tank."""
+    return tank_range - plan['total_distance'] + mpg * sum(stop['gallons'] for stop in plan['fuel_stops'])
+
+
+def plan_summary(plan: Dict, tank_range: float, mpg: float) -> Dict[str, float]:
+    """Cost figures for a fuel plan, plus whether its stops are close enough together to be driven."""
+    total_distance = plan['total_distance']
+    stops = plan['fuel_stops']
+    mileposts = [0.0] + [stop['distance_from_start'] for stop in stops] + [total_distance]
+    longest_leg = max(b - a for a, b in zip(mileposts, mileposts[1:]))
+    gallons = sum(stop['gallons'] for stop in stops)
+    return {
+        'stops': len(stops),
+        'total_cost': round(plan['total_cost'], 2),
+        'gallons': round(gallons, 2),
+        'cost_per_gallon': round(plan['total_cost'] / gallons, 4) if gallons else 0.0,
+        # What is left at the destination was bought but not burnt
+        'end_gallons': round(end_range(plan, tank_range, mpg) / mpg, 2) + 0.0,
+        'feasible': longest_leg <= tank_range,
+    }
@@ -0,0 +1,206 @@
+"""
+Route corridor: every station within a given distance of the route, projected onto it once per route.
+
+The route polyline is thinned to a resolution proportional to the corridor width, each segment's bounding box
+(grown by the width) is rasterised onto the grid of the snapshot's spatial index, and only the stations the index
+holds in those cells are measured, against the segments sharing their cell. The result is a list of stations sorted by milepost that optimizers scan with
+``searchsorted`` instead of re-querying stations for every point on the route.
+"""
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .distance import path_lengths
+from .instrumentation import count
+from .spatial_index import MILES_PER_DEGREE_LAT, cell_keys, expand_ranges
+from .station_snapshot import StationSnapshot
+
+
+class CorridorStation(NamedTuple):
+    milepost: float  # Distance along the route to the point nearest the station
+    offset: float  # Lateral distance from the route, in miles
+    station: int  # Row in the snapshot
+
+
+class RouteCorridor:
+    """Stations near a route, sorted by milepost, plus the route's cumulative distance profile."""
+
+    def __init__(
+            self,
+            snapshot: StationSnapshot,
+            lats: np.ndarray,
+            lons: np.ndarray,
+            cumulative: np.ndarray,
+            width: float,
+            rows: np.ndarray,
+            mileposts: np.ndarray,
+            offsets: np.ndarray
+    ):
+        self.snapshot = snapshot
+        self.lats = lats
+        self.lons = lons
+        self.cumulative = cumulative
+        self.width = width
+        self.rows = rows
+        self.mileposts = mileposts
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[CorridorStation]:
+        for milepost, offset, row in zip(self.mileposts, self.offsets, self.rows):
+            yield CorridorStation(float(milepost), float(offset), int(row))
+
+    @property
+    def total_distance(self) -> float:
+        return float(self.cumulative[-1])
+
+    def between(self, start: float, end: float) -> slice:
+        """Positions (into ``rows``/``mileposts``/``offsets``) of the stations with start <= milepost <= end."""
+        return slice(
+            int(np.searchsorted(self.mileposts, start, side='left')),
+            int(np.searchsorted(self.mileposts, end, side='right'))
+        )
+
+    def near(self, lat: float, lon: float, radius: float) -> np.ndarray:
+        """Positions of every station that can be within ``radius`` miles of a point (lat, lon) on the route.
+
+        Such a station's nearest route point is at most ``radius + width`` from the point, but on a route that winds
+        back on itself that can be anywhere along it, not only around the point's milepost. The milepost ranges of
+        all stretches of route passing that close (by a bounding box test on the vertices) are taken; callers
+        still check the real distance.
+        """
+        segments = np.diff(self.cumulative)
+        reach = 1.05 * (radius + self.width) + (float(segments.max()) if segments.size else 0.0)
+        lat_reach = reach / MILES_PER_DEGREE_LAT
+        lon_reach = reach / (MILES_PER_DEGREE_LAT * np.cos(np.radians(min(abs(lat) + lat_reach, 89.0))))
+        close = (np.abs(self.lats - lat) <= lat_reach) & (np.abs(self.lons - lon) <= lon_reach)
+        # A station projects onto the segments on either side of a close vertex
+        close = close | np.r_[close[1:], False] | np.r_[False, close[:-1]]
+        edges = np.flatnonzero(np.diff(np.r_[False, close, False].astype(np.int8)))
+        first = np.searchsorted(self.mileposts, self.cumulative[edges[::2]], side='left')
+        last = np.searchsorted(self.mileposts, self.cumulative[edges[1::2] - 1], side='right')
+        # Stretches are disjoint, but two can share a milepost where the route has a zero-length segment
+        return np.unique(expand_ranges(first, last - first))
+
+    def within(self, width: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Snapshot rows and mileposts of the stations no further than ``width`` miles from the route."""
+        mask = self.offsets <= width
+        return self.rows[mask], self.mileposts[mask]
+
+    def point_at(self, milepost: float) -> Tuple[float, float]:
+        """(lat, lon) of the route at a milepost, interpolated between vertices."""
+        return (
+            float(np.interp(milepost, self.cumulative, self.lats)),
+            float(np.interp(milepost, self.cumulative, self.lons))
+        )
+
+
+def _thin(cumulative: np.ndarray, resolution: float) -> np.ndarray:
+    """Indices of route vertices roughly ``resolution`` miles apart, always keeping both ends."""
+    marks = np.arange(0.0, cumulative[-1], resolution)
+    vertices = np.unique(np.searchsorted(cumulative, marks))
+    if vertices[-1] != len(cumulative) - 1:
+        vertices = np.append(vertices, len(cumulative) - 1)
+    return vertices
+
+
+def build_corridor(
+        snapshot: StationSnapshot,
+        route_coordinates: List[List[float]],
+        width: float,
+        total_distance: Optional[float] = None
+) -> RouteCorridor:
+    """Project every snapshot station within ``width`` miles of the route onto it.
+
+    ``route_coordinates`` are OSRM-style [lon, lat] pairs. When ``total_distance`` is given, mileposts are
+    scaled so the end of the route matches the distance reported by the router.
+    """
+    coords = np.asarray(route_coordinates, dtype=np.float64)
+    lats, lons = coords[:, 1].copy(), coords[:, 0].copy()
+    cumulative = np.concatenate(([0.0], np.cumsum(path_lengths(lats, lons))))
+    if total_distance and cumulative[-1] > 0:
+        cumulative *= total_distance / cumulative[-1]
+
+    empty = np.empty(0, dtype=np.int64)
+    if len(coords) < 2 or not len(snapshot) or cumulative[-1] <= 0:
+        return RouteCorridor(snapshot, lats, lons, cumulative, width, empty, np.empty(0), np.empty(0))
+
+    # Thinning moves the polyline by far less than the corridor width but cuts the segment count sharply
+    vertices = _thin(cumulative, min(max(width / 10, 0.25), 5.0))
+    seg_lat0, seg_lat1 = lats[vertices[:-1]], lats[vertices[1:]]
+    seg_lon0, seg_lon1 = lons[vertices[:-1]], lons[vertices[1:]]
+    seg_start = cumulative[vertices[:-1]]
+    seg_length = cumulative[vertices[1:]] - seg_start
+
+    # Segment bounding boxes grown by the corridor width, in grid cells
+    index = snapshot.index
+    lat_delta = width / MILES_PER_DEGREE_LAT
+    widest_lat = np.minimum(np.maximum(np.abs(seg_lat0), np.abs(seg_lat1)) + lat_delta, 89.0)
+    lon_delta = width / (MILES_PER_DEGREE_LAT * np.cos(np.radians(widest_lat)))
+    min_row = index.cell(np.minimum(seg_lat0, seg_lat1) - lat_delta)
+    max_row = index.cell(np.maximum(seg_lat0, seg_lat1) + lat_delta)
+    min_col = index.cell(np.minimum(seg_lon0, seg_lon1) - lon_delta)
+    max_col = index.cell(np.maximum(seg_lon0, seg_lon1) + lon_delta)
+
+    # Rasterise: one (cell, segment) pair for every cell each box covers, grouped by cell
+    n_rows = max_row - min_row + 1
+    n_cols = max_col - min_col + 1
+    counts = n_rows * n_cols
+    pair_segment = np.repeat(np.arange(len(counts)), counts)
+    local = expand_ranges(np.zeros_like(counts), counts)
+    pair_key = cell_keys(min_row[pair_segment] + local // n_cols[pair_segment],
+                         min_col[pair_segment] + local % n_cols[pair_segment])
+    order = np.argsort(pair_key, kind='stable')
+    pair_key, pair_segment = pair_key[order], pair_segment[order]
+    cells, cell_first, cell_pairs = np.unique(pair_key, return_index=True, return_counts=True)
+
+    # Join the stations of those cells, straight from the index, to the segments sharing their cell
+    stations, station_cell = index.stations_in(cells)
+    if not stations.size:
+        return RouteCorridor(snapshot, lats, lons, cumulative, width, empty, np.empty(0), np.empty(0))
+
+    matches = cell_pairs[station_cell]
+    cand_station = np.repeat(stations, matches)
+    cand_segment = pair_segment[expand_ranges(cell_first[station_cell], matches)]
+
+    # Point-to-segment distance in a local equirectangular frame centred on each station
+    s_lat = snapshot.lats[cand_station]
+    s_lon = snapshot.lons[cand_station]
+    scale = MILES_PER_DEGREE_LAT * np.cos(np.radians(s_lat))
+    ax = (seg_lon0[cand_segment] - s_lon) * scale
+    ay = (seg_lat0[cand_segment] - s_lat) * MILES_PER_DEGREE_LAT
+    bx = (seg_lon1[cand_segment] - s_lon) * scale
+    by = (seg_lat1[cand_segment] - s_lat) * MILES_PER_DEGREE_LAT
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_sq > 0, -(ax * dx + ay * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    offset = np.hypot(ax + t * dx, ay + t * dy)
+    count('segment_distance_computations', offset.size)
+    milepost = seg_start[cand_segment] + t * seg_length[cand_segment]
+
+    # Keep each station's closest segment (pairs are grouped by station)
+    group_start = np.cumsum(matches) - matches
+    best_offset = np.minimum.reduceat(offset, group_start)
+    best_pair = _first_true(offset == np.repeat(best_offset, matches), matches)
+
+    inside = best_offset <= width
+    rows = stations[inside]
+    mileposts = milepost[best_pair[inside]]
+    offsets = best_offset[inside]
+    count('corridor_stations', rows.size)
+
+    # By milepost, ties in station order
+    order = np.lexsort((rows, mileposts))
+    return RouteCorridor(snapshot, lats, lons, cumulative, width, rows[order], mileposts[order], offsets[order])
+
+
+def _first_true(mask: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Position of the first True in every consecutive group of a flat boolean array (each has at least one)."""
+    positions = np.flatnonzero(mask)
+    group_of = np.repeat(np.arange(len(counts)), counts)[positions]
+    _, first = np.unique(group_of, return_index=True)
+    return positions[first]
@@ -0,0 +1,78 @@
+"""
+Vectorized great-circle and ellipsoidal distance kernels.
+
+All functions take latitudes/longitudes in degrees (scalars or NumPy arrays that broadcast against each
+other) and return distances in miles, so a whole batch of station/route-point pairs is computed in one call.
+"""
+import numpy as np
+from django.conf import settings
+
+from .instrumentation import count
+
+METERS_PER_MILE = 1609.344
+EARTH_RADIUS_MILES = 6371008.8 / METERS_PER_MILE  # Mean earth radius
+
+# WGS-84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+DISTANCE_MODES = ('haversine', 'ellipsoidal')
+
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """Haversine central angle (radians) between points given in radians."""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Spherical distance in miles. Fastest mode, within ~0.5% of the ellipsoidal distance."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    return EARTH_RADIUS_MILES * _central_angle(lat1, lon1, lat2, lon2)
+
+
+def ellipsoidal(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """WGS-84 distance in miles using Lambert's formula, accurate to a few metres over continental routes."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+
+    # Reduced (parametric) latitudes
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_sigma = np.sin(sigma)
+    cos_half = np.cos(sigma / 2) ** 2
+    sin_half = np.sin(sigma / 2) ** 2
+
+    # Coincident (sigma == 0) and antipodal (sigma == pi) points would divide by zero; their correction terms are 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(cos_half > 0, (sigma - sin_sigma) * np.sin(p) ** 2 * np.cos(q) ** 2 / cos_half, 0.0)
+        y = np.where(sin_half > 0, (sigma + sin_sigma) * np.cos(p) ** 2 * np.sin(q) ** 2 / sin_half, 0.0)
+
+    return WGS84_A * (sigma - WGS84_F / 2 * (x + y)) / METERS_PER_MILE
+
+
+def get_distance_mode() -> str:
+    mode = getattr(settings, 'FUEL_ROUTER_DISTANCE_MODE', 'ellipsoidal')
+    if mode not in DISTANCE_MODES:
+        raise ValueError(f"Unknown distance mode '{mode}', expected one of {DISTANCE_MODES}")
+    return mode
+
+
+def distance(lat1, lon1, lat2, lon2, mode: str = None) -> np.ndarray:
+    """Element-wise distance in miles between broadcastable coordinate arrays."""
+    kernel = haversine if (mode or get_distance_mode()) == 'haversine' else ellipsoidal
+    result = kernel(lat1, lon1, lat2, lon2)
+    count('distance_computations', np.size(result))
+    return result
+
+
+def path_lengths(lats, lons, mode: str = None) -> np.ndarray:
+    """Length in miles of each consecutive segment of a path."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return distance(lats[:-1], lons[:-1], lats[1:], lons[1:], mode)
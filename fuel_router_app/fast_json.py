@@ -0,0 +1,110 @@
+"""
+JSON encoding and decoding for route payloads.
+
+Responses are mostly long coordinate arrays and OSRM responses are megabytes of nested lists, so the stdlib
+``json`` module shows up in profiles. ``dumps``/``loads`` use orjson when it is installed (and
+``FUEL_ROUTER_JSON_BACKEND`` is 'orjson', the default) and fall back to the stdlib otherwise, producing the same
+compact UTF-8 output DRF's ``JSONRenderer`` does. ``FastJSONRenderer`` and ``FastJSONParser`` plug them into DRF;
+``iter_json`` encodes a response in pieces so the long arrays of a big route are streamed instead of built as one
+buffer.
+"""
+import json
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+# Decimal costs, lazy strings, ...: whatever Django's encoder knows
+_encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+_use_orjson: Optional[bool] = None
+
+
+def orjson_enabled() -> bool:
+    global _use_orjson
+    if _use_orjson is None:
+        _use_orjson = orjson is not None and getattr(settings, 'FUEL_ROUTER_JSON_BACKEND', 'orjson') == 'orjson'
+    return _use_orjson
+
+
+def dumps(data: Any) -> bytes:
+    """Compact UTF-8 JSON."""
+    if orjson_enabled():
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return _encoder.encode(data).encode('utf-8')
+
+
+def loads(data: bytes) -> Any:
+    """Decode JSON bytes or text; raises ``ValueError`` on malformed input."""
+    if orjson_enabled():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def iter_json(data: dict, chunk_items: int = 4096) -> Iterator[bytes]:
+    """Encode a dict piece by piece, writing its long lists ``chunk_items`` elements at a time."""
+    yield b'{'
+    for i, (key, value) in enumerate(data.items()):
+        prefix = (b',' if i else b'') + dumps(key) + b':'
+        if isinstance(value, list) and len(value) > chunk_items:
+            yield prefix + b'['
+            for start in range(0, len(value), chunk_items):
+                # Each chunk is a JSON array; drop its brackets to splice it into the outer one
+                yield (b',' if start else b'') + dumps(value[start:start + chunk_items])[1:-1]
+            yield b']'
+        else:
+            yield prefix + dumps(value)
+    yield b'}'
+
+
+def should_stream(data: dict) -> bool:
+    """Whether ``data`` has a list longer than ``FUEL_ROUTER_JSON_STREAM_ITEMS`` (0 never streams)."""
+    limit = getattr(settings, 'FUEL_ROUTER_JSON_STREAM_ITEMS', 10000)
+    return bool(limit) and any(isinstance(value, list) and len(value) > limit for value in data.values())
+
+
+def json_response(data: dict, status: int = 200):
+    """Django response encoded with ``dumps``, streamed with ``iter_json`` when it carries a long array."""
+    if should_stream(data):
+        return StreamingHttpResponse(iter_json(data), status=status, content_type='application/json')
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` on orjson; indented output (``Accept: application/json; indent=2``) keeps DRF's path."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not orjson_enabled() or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """``JSONParser`` on orjson; request bodies are UTF-8 as RFC 8259 requires."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not orjson_enabled():
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _use_orjson
+    if setting == 'FUEL_ROUTER_JSON_BACKEND':
+        _use_orjson = None
@@ -0,0 +1,105 @@
+"""
+Exact minimum-cost refuelling along a fixed route (the classic "gas station problem").
+
+Stations are reduced to a milepost along the route and a price per gallon. Fuel can be bought in any amount
+up to the tank capacity, so the cheapest plan follows two rules at every station it stops at:
+
+    1. If a cheaper station is within one tank, buy just enough fuel to reach the nearest one.
+    2. Otherwise fill the tank (or buy just enough to finish) and drive to the cheapest station within reach.
+
+The nearest cheaper station for every station is precomputed with a monotonic stack in O(n), and each fill-up
+scans one tank-length window, so a plan with k stops costs O(n + n·k) after the O(n log n) sort of mileposts.
+
+A minimum purchase is applied by rounding smaller purchases up to it (as far as the tank allows); the extra fuel
+is carried to the next stop. The plan stays feasible but is no longer guaranteed to be the cheapest one.
+"""
+from typing import List, NamedTuple
+
+import numpy as np
+
+
+class Purchase(NamedTuple):
+    station: int  # Position of the station in the arrays passed to the solver
+    milepost: float
+    miles: float  # Range bought, i.e. gallons * mpg
+
+
+class InfeasibleRouteError(ValueError):
+    pass
+
+
+def next_cheaper(prices: np.ndarray) -> np.ndarray:
+    """For every station, the index of the nearest later station with a strictly lower price (or -1)."""
+    result = np.full(len(prices), -1, dtype=np.int64)
+    stack: List[int] = []
+    for i, price in enumerate(prices):
+        while stack and prices[stack[-1]] > price:
+            result[stack.pop()] = i
+        stack.append(i)
+    return result
+
+
+def solve_min_cost(
+        mileposts: np.ndarray,
+        prices: np.ndarray,
+        total_distance: float,
+        tank_range: float,
+        start_range: float,
+        min_purchase: float = 0.0,
+        end_range: float = 0.0
+) -> List[Purchase]:
+    """Cheapest set of purchases that gets from milepost 0 to ``total_distance``.
+
+    ``mileposts`` must be sorted ascending. Ranges are expressed in miles of driving; the caller converts them
+    to gallons, ``min_purchase`` included. The plan arrives at the destination with ``end_range`` left in the
+    tank (plus fuel left over by minimum purchases).
+    """
+    mileposts = np.asarray(mileposts, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    purchases: List[Purchase] = []
+    # Arriving with fuel to spare costs the same as driving that much further past the last station
+    total_distance += end_range
+
+    if total_distance <= start_range:
+        return purchases
+    if not len(mileposts) or mileposts[0] > start_range:
+        raise InfeasibleRouteError('No fuel station reachable with the starting fuel level')
+
+    cheaper = next_cheaper(prices)
+    current = 0
+    fuel = start_range - mileposts[0]
+
+    while True:
+        position = mileposts[current]
+        reach = position + tank_range
+        cheaper_station = cheaper[current]
+
+        if cheaper_station != -1 and mileposts[cheaper_station] <= reach:
+            # Rule 1: top up only as much as the cheaper station needs
+            target = cheaper_station
+            needed = mileposts[target] - position
+        elif total_distance <= reach:
+            # Nothing cheaper before the end of the trip: buy just enough to finish
+            needed = total_distance - position
+            if needed > fuel:
+                purchases.append(Purchase(current, position, _purchase(needed - fuel, fuel, tank_range, min_purchase)))
+            return purchases
+        else:
+            # Rule 2: fill up and move to the cheapest station within one tank
+            window_end = int(np.searchsorted(mileposts, reach, side='right'))
+            if window_end <= current + 1:
+                raise InfeasibleRouteError(f'No fuel station within range of mile {position:.1f}')
+            target = current + 1 + int(np.argmin(prices[current + 1:window_end]))
+            needed = tank_range
+
+        if needed > fuel:
+            miles = _purchase(needed - fuel, fuel, tank_range, min_purchase)
+            purchases.append(Purchase(current, position, miles))
+            fuel += miles
+        fuel -= mileposts[target] - position
+        current = target
+
+
+def _purchase(miles: float, fuel: float, tank_range: float, min_purchase: float) -> float:
+    """Range to buy: ``miles`` raised to the minimum purchase, but never more than the tank holds."""
+    return max(miles, min(min_purchase, tank_range - fuel))
@@ -0,0 +1,179 @@
+"""
+In-process gazetteer for "City, ST" queries.
+
+Most trips start and end at a plain "City, ST", which does not need a Nominatim round trip (rate limited to one
+per second). The gazetteer maps normalized "city, st" names to coordinates: one point per city that has geocoded
+fuel stations (their centroid), overridden by the city centres of the bundled places file. Exact names are a dict
+lookup; a city given without its state is answered from a sorted key list when it names a single city. Anything
+else (street addresses, unknown places, ambiguous names) falls through to the configured geocoder.
+"""
+import bisect
+import csv
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Avg
+
+from .tiered_cache import normalize_query
+
+Point = Tuple[float, float]
+
+DEFAULT_PLACES_FILE = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+COUNTRY_SUFFIXES = (', usa', ', united states', ', us')
+
+STATE_CODES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca', 'colorado': 'co',
+    'connecticut': 'ct', 'delaware': 'de', 'district of columbia': 'dc', 'florida': 'fl', 'georgia': 'ga',
+    'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks',
+    'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma', 'michigan': 'mi',
+    'minnesota': 'mn', 'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv',
+    'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny', 'north carolina': 'nc',
+    'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok', 'oregon': 'or', 'pennsylvania': 'pa',
+    'rhode island': 'ri', 'south carolina': 'sc', 'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx',
+    'utah': 'ut', 'vermont': 'vt', 'virginia': 'va', 'washington': 'wa', 'west virginia': 'wv',
+    'wisconsin': 'wi', 'wyoming': 'wy',
+}
+
+
+def place_key(query: str) -> str:
+    """Normalized form of a place query: lower case, no country suffix, two-letter state code."""
+    key = normalize_query(query)
+    for suffix in COUNTRY_SUFFIXES:
+        if key.endswith(suffix):
+            key = key[:-len(suffix)]
+            break
+    city, _, state = key.rpartition(', ')
+    if city and state in STATE_CODES:
+        key = f'{city}, {STATE_CODES[state]}'
+    return key
+
+
+class Gazetteer:
+    """Exact and city-only lookups over normalized "city, st" names."""
+
+    def __init__(self, places: Dict[str, Point]):
+        self.places = places
+        self.keys: List[str] = sorted(places)
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        # Lookups run concurrently in the geocoding thread pools
+        self._stats_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, float, float]]) -> 'Gazetteer':
+        """Build from (city, state, lat, lon) rows; later rows win over earlier ones for the same place."""
+        return cls({place_key(f'{city}, {state}'): (float(lat), float(lon)) for city, state, lat, lon in rows})
+
+    def lookup(self, query: str) -> Optional[Point]:
+        key = place_key(query)
+        point = self.places.get(key)
+        if point is not None:
+            with self._stats_lock:
+                self.exact_hits += 1
+            return point
+
+        # A bare city name: the keys "<city>, <st>" sort together, so a bisect finds every state that has one
+        if ', ' not in key:
+            prefix = f'{key}, '
+            first = bisect.bisect_left(self.keys, prefix)
+            if first < len(self.keys) and self.keys[first].startswith(prefix) and (
+                    first + 1 == len(self.keys) or not self.keys[first + 1].startswith(prefix)):
+                with self._stats_lock:
+                    self.prefix_hits += 1
+                return self.places[self.keys[first]]
+
+        with self._stats_lock:
+            self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            exact_hits, prefix_hits, misses = self.exact_hits, self.prefix_hits, self.misses
+        lookups = exact_hits + prefix_hits + misses
+        return {
+            'places': len(self.places),
+            'exact_hits': exact_hits,
+            'prefix_hits': prefix_hits,
+            'misses': misses,
+            'hit_ratio': (exact_hits + prefix_hits) / lookups if lookups else 0.0,
+        }
+
+
+def read_places_file(path) -> List[Tuple[str, str, float, float]]:
+    """(city, state, lat, lon) rows of a ``name,state,lat,lon`` CSV file."""
+    with open(path, newline='') as file:
+        return [(row['name'], row['state'], row['lat'], row['lon']) for row in csv.DictReader(file)]
+
+
+def station_places() -> List[Tuple[str, str, float, float]]:
+    """One (city, state, lat, lon) row per city with geocoded fuel stations, at the stations' centroid."""
+    from .models import FuelStation
+
+    return list(
+        FuelStation.objects.exclude(lat=None).exclude(lon=None)
+        .values('city', 'state')
+        .annotate(lat=Avg('lat'), lon=Avg('lon'))
+        .values_list('city', 'state', 'lat', 'lon')
+    )
+
+
+def load_gazetteer() -> Gazetteer:
+    """Gazetteer of the station cities plus the places file (``FUEL_ROUTER_GAZETTEER_FILE``, None to skip it)."""
+    places_file = getattr(settings, 'FUEL_ROUTER_GAZETTEER_FILE', DEFAULT_PLACES_FILE)
+    try:
+        rows = station_places()
+    except DatabaseError:
+        # Not migrated yet
+        rows = []
+    if places_file:
+        rows += read_places_file(places_file)
+    return Gazetteer.from_rows(rows)
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def gazetteer_enabled() -> bool:
+    return getattr(settings, 'FUEL_ROUTER_GAZETTEER', True)
+
+
+def gazetteer_loaded() -> bool:
+    """Whether ``get_gazetteer`` will answer without touching the database."""
+    return _gazetteer is not None or not gazetteer_enabled()
+
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    """Process-wide gazetteer, or None when ``FUEL_ROUTER_GAZETTEER`` is off."""
+    global _gazetteer
+    if not gazetteer_enabled():
+        return None
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer()
+    return _gazetteer
+
+
+def invalidate_gazetteer() -> None:
+    """Rebuild the gazetteer on next use, e.g. after stations in new cities were imported."""
+    global _gazetteer
+    with _gazetteer_lock:
+        _gazetteer = None
+
+
+def preload_gazetteer() -> Optional[Gazetteer]:
+    """Build the gazetteer at startup so the first requests do not pay for it."""
+    return get_gazetteer()
+
+
+def gazetteer_stats() -> Dict[str, float]:
+    return _gazetteer.stats() if _gazetteer is not None else {}
@@ -0,0 +1,81 @@
+from typing import List, Tuple
+
+import numpy as np
+import polyline
+
+from .spatial_index import MILES_PER_DEGREE_LAT
+
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0  # At the equator; scaled by cos(latitude)
+
+
+def simplify(coordinates: List[List[float]], tolerance: float) -> List[List[float]]:
+    """Douglas–Peucker simplification of OSRM-style [lon, lat] coordinates.
+
+    ``tolerance`` is the maximum distance in metres between the original and the simplified line. Distances are
+    measured in a local equirectangular projection, which is accurate to well under a metre at road scales.
+    """
+    if tolerance <= 0 or len(coordinates) < 3:
+        return [list(point) for point in coordinates]
+
+    points = np.asarray(coordinates, dtype=np.float64)
+    scale = np.cos(np.radians(points[:, 1].mean()))
+    xy = np.column_stack((points[:, 0] * METERS_PER_DEGREE_LON * scale, points[:, 1] * METERS_PER_DEGREE_LAT))
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    # Iterative rather than recursive: coast-to-coast routes have tens of thousands of points
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        segment = end - start
+        inner = xy[first + 1:last] - start
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return points[keep].tolist()
+
+
+def encode_polyline(coordinates: List[List[float]], precision: int = 5) -> str:
+    """Google encoded polyline of OSRM-style [lon, lat] coordinates (decoders return (lat, lon) pairs)."""
+    return polyline.encode(coordinates, precision, geojson=True)
+
+
+def route_boxes(
+        coordinates: List[List[float]], width: float, max_boxes: int = 200
+) -> List[Tuple[float, float, float, float]]:
+    """(min_lat, min_lon, max_lat, max_lon) boxes covering everything within ``width`` miles of a route.
+
+    The [lon, lat] route is cut into at most ``max_boxes`` runs of consecutive points and each run's bounding
+    box is grown by ``width``, so a database query stays bounded however detailed the route geometry is.
+    """
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return []
+    step = max(int(np.ceil((len(points) - 1) / max(max_boxes, 1))), 1)
+    lat_delta = width / MILES_PER_DEGREE_LAT
+
+    boxes = []
+    for first in range(0, max(len(points) - 1, 1), step):
+        run = points[first:first + step + 1]
+        min_lat, max_lat = float(run[:, 1].min()), float(run[:, 1].max())
+        # Longitude degrees shrink towards the poles, so widen the box at the widest latitude it spans
+        widest_lat = min(max(abs(min_lat), abs(max_lat)) + lat_delta, 89.0)
+        lon_delta = width / (MILES_PER_DEGREE_LAT * np.cos(np.radians(widest_lat)))
+        boxes.append((
+            min_lat - lat_delta, float(run[:, 0].min()) - lon_delta,
+            max_lat + lat_delta, float(run[:, 0].max()) + lon_delta,
+        ))
+    return boxes
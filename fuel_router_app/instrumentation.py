@@ -0,0 +1,236 @@
+"""
+Per-request timing of the planning hot path.
+
+Code wraps each stage (geocoding, routing, station corridor, optimizer, serialization, ...) in ``stage(name)``
+and bumps counters (distance computations, cache hits, candidate stations) with ``count(name, n)``. Both feed
+the ``Trace`` of the current request, held in a context variable so it follows the request into thread pools
+and ``sync_to_async`` calls, and process-wide histograms and totals rendered by ``render_metrics`` in the
+Prometheus text format. ``server_timing_middleware`` starts a trace per request and reports it in a
+``Server-Timing`` header.
+"""
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.utils.decorators import sync_and_async_middleware
+
+# Seconds; from in-memory cache hits to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Trace:
+    """Stage durations (seconds, summed over repeats) and counters of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name: str, value: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                'stages_ms': {name: round(1000 * seconds, 3) for name, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+                'elapsed_ms': round(1000 * self.elapsed(), 3),
+            }
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value, one metric per stage."""
+        with self._lock:
+            return ', '.join(f'{name};dur={1000 * seconds:.3f}' for name, seconds in self.stages.items())
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label, as Prometheus expects."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, seconds: float) -> None:
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = series
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            total[0] += seconds
+
+    def snapshot(self) -> Dict[str, Tuple[List[int], float]]:
+        with self._lock:
+            return {label: (list(counts), total[0]) for label, (counts, total) in self._series.items()}
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('fuel_router_trace', default=None)
+_stage_seconds = Histogram()
+_counters: Dict[str, float] = {}
+_counters_lock = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def start_trace() -> Iterator[Trace]:
+    """Collect the stages and counters of everything run inside the block (and the threads it hands work to)."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage into the current trace and the process-wide histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        _stage_seconds.observe(name, seconds)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Add to a counter of the current trace and to its process-wide total."""
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + value
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def trace_count(name: str, value: float = 1) -> None:
+    """Add to a counter of the current trace only, for events whose process-wide totals are exported elsewhere."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def propagate(func: Callable) -> Callable:
+    """Bind ``func`` to the caller's context (and so its trace) before handing it to a thread pool."""
+    context = contextvars.copy_context()
+    # A context can only be entered by one thread at a time, and pool.map runs the calls concurrently
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def counter_totals() -> Dict[str, float]:
+    with _counters_lock:
+        return dict(_counters)
+
+
+def _labels(**labels: str) -> str:
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def render_metrics() -> str:
+    """Stage histograms, counters and cache, gazetteer and upstream statistics in the Prometheus text format."""
+    from .gazetteer import gazetteer_stats
+    from .plan_cache import get_plan_cache
+    from .tiered_cache import cache_stats
+    from .upstream import upstream_stats
+
+    lines = [
+        '# HELP fuel_router_stage_seconds Time spent in each stage of route planning.',
+        '# TYPE fuel_router_stage_seconds histogram',
+    ]
+    for name, (counts, total) in sorted(_stage_seconds.snapshot().items()):
+        cumulative = 0
+        for bound, bucket_count in zip(_stage_seconds.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'fuel_router_stage_seconds_bucket{_labels(stage=name, le=repr(bound))} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'fuel_router_stage_seconds_bucket{_labels(stage=name, le="+Inf")} {cumulative}')
+        lines.append(f'fuel_router_stage_seconds_sum{_labels(stage=name)} {total!r}')
+        lines.append(f'fuel_router_stage_seconds_count{_labels(stage=name)} {cumulative}')
+
+    lines += [
+        '# HELP fuel_router_events_total Work done while planning (distance computations, candidate stations, ...).',
+        '# TYPE fuel_router_events_total counter',
+    ]
+    lines += [f'fuel_router_events_total{_labels(event=name)} {value}' for name, value in sorted(counter_totals().items())]
+
+    lines += [
+        '# HELP fuel_router_cache_lookups_total Tiered cache lookups by result.',
+        '# TYPE fuel_router_cache_lookups_total counter',
+    ]
+    for name, stats in sorted(cache_stats().items()):
+        for result in ('local_hits', 'shared_hits', 'misses'):
+            lines.append(f'fuel_router_cache_lookups_total{_labels(cache=name, result=result)} {stats[result]}')
+    lines += [
+        '# HELP fuel_router_plan_cache_coalesced_total Plan requests that waited for an identical one in flight.',
+        '# TYPE fuel_router_plan_cache_coalesced_total counter',
+        f'fuel_router_plan_cache_coalesced_total {get_plan_cache().flights.coalesced}',
+    ]
+
+    lines += [
+        '# HELP fuel_router_gazetteer_lookups_total Lookups in the in-process gazetteer by result.',
+        '# TYPE fuel_router_gazetteer_lookups_total counter',
+    ]
+    gazetteer = gazetteer_stats()
+    lines += [
+        f'fuel_router_gazetteer_lookups_total{_labels(result=result)} {gazetteer[result]}'
+        for result in ('exact_hits', 'prefix_hits', 'misses') if gazetteer
+    ]
+
+    lines += [
+        '# HELP fuel_router_upstream_requests_total Upstream HTTP requests by outcome.',
+        '# TYPE fuel_router_upstream_requests_total counter',
+    ]
+    upstreams = sorted(upstream_stats().items())
+    for name, stats in upstreams:
+        lines.append(f'fuel_router_upstream_requests_total{_labels(upstream=name, outcome="ok")} '
+                     f'{stats["requests"] - stats["errors"]}')
+        lines.append(f'fuel_router_upstream_requests_total{_labels(upstream=name, outcome="error")} {stats["errors"]}')
+        lines.append(f'fuel_router_upstream_requests_total{_labels(upstream=name, outcome="retry")} {stats["retries"]}')
+    lines += [
+        '# HELP fuel_router_upstream_circuit_open Whether the upstream circuit breaker is open (1) or not (0).',
+        '# TYPE fuel_router_upstream_circuit_open gauge',
+    ]
+    lines += [
+        f'fuel_router_upstream_circuit_open{_labels(upstream=name)} {int(stats["circuit"] == "open")}'
+        for name, stats in upstreams
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Trace every request and report its stages in a ``Server-Timing`` header, for sync and async views."""
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with start_trace() as trace:
+                with stage('request'):
+                    response = await get_response(request)
+            response['Server-Timing'] = trace.server_timing()
+            return response
+    else:
+        def middleware(request):
+            with start_trace() as trace:
+                with stage('request'):
+                    response = get_response(request)
+            response['Server-Timing'] = trace.server_timing()
+            return response
+    return middleware
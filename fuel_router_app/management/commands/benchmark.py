@@ -0,0 +1,361 @@
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from fuel_router_app.benchmarks import (
+    compare, end_range, measure, plan_summary, recorded_routes, synthetic_route, synthetic_snapshot, timed
+)
+from fuel_router_app.distance import DISTANCE_MODES, distance
+from fuel_router_app.route_optimizer import OPTIMIZATION_MODES, RouteOptimizer
+
+SUITES = ('solvers', 'distance', 'cache', 'serializer', 'maps', 'e2e', 'coldstart')
+
+# Imported on first use; a cold start that loads them has regressed. (requests is lazy too, but DRF imports it.)
+LAZY_MODULES = ('folium', 'httpx')
+
+# Run in a fresh interpreter: Django setup (with or without the warm-up) and URL conf, as a new worker does
+COLDSTART_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from django.conf import settings
+from django.core.servers.basehttp import get_internal_wsgi_application
+settings.FUEL_ROUTER_PRELOAD_SNAPSHOT = {preload}
+get_internal_wsgi_application()  # Django setup, and the warm-up when enabled, as the server entrypoint does
+set_up = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+loaded = time.perf_counter()
+print(json.dumps({{
+    'setup_ms': 1000 * (set_up - started),
+    'urls_ms': 1000 * (loaded - set_up),
+    'lazy_modules_loaded': [name for name in {lazy_modules!r} if name in sys.modules],
+}}))
+"""
+
+# Gazetteer trips for the end-to-end suite
+E2E_TRIPS = [
+    ('Dallas, TX', 'Chicago, IL'),
+    ('Seattle, WA', 'Denver, CO'),
+    ('Los Angeles, CA', 'New York, NY'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the planning hot path (solvers, distance kernels, caches, serialization, maps, end to end) '
+        'and worker cold start'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', nargs='+', choices=SUITES, default=list(SUITES))
+        parser.add_argument('--stations', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--route-miles', type=float, nargs='+', default=[800, 1600, 2800])
+        parser.add_argument(
+            '--routes-dir',
+            help='Use OSRM responses recorded by OSRMRouter(record_dir=...) instead of synthetic routes'
+        )
+        parser.add_argument('--tank-range', type=float, default=500)
+        parser.add_argument('--mpg', type=float, default=10)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--coldstart-budget-ms', type=float, default=1500,
+            help='Fail when a cold start without warm-up (Django setup and URL conf) takes longer than this'
+        )
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', help='Report timing changes against an earlier JSON report')
+
+    def handle(self, *args, **options):
+        self.client, self.async_client = Client(), AsyncClient()
+        self.routes = self.load_routes(options)
+        results = {
+            'meta': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'options': {key: options[key] for key in ('suite', 'stations', 'tank_range', 'mpg', 'repeat')},
+                'route_miles': [round(miles, 1) for _, miles in self.routes],
+            }
+        }
+        for suite in options['suite']:
+            results[suite] = getattr(self, f'bench_{suite}')(options)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                results['comparison'] = compare(json.load(file), results)
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report)
+        else:
+            self.stdout.write(report)
+
+        for row in results.get('coldstart', []):
+            if row.get('over_budget'):
+                raise CommandError(
+                    f"Cold start ({row['case']}) took {row['median_ms']} ms, over the "
+                    f"{options['coldstart_budget_ms']} ms budget"
+                )
+
+    def load_routes(self, options):
+        if options['routes_dir']:
+            routes = recorded_routes(options['routes_dir'])
+            if not routes:
+                raise CommandError(f"No recorded routes in {options['routes_dir']}")
+            return routes
+        return [synthetic_route(length, seed=seed) for seed, length in enumerate(options['route_miles'])]
+
+    def bench_solvers(self, options):
+        """Cost and runtime of every optimization mode on the same routes and station tables."""
+        optimizer = RouteOptimizer()
+        tank_range, mpg = options['tank_range'], options['mpg']
+        rows = []
+
+        for size in options['stations']:
+            snapshot = synthetic_snapshot(size)
+            snapshot.index  # Build outside the timed section, as a long-running process would
+            for coordinates, total_distance in self.routes:
+                start = (coordinates[0][1], coordinates[0][0])
+                end = (coordinates[-1][1], coordinates[-1][0])
+                row = {'stations': size, 'route_miles': round(total_distance, 1)}
+                plans = {}
+
+                for mode in OPTIMIZATION_MODES:
+                    timings = []
+                    for _ in range(options['repeat']):
+                        try:
+                            plan, elapsed = timed(
+                                optimizer.plan_fuel_stops, start, end, coordinates, total_distance,
+                                tank_range, mpg, optimization=mode, snapshot=snapshot
+                            )
+                        except ValueError as e:
+                            row[mode] = {'error': str(e)}
+                            break
+                        timings.append(elapsed)
+                    else:
+                        plans[mode] = plan
+                        row[mode] = dict(plan_summary(plan, tank_range, mpg), ms=round(statistics.median(timings), 2))
+
+                greedy = plans.get('greedy')
+                if greedy and greedy['total_cost'] and 'min_cost' in plans:
+                    # Greedy stops fill the tank, so it arrives with fuel to spare; compare against the cheapest
+                    # plan that arrives with as much, not one that arrives empty
+                    arrival = min(max(end_range(greedy, tank_range, mpg), 0.0), tank_range)
+                    try:
+                        plan = optimizer.find_min_cost_fuel_stops(
+                            coordinates, total_distance, tank_range, mpg, snapshot=snapshot, end_range=arrival
+                        )
+                    except ValueError as e:
+                        row['min_cost_same_end'] = {'error': str(e)}
+                    else:
+                        row['min_cost_same_end'] = plan_summary(plan, tank_range, mpg)
+                        row['savings_pct'] = round(100 * (1 - plan['total_cost'] / greedy['total_cost']), 2)
+                rows.append(row)
+        return rows
+
+    def bench_distance(self, options):
+        """Per-call cost of ``calculate_distance`` and per-pair cost of the vectorized kernels."""
+        optimizer = RouteOptimizer()
+        rows = []
+        for mode in DISTANCE_MODES:
+            with override_settings(FUEL_ROUTER_DISTANCE_MODE=mode):
+                scalar = measure(
+                    lambda: optimizer.calculate_distance((34.05, -118.24), (40.71, -74.0)),
+                    repeat=options['repeat'], number=1000
+                )
+            rows.append(dict(scalar, case=f'calculate_distance:{mode}'))
+
+            for size in options['stations']:
+                snapshot = synthetic_snapshot(size)
+                vectorized = measure(
+                    lambda: distance(39.0, -98.0, snapshot.lats, snapshot.lons, mode=mode), repeat=options['repeat']
+                )
+                rows.append(dict(
+                    vectorized, case=f'vectorized:{mode}', stations=size,
+                    ns_per_pair=round(vectorized['median_ms'] * 1e6 / size, 2),
+                ))
+        return rows
+
+    def bench_cache(self, options):
+        """Lookups per tier of the tiered cache, plus key hashing."""
+        from fuel_router_app.tiered_cache import LRUCache, TieredCache, query_key
+
+        lru = LRUCache(max_size=1024)
+        keys = [query_key(f'{i} Main St, Springfield, IL') for i in range(2048)]
+        tiered = TieredCache('benchmark', ttl=60, local_size=1024, shared_alias='default')
+        for key in keys[:1024]:
+            lru.set(key, (1.0, 2.0), ttl=60)
+            tiered.set(key, (1.0, 2.0))
+        missing = keys[1024:]
+
+        number = 2000
+        return [
+            dict(measure(lambda: query_key('Los Angeles, CA, USA'), options['repeat'], number), case='query_key'),
+            dict(measure(lambda: lru.get(keys[7]), options['repeat'], number), case='lru_hit'),
+            dict(measure(lambda: lru.set(missing[0], (1.0, 2.0), ttl=60), options['repeat'], number), case='lru_set'),
+            dict(measure(lambda: tiered.get(keys[7]), options['repeat'], number), case='tiered_local_hit'),
+            dict(measure(lambda: tiered.shared.get(tiered._shared_key(keys[7])), options['repeat'], number),
+                 case='tiered_shared_hit (locmem)'),
+            dict(measure(lambda: tiered.get(missing[1]), options['repeat'], number), case='tiered_miss (locmem)'),
+        ]
+
+    def bench_serializer(self, options):
+        """Time and payload size of the plan-route response for each geometry format, with DRF's and the fast renderer."""
+        from rest_framework.renderers import JSONRenderer
+        from fuel_router_app.fast_json import FastJSONRenderer
+        from fuel_router_app.geometry import encode_polyline, simplify
+        from fuel_router_app.serializers import RouteResponseSerializer
+
+        coordinates, total_distance = self.routes[-1]
+        plan = RouteOptimizer().plan_fuel_stops(
+            (coordinates[0][1], coordinates[0][0]), (coordinates[-1][1], coordinates[-1][0]), coordinates,
+            total_distance, options['tank_range'], options['mpg'], snapshot=synthetic_snapshot(options['stations'][0])
+        )
+        base = {
+            'route_id': 'benchmark', 'fuel_stops': plan['fuel_stops'], 'total_cost': round(plan['total_cost'], 4),
+            'total_distance': total_distance, 'vehicle': {}, 'map_url': 'http://localhost/api/maps/benchmark/',
+        }
+        cases = {
+            'coordinates': lambda: dict(base, route_coordinates=coordinates),
+            'coordinates_simplified_25m': lambda: dict(base, route_coordinates=simplify(coordinates, 25.0)),
+            'polyline': lambda: dict(base, route_polyline=encode_polyline(coordinates)),
+            'none': lambda: dict(base),
+        }
+
+        rows = []
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            for case, build in cases.items():
+                data = RouteResponseSerializer(build()).data
+                rows.append(dict(
+                    measure(lambda: renderer.render(RouteResponseSerializer(build()).data), options['repeat']),
+                    case=case, renderer=type(renderer).__name__, points=len(coordinates),
+                    bytes=len(renderer.render(data)),
+                ))
+        return rows
+
+    def bench_maps(self, options):
+        """Rendering the folium map of the longest route (done on demand by /api/maps/<route_id>/)."""
+        from fuel_router_app.geometry import simplify
+        from fuel_router_app.maps import generate_map
+
+        coordinates, total_distance = self.routes[-1]
+        plan = RouteOptimizer().plan_fuel_stops(
+            (coordinates[0][1], coordinates[0][0]), (coordinates[-1][1], coordinates[-1][0]), coordinates,
+            total_distance, options['tank_range'], options['mpg'], snapshot=synthetic_snapshot(options['stations'][0])
+        )
+        simplified = simplify(coordinates, 25.0)
+        return [
+            dict(measure(lambda: simplify(coordinates, 25.0), options['repeat']), case='simplify_25m',
+                 points=len(coordinates), simplified_points=len(simplified)),
+            dict(measure(lambda: generate_map(simplified, plan['fuel_stops']), options['repeat']), case='generate_map',
+                 html_bytes=len(generate_map(simplified, plan['fuel_stops']))),
+        ]
+
+    def bench_e2e(self, options):
+        """Latency of POST /api/plan-route/ through the Django test client, with offline backends and no database."""
+        from fuel_router_app.station_snapshot import override_snapshot
+
+        offline = override_settings(
+            FUEL_ROUTER_GEOCODER={'BACKEND': 'fuel_router_app.backends.GazetteerGeocoder'},
+            FUEL_ROUTER_ROUTER={'BACKEND': 'fuel_router_app.backends.SyntheticRouter'},
+            FUEL_ROUTER_SHARED_CACHE=None,
+            ALLOWED_HOSTS=['testserver'],
+        )
+        rows = []
+        with offline:
+            for size in options['stations']:
+                snapshot = synthetic_snapshot(size)
+                snapshot.index
+                with override_snapshot(snapshot):
+                    for mode in OPTIMIZATION_MODES:
+                        for url in ('/api/plan-route/', '/api/plan-route/async/'):
+                            error = self.post_trips(url, mode, cold=True)
+                            if error:
+                                rows.append({'case': f'{url} {mode}', 'stations': size, 'error': error})
+                                continue
+                            for cold in (True, False):
+                                timing = measure(lambda: self.post_trips(url, mode, cold), options['repeat'])
+                                rows.append({
+                                    'case': f"{url} {mode} {'cold' if cold else 'cached'}",
+                                    'stations': size,
+                                    'median_ms': round(timing['median_ms'] / len(E2E_TRIPS), 3),
+                                    'min_ms': round(timing['min_ms'] / len(E2E_TRIPS), 3),
+                                })
+        return rows
+
+    def bench_coldstart(self, options):
+        """Startup of a fresh worker process, without and with the warm-up, and its slowest imports."""
+        rows = []
+        for case, preload in (('imports', False), ('warm_up', True)):
+            runs = [self.start_process(preload) for _ in range(options['repeat'])]
+            totals = [run['setup_ms'] + run['urls_ms'] + run['interpreter_ms'] for run in runs]
+            row = {
+                'case': case,
+                'median_ms': round(statistics.median(totals), 1),
+                'min_ms': round(min(totals), 1),
+                'setup_ms': round(statistics.median(run['setup_ms'] for run in runs), 1),
+                'urls_ms': round(statistics.median(run['urls_ms'] for run in runs), 1),
+                'lazy_modules_loaded': runs[0]['lazy_modules_loaded'],
+            }
+            if not preload:
+                row['budget_ms'] = options['coldstart_budget_ms']
+                row['over_budget'] = row['median_ms'] > options['coldstart_budget_ms']
+                row['slowest_imports'] = self.slowest_imports()
+            rows.append(row)
+        return rows
+
+    def start_process(self, preload, *flags):
+        """Run ``COLDSTART_SCRIPT`` in a new interpreter; its timings plus the interpreter's own startup."""
+        script = COLDSTART_SCRIPT.format(preload=preload, lazy_modules=LAZY_MODULES)
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, *flags, '-c', script], capture_output=True, text=True, env=os.environ.copy()
+        )
+        elapsed = 1000 * (time.perf_counter() - started)
+        if process.returncode:
+            raise CommandError(f'Cold start failed:\n{process.stderr}')
+        run = json.loads(process.stdout.strip().splitlines()[-1])
+        run['interpreter_ms'] = max(elapsed - run['setup_ms'] - run['urls_ms'], 0.0)
+        run['stderr'] = process.stderr
+        return run
+
+    def slowest_imports(self, count=10):
+        """Top-level imports of a cold start by cumulative time (``python -X importtime``)."""
+        imports = []
+        for line in self.start_process(False, '-X', 'importtime')['stderr'].splitlines():
+            match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+            # Nested imports are indented under the one that triggered them
+            if match and not match.group(2):
+                imports.append((int(match.group(1)), match.group(3)))
+        return [{'module': module, 'ms': round(us / 1000, 1)} for us, module in sorted(imports, reverse=True)[:count]]
+
+    def post_trips(self, url, optimization, cold):
+        """POST every ``E2E_TRIPS`` trip; ``cold`` empties the in-process caches first. Returns the first error."""
+        from fuel_router_app.tiered_cache import get_cache
+
+        if cold:
+            for name in ('geocode', 'route', 'plan'):
+                get_cache(name).clear()
+        for start, end in E2E_TRIPS:
+            body = {'start': start, 'end': end, 'optimization': optimization, 'geometry_format': 'polyline'}
+            if url.endswith('/async/'):
+                response = async_to_sync(self.apost)(url, body)
+            else:
+                response = self.client.post(url, body, content_type='application/json')
+            if response.status_code != 200:
+                return response.json().get('error', response.status_code)
+        return None
+
+    async def apost(self, url, body):
+        return await self.async_client.post(url, body, content_type='application/json')
@@ -1,85 +1,154 @@
 import csv
+import json
+import os
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from fuel_router_app.models import FuelStation
+from django.db import transaction
+from fuel_router_app.models import FuelStation, StationDataVersion
+from fuel_router_app.route_optimizer import geocode_ttl
+from fuel_router_app.tiered_cache import MISSING, get_cache, query_key
+from fuel_router_app.backends import get_geocoder
+from fuel_router_app.upstream import UpstreamError
 
 
 class Command(BaseCommand):
     help = 'Import fuel stations from CSV file in batches'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=str(settings.BASE_DIR / 'fuel-prices-for-be-assessment.csv'))
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows geocoded and inserted per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Concurrent geocoding requests (the Nominatim rate limit still applies to the public server)'
+        )
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / '.import_stations.checkpoint.json'))
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first row')
+
     def handle(self, *args, **options):
-        base_dir = settings.BASE_DIR
-        fuel_prices_csv = base_dir / 'fuel-prices-for-be-assessment.csv'
+        fuel_prices_csv = options['file']
+        checkpoint_path = options['checkpoint']
+        start_row = 0 if options['restart'] else self.load_checkpoint(checkpoint_path, fuel_prices_csv)
+        if start_row:
+            print(f"Resuming from row {start_row}")
+
+        # One query for every id already imported instead of an exists() query per row
+        self.known_ids = set(FuelStation.objects.values_list('opis_id', flat=True))
+        self.geocode_cache = get_cache('geocode')
+        started = time.perf_counter()
+        imported = 0
+        row_number = start_row
 
-        with open(fuel_prices_csv, mode='r') as file:
+        with open(fuel_prices_csv, mode='r') as file, ThreadPoolExecutor(max_workers=options['workers']) as pool:
             reader = csv.DictReader(file)
-            start = 0
-            limit = 100
+            rows = islice(reader, start_row, None)
             while True:
-                print(f"processing rows from: {start*limit}")
-                batch = list(islice(reader, limit))  # Read 100 rows at a time
+                batch = list(islice(rows, options['batch_size']))
                 if not batch:
                     break
-                
-                self.process_batch(batch)
-                start+=1
 
-    def process_batch(self, batch):
+                print(f"processing rows from: {row_number}")
+                imported += self.process_batch(batch, pool)
+                row_number += len(batch)
+                self.save_checkpoint(checkpoint_path, fuel_prices_csv, row_number)
+
+                elapsed = time.perf_counter() - started
+                print(f"{row_number - start_row} rows in {elapsed:.1f}s ({(row_number - start_row) / elapsed:.1f} rows/sec)")
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        print(f"Imported {imported} fuel stations successfully.")
+
+    def process_batch(self, batch, pool):
+        """Geocode the new rows of a batch (each distinct address once) and insert them in one transaction."""
+        pending = []
         for stop in batch:
-            if FuelStation.objects.filter(opis_id=stop["OPIS Truckstop ID"]).exists():
-                print("Id already exists")
+            opis_id = int(stop['OPIS Truckstop ID'])
+            if opis_id in self.known_ids:
                 continue
-            
-            print(f"process shop : {stop['OPIS Truckstop ID']}")
-            formatted_location = stop['Address'].replace("EXIT", "").replace("&", "and").replace("  ", " ").strip()
-            lat, lon = None, None
-
-            for attempt in [
-                f"{formatted_location}, {stop['City']}, {stop['State']}, USA",
-                f"{stop['Address'].replace('EXIT', '').strip()}, {stop['City']}, {stop['State']}, USA",
-                f"{stop['City']}, {stop['State']}, USA"
-            ]:
-                lat, lon = self.geocode_location(attempt)
-                if lat and lon:
-                    break  # Exit once valid coordinates are found
-
-            if lat is not None and lon is not None:
-                FuelStation.objects.create(
-                    opis_id=stop['OPIS Truckstop ID'],
-                    name=stop['Truckstop Name'],
-                    address=stop['Address'],
-                    city=stop['City'],
-                    state=stop['State'],
-                    rack_id=stop['Rack ID'],
-                    lat=lat,
-                    lon=lon,
-                    retail_price=stop['Retail Price'],
-                )
-                
-            else:
-                print(f"Failed to geocode location: {formatted_location}")
-
-        print(f"Imported fuel stations successfully.")
+            self.known_ids.add(opis_id)
+            pending.append((stop, self.location_attempts(stop)))
 
-    def geocode_location(self, location):
-        url = 'https://nominatim.openstreetmap.org/search'
-        params = {
-            'q': location,
-            'format': 'json',
-            'limit': 10,
-            'countrycodes': 'us'
-        }
-        headers = {'User-Agent': 'RouteOptimizer/1.0'}
+        coordinates = {}
+        # Try each fallback level for the rows still unresolved, deduplicating the queries across the batch
+        for level in range(3):
+            queries = {attempts[level] for stop, attempts in pending
+                       if not coordinates.get(stop['OPIS Truckstop ID'])}
+            results = dict(zip(queries, pool.map(self.cached_geocode, queries)))
+            for stop, attempts in pending:
+                if not coordinates.get(stop['OPIS Truckstop ID']):
+                    lat, lon = results[attempts[level]]
+                    if lat and lon:
+                        coordinates[stop['OPIS Truckstop ID']] = (lat, lon)
+
+        stations = []
+        for stop, attempts in pending:
+            if stop['OPIS Truckstop ID'] not in coordinates:
+                print(f"Failed to geocode location: {attempts[0]}")
+                continue
+            lat, lon = coordinates[stop['OPIS Truckstop ID']]
+            stations.append(FuelStation(
+                opis_id=stop['OPIS Truckstop ID'],
+                name=stop['Truckstop Name'],
+                address=stop['Address'],
+                city=stop['City'],
+                state=stop['State'],
+                rack_id=stop['Rack ID'],
+                lat=lat,
+                lon=lon,
+                retail_price=stop['Retail Price'],
+            ))
+
+        if stations:
+            with transaction.atomic():
+                FuelStation.objects.bulk_create(stations)
+                # bulk_create skips model signals, so invalidate in-process station snapshots explicitly
+                StationDataVersion.bump()
+        return len(stations)
+
+    def location_attempts(self, stop):
+        formatted_location = stop['Address'].replace("EXIT", "").replace("&", "and").replace("  ", " ").strip()
+        return [
+            f"{formatted_location}, {stop['City']}, {stop['State']}, USA",
+            f"{stop['Address'].replace('EXIT', '').strip()}, {stop['City']}, {stop['State']}, USA",
+            f"{stop['City']}, {stop['State']}, USA"
+        ]
+
+    def cached_geocode(self, location):
+        """Geocode through the persistent shared geocode cache; transient failures are not cached."""
+        key = query_key(location)
+        cached = self.geocode_cache.get(key)
+        if cached is not MISSING:
+            return cached
         try:
-            response = requests.get(url, params=params, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            if data:
-                for result in data:
-                    if 'lat' in result and 'lon' in result:
-                        return float(result['lat']), float(result['lon'])
-        except requests.RequestException as e:
+            result = self.geocode_location(location)
+        except (requests.RequestException, UpstreamError, ValueError) as e:
             print(f"Geocoding request failed: {e}")
-        return None, None
\ No newline at end of file
+            return None, None
+        # Misses expire after the short geocode_miss TTL, like the planner's, so a later import retries them
+        self.geocode_cache.set(key, result, ttl=geocode_ttl(result))
+        return result
+
+    def geocode_location(self, location):
+        # Configured geocoder (Nominatim by default: pooled connection, timeouts, retries and its 1 req/s limit)
+        return get_geocoder().geocode(location)
+
+    def load_checkpoint(self, path, fuel_prices_csv):
+        """Row to resume from, if the checkpoint was written for the same CSV file."""
+        if not os.path.exists(path):
+            return 0
+        with open(path) as file:
+            checkpoint = json.load(file)
+        if checkpoint.get('file') != os.path.abspath(fuel_prices_csv):
+            return 0
+        return checkpoint.get('next_row', 0)
+
+    def save_checkpoint(self, path, fuel_prices_csv, next_row):
+        # Write-then-rename so an interrupted run never leaves a truncated checkpoint
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'file': os.path.abspath(fuel_prices_csv), 'next_row': next_row}, file)
+        os.replace(tmp_path, path)
@@ -0,0 +1,65 @@
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from fuel_router_app.models import FuelStation, StationDataVersion
+
+PRICE_PLACES = Decimal('0.001')  # FuelStation.retail_price has 3 decimal places
+
+
+class Command(BaseCommand):
+    help = 'Update retail prices of already imported fuel stations from CSV file (no geocoding)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=str(settings.BASE_DIR / 'fuel-prices-for-be-assessment.csv'))
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per UPDATE batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        # One query for every stored price, keyed like the CSV
+        stored = {
+            opis_id: (pk, retail_price)
+            for pk, opis_id, retail_price in FuelStation.objects.values_list('pk', 'opis_id', 'retail_price')
+        }
+
+        changed, seen = {}, set()
+        rows = unknown = invalid = 0
+        with open(options['file'], mode='r') as file:
+            for row in csv.DictReader(file):
+                rows += 1
+                opis_id = int(row['OPIS Truckstop ID'])
+                # The first row of a station wins, as in import_stations
+                if opis_id in seen:
+                    continue
+                seen.add(opis_id)
+
+                if opis_id not in stored:
+                    unknown += 1
+                    continue
+                try:
+                    price = Decimal(row['Retail Price']).quantize(PRICE_PLACES)
+                except InvalidOperation:
+                    invalid += 1
+                    continue
+
+                pk, current_price = stored[opis_id]
+                if price != current_price:
+                    changed[pk] = price
+
+        print(f"Read {rows} rows: {len(changed)} price changes, {unknown} stations not imported yet, {invalid} invalid prices")
+
+        if changed and not options['dry_run']:
+            stations = [FuelStation(pk=pk, retail_price=price) for pk, price in changed.items()]
+            with transaction.atomic():
+                FuelStation.objects.bulk_update(stations, ['retail_price'], batch_size=options['batch_size'])
+                # bulk_update skips model signals, so invalidate station snapshots and cached plans explicitly
+                StationDataVersion.bump()
+
+        action = 'Would update' if options['dry_run'] else 'Updated'
+        print(f"{action} {len(changed)} fuel station prices in {time.perf_counter() - started:.2f}s.")
+        if unknown:
+            print("Run import_stations to add the stations that are not imported yet.")
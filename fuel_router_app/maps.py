@@ -0,0 +1,93 @@
+"""
+On-demand route maps.
+
+Planning a route only stores a simplified copy of its geometry and fuel stops under a route id. The folium map is
+rendered the first time ``/api/maps/<route_id>/`` is requested and the HTML is cached under the same id, so the
+JSON endpoints never pay for rendering and concurrent requests never share an output file.
+"""
+import uuid
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from .geometry import simplify
+from .instrumentation import stage
+from .tiered_cache import MISSING, get_cache
+
+
+def store_route(coordinates: List[List[float]], fuel_stops: List[Dict]) -> str:
+    """Keep what the map needs for a planned route and return the id to render it with."""
+    route_id = uuid.uuid4().hex
+    tolerance = getattr(settings, 'FUEL_ROUTER_MAP_SIMPLIFY_METERS', 25.0)
+    get_cache('map_route').set(route_id, {
+        'geometry': simplify(coordinates, tolerance),
+        'fuel_stops': fuel_stops,
+    })
+    return route_id
+
+
+def get_map_html(route_id: str) -> Optional[str]:
+    """Rendered map for a stored route, or None if the id is unknown or expired."""
+    html_cache = get_cache('map_html')
+    html = html_cache.get(route_id)
+    if html is not MISSING:
+        return html
+
+    route = get_cache('map_route').get(route_id)
+    if route is MISSING:
+        return None
+
+    with stage('map_render'):
+        html = generate_map(route['geometry'], route['fuel_stops'])
+    html_cache.set(route_id, html)
+    return html
+
+
+def generate_map(coordinates, fuel_stops):
+    # folium takes longer to import than the rest of the app; only workers that render a map pay for it
+    import folium
+    from folium.plugins import MarkerCluster
+
+    # Create map centered on route with Google Satellite view tile layer
+    map_center = coordinates[len(coordinates) // 2]
+    m = folium.Map(location=[map_center[1], map_center[0]], zoom_start=14)
+
+    # Add route with a smoother Polyline
+    folium.PolyLine(
+        [(lat, lon) for lon, lat in coordinates],
+        weight=5,
+        color='blue',
+        opacity=0.7
+    ).add_to(m)
+
+    # Marker Cluster for fuel stops
+    marker_cluster = MarkerCluster().add_to(m)
+
+    # Start marker (Green marker for start point)
+    start_point = coordinates[0]  # First point in coordinates
+    folium.Marker(
+        [start_point[1], start_point[0]],
+        tooltip="Start",
+        popup="This is the start point!",
+        icon=folium.Icon(color='green', icon='play')
+    ).add_to(m)
+
+    # Stop marker (Red marker for stop point)
+    stop_point = coordinates[-1]  # Last point in coordinates
+    folium.Marker(
+        [stop_point[1], stop_point[0]],
+        tooltip="End",
+        popup="This is the stop point!",
+        icon=folium.Icon(color='red', icon='stop')
+    ).add_to(m)
+
+    # Add fuel stops
+    for stop in fuel_stops:
+        folium.Marker(
+            [stop['location']['lat'], stop['location']['lng']],
+            tooltip=stop['name'],
+            popup=f"{stop['name']}<br>Price: ${stop['price']}/gal",
+            icon=folium.Icon(color='blue', icon='fa-gas-pump', prefix='fa')
+        ).add_to(marker_cluster)
+
+    return m._repr_html_()
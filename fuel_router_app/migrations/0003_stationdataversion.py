@@ -0,0 +1,24 @@
+# Generated by Django 3.2.23 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuel_router_app', '0002_alter_fuelstation_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StationDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'route_stationdataversion',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.23 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuel_router_app', '0003_stationdataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('tank_gallons', models.FloatField()),
+                ('mpg', models.FloatField()),
+                ('start_fuel', models.FloatField(default=1.0, help_text='Fraction of the tank that is full at departure')),
+                ('reserve', models.FloatField(default=0.0, help_text='Fraction of the tank the plan never dips into')),
+                ('min_purchase', models.FloatField(default=0.0, help_text='Smallest fill-up in gallons')),
+            ],
+            options={
+                'db_table': 'route_vehicleprofile',
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import OperationalError, migrations
+
+RTREE_TABLE = 'route_fuelstation_rtree'
+
+FORWARD_SQL = [
+    # R*Tree coordinates are 32-bit floats rounded outwards, so lookups may return a few stations just outside a
+    # box but never miss one inside it
+    f'CREATE VIRTUAL TABLE {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)',
+    f'''INSERT INTO {RTREE_TABLE}
+        SELECT id, lat, lat, lon, lon FROM route_fuelstation WHERE lat IS NOT NULL AND lon IS NOT NULL''',
+    f'''CREATE TRIGGER {RTREE_TABLE}_insert AFTER INSERT ON route_fuelstation
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+            INSERT INTO {RTREE_TABLE} VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END''',
+    f'''CREATE TRIGGER {RTREE_TABLE}_update AFTER UPDATE OF id, lat, lon ON route_fuelstation
+        BEGIN
+            DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+            INSERT INTO {RTREE_TABLE}
+                SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END''',
+    f'''CREATE TRIGGER {RTREE_TABLE}_delete AFTER DELETE ON route_fuelstation
+        BEGIN
+            DELETE FROM {RTREE_TABLE} WHERE id = OLD.id;
+        END''',
+]
+
+REVERSE_SQL = [
+    f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_update',
+    f'DROP TRIGGER IF EXISTS {RTREE_TABLE}_delete',
+    f'DROP TABLE IF EXISTS {RTREE_TABLE}',
+]
+
+
+def has_rtree_module(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE VIRTUAL TABLE temp.rtree_probe USING rtree(id, min_x, max_x)')
+            cursor.execute('DROP TABLE temp.rtree_probe')
+    except OperationalError:
+        return False
+    return True
+
+
+def create_rtree(apps, schema_editor):
+    # Other databases (and SQLite builds without R*Tree) fall back to lat/lon range filters
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or not has_rtree_module(connection):
+        return
+    for statement in FORWARD_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in REVERSE_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fuel_router_app', '0004_vehicleprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
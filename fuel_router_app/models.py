@@ -1,4 +1,66 @@
-from django.db import models
+from typing import Iterable, List, Sequence, Tuple
+
+from django.db import connections, models, transaction
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from .geometry import route_boxes
+from .vehicle import Vehicle
+
+# SQLite R*Tree over station coordinates, kept in sync with route_fuelstation by triggers (migration 0005)
+STATION_RTREE_TABLE = 'route_fuelstation_rtree'
+
+Box = Tuple[float, float, float, float]  # (min_lat, min_lon, max_lat, max_lon)
+
+
+class FuelStationQuerySet(models.QuerySet):
+    """Spatial lookups answered by the database, for processes that do not hold the whole station table."""
+
+    def in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> 'FuelStationQuerySet':
+        return self.in_boxes([(min_lat, min_lon, max_lat, max_lon)])
+
+    def in_boxes(self, boxes: Iterable[Box]) -> 'FuelStationQuerySet':
+        """Stations inside any of the boxes, in one query (an R*Tree lookup per box on SQLite)."""
+        boxes = list(boxes)
+        if not boxes:
+            return self.none()
+        if has_station_rtree(self.db):
+            # One SELECT per box: SQLite answers each from the R*Tree, while an OR of boxes in a subquery scans it
+            select = (
+                f'SELECT id FROM {STATION_RTREE_TABLE} '
+                'WHERE max_lat >= %s AND min_lat <= %s AND max_lon >= %s AND min_lon <= %s'
+            )
+            params = [value for min_lat, min_lon, max_lat, max_lon in boxes for value in (min_lat, max_lat, min_lon, max_lon)]
+            return self.filter(pk__in=RawSQL(' UNION '.join([select] * len(boxes)), params))
+
+        condition = Q()
+        for min_lat, min_lon, max_lat, max_lon in boxes:
+            condition |= Q(lat__range=(min_lat, max_lat), lon__range=(min_lon, max_lon))
+        return self.filter(condition)
+
+    def near_route(self, route_coordinates: List[List[float]], width: float, max_boxes: int = 200) -> 'FuelStationQuerySet':
+        """A superset of the stations within ``width`` miles of a [lon, lat] route, from its segment boxes."""
+        return self.in_boxes(route_boxes(route_coordinates, width, max_boxes))
+
+    def near_routes(self, routes: Sequence[List[List[float]]], width: float, max_boxes: int = 200) -> 'FuelStationQuerySet':
+        """``near_route`` for several routes in one query, sharing the ``max_boxes`` budget between them."""
+        per_route = max(max_boxes // max(len(routes), 1), 1)
+        return self.in_boxes([box for route in routes for box in route_boxes(route, width, per_route)])
+
+
+_rtree_aliases = {}
+
+
+def has_station_rtree(using: str = 'default') -> bool:
+    """Whether the database has the station R*Tree (SQLite built with R*Tree support, migrated)."""
+    available = _rtree_aliases.get(using)
+    if available is None:
+        connection = connections[using]
+        available = connection.vendor == 'sqlite' and STATION_RTREE_TABLE in connection.introspection.table_names()
+        # Only remember a positive answer, so a database migrated after start-up is picked up
+        if available:
+            _rtree_aliases[using] = available
+    return available
+
 
 class FuelStation(models.Model):
     opis_id = models.IntegerField(unique=True)
@@ -11,8 +73,60 @@ class FuelStation(models.Model):
     lat = models.FloatField(null=True)
     lon = models.FloatField(null=True)
 
+    objects = FuelStationQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} - {self.city}, {self.state}"
     
     class Meta:
-        db_table = 'route_fuelstation'
\ No newline at end of file
+        db_table = 'route_fuelstation'
+
+
+class StationDataVersion(models.Model):
+    """Single-row counter bumped whenever station rows or prices change.
+
+    Every process compares it with the version of its in-memory station snapshot to know when to reload.
+    """
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'route_stationdataversion'
+
+    @classmethod
+    def current(cls) -> int:
+        version = cls.objects.filter(pk=1).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def bump(cls) -> int:
+        with transaction.atomic():
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(version=F('version') + 1)
+        return cls.current()
+
+
+class VehicleProfile(models.Model):
+    """Named vehicle type that plan requests can refer to instead of spelling out its fuel parameters."""
+    name = models.CharField(max_length=100, unique=True)
+    tank_gallons = models.FloatField()
+    mpg = models.FloatField()
+    start_fuel = models.FloatField(default=1.0, help_text='Fraction of the tank that is full at departure')
+    reserve = models.FloatField(default=0.0, help_text='Fraction of the tank the plan never dips into')
+    min_purchase = models.FloatField(default=0.0, help_text='Smallest fill-up in gallons')
+
+    def __str__(self):
+        return f"{self.name} ({self.tank_gallons:g} gal, {self.mpg:g} mpg)"
+
+    class Meta:
+        db_table = 'route_vehicleprofile'
+
+    def as_vehicle(self) -> Vehicle:
+        return Vehicle(
+            tank_gallons=self.tank_gallons,
+            mpg=self.mpg,
+            start_fuel=self.start_fuel,
+            reserve=self.reserve,
+            min_purchase=self.min_purchase,
+            name=self.name,
+        )
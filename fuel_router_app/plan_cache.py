@@ -0,0 +1,139 @@
+"""
+Cache of complete route plans (geocoding, OSRM route, fuel stops and map id) for repeated trips.
+
+Plans are keyed by the normalized start/end queries, the vehicle and optimizer parameters and the station data
+version of the snapshot they were computed from, so a price or station change makes every older plan unreachable
+without an explicit purge. Concurrent misses for the same key are coalesced: one request computes the plan and
+the others wait for its result.
+"""
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from .tiered_cache import MISSING, TieredCache, get_cache, normalize_query
+
+
+def plan_key(start: str, end: str, version: int, **params) -> str:
+    """Key of a plan; ``params`` are the vehicle and optimizer settings it was computed with."""
+    parts = [normalize_query(start), normalize_query(end), f'v{version}']
+    for name in sorted(params):
+        value = params[name]
+        # 500 and 500.0 are the same tank range
+        parts.append(f'{name}={float(value)!r}' if isinstance(value, (int, float)) else f'{name}={value}')
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; callers arriving meanwhile share its result or error."""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Async ``do``; coalesces callers running on the same event loop."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._async_calls[flight_key] = loop.create_future()
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here so an error nobody else awaited is not logged as unhandled
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._async_calls[flight_key]
+
+
+class PlanCache:
+    def __init__(self, name: str = 'plan'):
+        self.name = name
+        self.flights = SingleFlight()
+
+    @property
+    def cache(self) -> TieredCache:
+        return get_cache(self.name)
+
+    def get_or_plan(self, key: str, compute: Callable[[], Dict]) -> Dict:
+        plan = self.cache.get(key)
+        if plan is not MISSING:
+            return plan
+        return self.flights.do(key, lambda: self._fill(key, compute))
+
+    async def aget_or_plan(self, key: str, compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        plan = self.cache.local.get(key)
+        if plan is not MISSING:
+            self.cache.hit('local')
+            return plan
+        return await self.flights.ado(key, lambda: self.cache.aget_or_set(key, compute))
+
+    def _fill(self, key: str, compute: Callable[[], Dict]) -> Dict:
+        # The previous leader may have stored the plan between our miss and taking the lead
+        plan = self.cache.local.get(key)
+        if plan is MISSING:
+            plan = compute()
+            self.cache.set(key, plan)
+        return plan
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self.cache.stats(), coalesced=self.flights.coalesced)
+
+
+_plan_cache: Optional[PlanCache] = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache() -> PlanCache:
+    global _plan_cache
+    if _plan_cache is None:
+        with _plan_cache_lock:
+            if _plan_cache is None:
+                _plan_cache = PlanCache()
+    return _plan_cache
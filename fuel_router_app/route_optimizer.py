@@ -1,88 +1,132 @@
-import requests
-from django.core.cache import cache
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.conf import settings
 from typing import List, Dict, Tuple, Union, Optional
-from .models import FuelStation
-from geopy.distance import geodesic
+from .backends import get_geocoder, get_router
+from .corridor import RouteCorridor, build_corridor
+from .distance import distance
+from .fuel_solver import solve_min_cost
+from .gazetteer import get_gazetteer
+from .instrumentation import count, propagate, stage, trace_count
+from .station_snapshot import DatabaseStations, StationSnapshot, get_snapshot
+from .tiered_cache import cache_ttl, coordinates_key, get_cache, query_key
+from .vehicle import Vehicle
 
+OPTIMIZATION_MODES = ('greedy', 'min_cost')
 
-class RouteOptimizer:
-    def __init__(self):
-        # Using public OSRM instance - you can also host your own
-        self.OSRM_BASE_URL = 'http://router.project-osrm.org'
-        self.NOMINATIM_BASE_URL = 'https://nominatim.openstreetmap.org'
-
-    def geocode_location(self, location: str) -> Tuple[Optional[float], Optional[float]]:
-        """Convert location string to coordinates using Nominatim"""
-        url = f'{self.NOMINATIM_BASE_URL}/search'
-        params = {
-            'q': location,
-            'format': 'json',
-            'limit': 10,
-            'countrycodes': 'us'  # Limit to USA
-        }
-        headers = {
-            'User-Agent': 'RouteOptimizer/1.0'
-        }
-        response = requests.get(url, params=params, headers=headers)
-        if response.status_code != 200:
-            raise ValueError(f"Nominatim API request failed with status code {response.status_code}")
 
-        data = response.json()
-        if not data:
-            return None, None
+def route_key(points: List[Tuple[float, float]], alternatives: int = 0, steps: bool = False) -> str:
+    """Route cache key; routes fetched with steps or alternatives are cached apart from plain ones."""
+    key = coordinates_key(*points)
+    if alternatives:
+        key += f'|alternatives={alternatives}'
+    if steps:
+        key += '|steps'
+    return key
 
-        # Extract coordinates from the first non-empty result
-        for result in data:
-            if 'lat' in result and 'lon' in result:
-                return float(result['lat']), float(result['lon'])
 
-        return None, None
+def geocode_ttl(point: Tuple[Optional[float], Optional[float]]) -> Optional[float]:
+    """Cache misses only for ``FUEL_ROUTER_CACHE_TTLS['geocode_miss']``, found locations for the geocode TTL."""
+    return cache_ttl('geocode_miss') if None in point else None
 
-    def get_route(self, start_lat: float, start_lon: float, end_lat: float, end_lon: float) -> Dict[str, Union[float, List]]:
-        """Get route using OSRM"""
-
-        # Get route from OSRM
-        url = f'{self.OSRM_BASE_URL}/route/v1/driving/{start_lon},{start_lat};{end_lon},{end_lat}'
-        params = {
-            'overview': 'full',
-            'geometries': 'geojson',
-            'steps': 'true'
-        }
-        response = requests.get(url, params=params)
-        data = response.json()
 
-        if data['code'] != 'Ok':
-            raise ValueError("Could not calculate route")
-
-        route = data['routes'][0]
+class RouteOptimizer:
+    def __init__(self):
+        # Backends are chosen in settings.FUEL_ROUTER_GEOCODER / FUEL_ROUTER_ROUTER (Nominatim and OSRM by default)
+        self.geocoder = get_geocoder()
+        self.router = get_router()
 
-        # Decode the polyline to get route points
-        coordinates = route['geometry']['coordinates']
+    def geocode_location(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        """Convert location string to coordinates, served from the gazetteer or the geocode cache when possible"""
+        point = self.lookup_gazetteer(location)
+        if point is not None:
+            return point
+        return get_cache('geocode').get_or_set(
+            query_key(location), lambda: self._fetch_geocode(location), ttl_for=geocode_ttl
+        )
+
+    def lookup_gazetteer(self, location: str) -> Optional[Tuple[float, float]]:
+        """Coordinates of a plain "City, ST" from the in-process gazetteer, or None to ask the geocoder"""
+        gazetteer = get_gazetteer()
+        if gazetteer is None:
+            return None
+        point = gazetteer.lookup(location)
+        trace_count('gazetteer_hits' if point is not None else 'gazetteer_misses')
+        return point
+
+    def _fetch_geocode(self, location: str) -> Tuple[Optional[float], Optional[float]]:
+        """Convert location string to coordinates with the configured geocoder"""
+        with stage('geocode_upstream'):
+            return self.geocoder.geocode(location)
+
+    def geocode_locations(self, *locations: str) -> List[Tuple[Optional[float], Optional[float]]]:
+        """Geocode several locations concurrently (the geocoder's rate limit still spaces uncached lookups)."""
+        with stage('geocode'):
+            if len(locations) < 2:
+                return [self.geocode_location(location) for location in locations]
+            with ThreadPoolExecutor(max_workers=min(len(locations), 8)) as pool:
+                return list(pool.map(propagate(self.geocode_location), locations))
 
-        return {
-            'distance': route['distance'] / 1609.34,  # Convert meters to miles
-            'duration': route['duration'] / 3600,  # Convert seconds to hours
-            'geometry': coordinates,
-            'steps': route['legs'][0]['steps']
-        }
+    def get_route(self, start_lat: float, start_lon: float, end_lat: float, end_lon: float) -> Dict[str, Union[float, List]]:
+        """Get route between two points, served from the route cache when possible"""
+        return self.get_route_via([(start_lat, start_lon), (end_lat, end_lon)])
 
+    def get_route_via(self, points: List[Tuple[float, float]], steps: bool = False) -> Dict[str, Union[float, List]]:
+        """Get one route through an ordered list of (lat, lon) points, with a leg between each consecutive pair.
 
-    def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
-        """Check the cache for a pre-calculated distance or calculate and cache it."""
+        Turn-by-turn ``steps`` are only fetched when asked for; otherwise the route has an empty list.
+        """
+        with stage('route'):
+            return get_cache('route').get_or_set(route_key(points, steps=steps), lambda: self._fetch_route(points, steps))
 
-        cache_key = f"distance_{point1[0]}_{point1[1]}_{point2[0]}_{point2[1]}"
-        cached_distance = cache.get(cache_key)
+    def _fetch_route(self, points: List[Tuple[float, float]], steps: bool = False) -> Dict[str, Union[float, List]]:
+        """Get route with the configured router"""
+        with stage('route_upstream'):
+            return self.router.route(points, steps)
 
-        if cached_distance is not None:
-            return cached_distance
+    def get_routes(
+            self,
+            points: List[Tuple[float, float]],
+            alternatives: int = 0,
+            steps: bool = False
+    ) -> List[Dict[str, Union[float, List]]]:
+        """The route through the points followed by up to ``alternatives`` alternatives, from one upstream call"""
+        if not alternatives:
+            return [self.get_route_via(points, steps)]
+        with stage('route'):
+            return get_cache('route').get_or_set(
+                route_key(points, alternatives, steps), lambda: self._fetch_routes(points, alternatives, steps)
+            )
+
+    def _fetch_routes(
+            self,
+            points: List[Tuple[float, float]],
+            alternatives: int,
+            steps: bool = False
+    ) -> List[Dict[str, Union[float, List]]]:
+        """Get a route and its alternatives with the configured router"""
+        with stage('route_upstream'):
+            return self.router.routes(points, alternatives, steps)
 
-        # If the distance is not in cache, calculate it
-        distance = geodesic(point1, point2).miles
+    def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
+        """Distance in miles between two (lat, lon) points."""
+        return float(distance(point1[0], point1[1], point2[0], point2[1]))
 
-        # Cache the calculated distance for future use (expire in 24 hours)
-        cache.set(cache_key, distance, timeout=86400)
-        return distance
-    
+    def build_corridor(
+            self,
+            route_coordinates: List[List[float]],
+            total_distance: float,
+            width: float,
+            snapshot: Optional[Union[StationSnapshot, DatabaseStations]] = None
+    ) -> RouteCorridor:
+        """Project the stations within ``width`` miles of the route onto it, once per route."""
+        snapshot = snapshot or get_snapshot()
+        if isinstance(snapshot, DatabaseStations):
+            with stage('station_query'):
+                snapshot = snapshot.near_routes([route_coordinates], width)
+        with stage('corridor'):
+            return build_corridor(snapshot, route_coordinates, width, total_distance)
 
     def find_optimal_fuel_stops(
             self,
@@ -91,115 +135,120 @@ class RouteOptimizer:
             route_coordinates: List[List[float]],
             total_distance: float,
             tank_range: float,
-            mpg: float
+            mpg: float,
+            snapshot: Optional[StationSnapshot] = None,
+            corridor: Optional[RouteCorridor] = None,
+            start_range: Optional[float] = None,
+            min_gallons: float = 0.0
     ) -> Dict[str, Union[List[Dict[str, Union[str, float, Dict[str, float]]]], float]]:
-        """Find optimal fuel stops along the route."""
+        """Find optimal fuel stops along the route, starting with ``start_range`` miles of fuel (default: full)."""
+
+        """
+        For each critical point on the route, nearby fuel stations are identified
+        within a 20% radius of the tank range.
+        """
+        search_radius = tank_range * 0.2  # Look within 20% of tank range
+        if corridor is None or corridor.width < search_radius:
+            corridor = self.build_corridor(route_coordinates, total_distance, search_radius, snapshot)
+        snapshot = corridor.snapshot
 
         # Initialize variables
         fuel_stops = []
-        remaining_range = tank_range
+        remaining_range = tank_range if start_range is None else start_range
+        # Every stop fills the tank, so the first one also buys back whatever was missing at departure
+        missing_range = tank_range - remaining_range
         last_stop_coords = start_coords
-        stations = FuelStation.objects.all()
+        previous_progress = 0.0
 
         # Sample points every 50 miles
         """
         The route is sampled at intervals (every ~50 miles) to reduce computational overhead by considering only key
-        points instead of every point along the route.
+        points instead of every point along the route. Progress is the exact milepost of each sample.
         """
-        sample_interval = max(1, len(route_coordinates) // int(total_distance / 50))
-        sampled_points = route_coordinates[::sample_interval]
+        for progress in np.arange(0.0, corridor.total_distance, 50.0):
+            point = corridor.point_at(progress)
 
-        for i, point in enumerate(sampled_points):
-            # Calculate progress along route
-            progress = i / len(sampled_points) * total_distance
+            # Update remaining range
+            remaining_range -= progress - previous_progress
+            previous_progress = progress
 
             # If we're running low on fuel (25% of tank range remaining)
             """
             The car's fuel tank range is tracked, and when it drops below 25% of its capacity,
             nearby fuel stations are searched.
             """
-            if remaining_range < (tank_range * 0.25) and progress < total_distance:
-                # Find nearby stations
-                nearby_stations = []
+            if remaining_range < (tank_range * 0.25):
                 """
-                For each critical point on the route, nearby fuel stations are identified
-                within a 20% radius of the tank range.
+                The corridor is sorted by milepost, so the stations that can be within the search radius of the
+                current point are the slices of it along the stretches of route that pass near the point (on a
+                winding route, not only the one around its milepost); only those get the exact distance check.
+                """
+                window = corridor.near(point[0], point[1], search_radius)
+                candidates = corridor.rows[window]
+                candidate_mileposts = corridor.mileposts[window]
+                count('candidate_stations', candidates.size)
+
+                # Distances from the current point to every candidate, in one vectorized call
+                station_lats = snapshot.lats[candidates]
+                station_lons = snapshot.lons[candidates]
+                distances = distance(point[0], point[1], station_lats, station_lons)
+                nearby = np.flatnonzero(distances <= search_radius)
+
+                """
+                Deviation measures how much a fuel station deviates from the most direct route between the
+                current point on the route and the destination (end coordinates). The goal is to penalize
+                stations that cause unnecessary detours, as those will increase the overall trip distance
+                and fuel costs.
+
+                Formula:
+                D(start to station): Distance from Current Point to Fuel Station
+                D(station to end): Distance from Fuel Station to Destination
+                D(start to end): Direct Distance from Current Point to Destination
+
+                Deviation (Detour): (D(start to station) + D(station to end)) - D(start to end)
                 """
-                search_radius = tank_range * 0.2  # Look within 20% of tank range
-
-                for station in stations:
-                    distance = self.calculate_distance((point[1], point[0]), (station.lat, station.lon))
-
-                    if distance <= search_radius:
-                        # Calculate deviation from route
-
-                        """
-                        Deviation measures how much a fuel station deviates from the most direct route between the
-                        current point on the route and the destination (end coordinates). The goal is to penalize
-                        stations that cause unnecessary detours, as those will increase the overall trip distance
-                        and fuel costs.
-
-                        Formula:
-                        D(start to station): Distance from Current Point to Fuel Station
-                        D(station to end): Distance from Fuel Station to Destination
-                        D(start to end): Direct Distance from Current Point to Destination
-
-                        Deviation (Detour): (D(start to station) + D(station to end)) - D(start to end)
-                        """
-                        deviation = (
-                            (self.calculate_distance((point[1], point[0]), (station.lat, station.lon)) +
-                             self.calculate_distance((station.lat, station.lon), end_coords)) -
-                            self.calculate_distance((point[1], point[0]), end_coords)
-                        )
-
-                        # Score based on price and deviation
-                        # Lower is better
-                        score = float(station.retail_price) + (deviation * 0.1)  # Penalty for deviation
-                        nearby_stations.append({
-                            'station': station,
-                            'distance': distance,
-                            'deviation': deviation,
-                            'score': score
-                        })
                 """
                 The "best" station is selected based on a scoring system:
                     1. Fuel price: Lower prices are preferred.
                     2. Route deviation: Stations that deviate less from the direct route are favored
                         (to minimize detour cost).
                 """
-                if nearby_stations:
-                    best_station = min(nearby_stations, key=lambda x: x['score'])
+                if nearby.size:
+                    deviations = (
+                        distances[nearby] +
+                        distance(station_lats[nearby], station_lons[nearby], end_coords[0], end_coords[1]) -
+                        distance(point[0], point[1], end_coords[0], end_coords[1])
+                    )
+
+                    # Score based on price and deviation
+                    # Lower is better
+                    scores = snapshot.prices[candidates[nearby]] + deviations * 0.1  # Penalty for deviation
+                    best = nearby[int(np.argmin(scores))]
+                    best_station = snapshot.station(candidates[best])
 
                     # Calculate gallons needed
-                    distance_since_last = self.calculate_distance(last_stop_coords, (
-                        best_station['station'].lat, best_station['station'].lon))
+                    distance_since_last = self.calculate_distance(
+                        last_stop_coords, (best_station['lat'], best_station['lon']))
 
-                    gallons_needed = distance_since_last / mpg
+                    gallons_needed = max((distance_since_last + missing_range) / mpg, min_gallons)
 
                     fuel_stops.append({
-                        'station_id': best_station['station'].opis_id,
-                        'name': best_station['station'].name,
+                        'station_id': best_station['station_id'],
+                        'name': best_station['name'],
                         'location': {
-                            'lat': best_station['station'].lat,
-                            'lng': best_station['station'].lon
+                            'lat': best_station['lat'],
+                            'lng': best_station['lon']
                         },
-                        'price': float(best_station['station'].retail_price),
-                        'distance_from_start': progress,
+                        'price': best_station['price'],
+                        'distance_from_start': float(candidate_mileposts[best]),
                         'gallons': gallons_needed,
-                        'cost': float(best_station['station'].retail_price) * gallons_needed
+                        'cost': best_station['price'] * gallons_needed
                     })
 
                     # Update tracking variables
-                    last_stop_coords = (best_station['station'].lat, best_station['station'].lon)
+                    last_stop_coords = (best_station['lat'], best_station['lon'])
                     remaining_range = tank_range
-
-            # Update remaining range
-            if i > 0:
-                distance_covered = self.calculate_distance(
-                    (sampled_points[i - 1][1], sampled_points[i - 1][0]),
-                    (point[1], point[0])
-                )
-                remaining_range -= distance_covered
+                    missing_range = 0.0
 
         total_cost = sum(stop['cost'] for stop in fuel_stops)
 
@@ -209,6 +258,201 @@ class RouteOptimizer:
             'total_distance': total_distance
         }
 
+    def plan_fuel_stops(
+            self,
+            start_coords: Tuple[float, float],
+            end_coords: Tuple[float, float],
+            route_coordinates: List[List[float]],
+            total_distance: float,
+            tank_range: float,
+            mpg: float,
+            optimization: str = 'greedy',
+            snapshot: Optional[StationSnapshot] = None,
+            corridor: Optional[RouteCorridor] = None,
+            start_range: Optional[float] = None,
+            min_gallons: float = 0.0,
+            legs: Optional[List[Dict[str, float]]] = None
+    ) -> Dict[str, Union[List[Dict[str, Union[str, float, Dict[str, float]]]], float]]:
+        """Plan fuel stops with the selected optimization mode.
+
+        For a route through waypoints, pass its ``legs``: fuel carries over from leg to leg and every stop gets the
+        index of the leg it is on.
+        """
+        with stage('optimize'):
+            if optimization == 'min_cost':
+                result = self.find_min_cost_fuel_stops(
+                    route_coordinates, total_distance, tank_range, mpg, snapshot=snapshot, corridor=corridor,
+                    start_range=start_range, min_gallons=min_gallons
+                )
+            else:
+                result = self.find_optimal_fuel_stops(
+                    start_coords, end_coords, route_coordinates, total_distance, tank_range, mpg, snapshot=snapshot,
+                    corridor=corridor, start_range=start_range, min_gallons=min_gallons
+                )
+        if legs and len(legs) > 1:
+            self.assign_legs(result['fuel_stops'], legs)
+        return result
+
+    def assign_legs(self, fuel_stops: List[Dict], legs: List[Dict[str, float]]) -> List[Dict]:
+        """Tag each stop with the index of the route leg it falls on."""
+        leg_ends = np.cumsum([leg['distance'] for leg in legs])
+        for stop in fuel_stops:
+            stop['leg'] = min(int(np.searchsorted(leg_ends, stop['distance_from_start'])), len(legs) - 1)
+        return fuel_stops
+
+    def plan_for_vehicles(
+            self,
+            start_coords: Tuple[float, float],
+            end_coords: Tuple[float, float],
+            route_coordinates: List[List[float]],
+            total_distance: float,
+            vehicles: List[Vehicle],
+            optimization: str = 'greedy',
+            snapshot: Optional[StationSnapshot] = None,
+            legs: Optional[List[Dict[str, float]]] = None
+    ) -> List[Dict[str, Union[List[Dict[str, Union[str, float, Dict[str, float]]]], float]]]:
+        """Plan fuel stops for several vehicles on one route, sharing a single corridor between them."""
+        width = max(self.corridor_width(vehicle.usable_range) for vehicle in vehicles)
+        corridor = self.build_corridor(route_coordinates, total_distance, width, snapshot)
+        return [
+            self.plan_fuel_stops(
+                start_coords, end_coords, route_coordinates, total_distance, optimization=optimization,
+                corridor=corridor, legs=legs, **vehicle.planning_kwargs()
+            )
+            for vehicle in vehicles
+        ]
+
+    def plan_alternatives(
+            self,
+            start_coords: Tuple[float, float],
+            end_coords: Tuple[float, float],
+            routes: List[Dict[str, Union[float, List]]],
+            vehicles: List[Vehicle],
+            optimization: str = 'greedy',
+            snapshot: Optional[Union[StationSnapshot, DatabaseStations]] = None
+    ) -> List[Dict]:
+        """Plan fuel stops on every alternative route concurrently and rank them by trip cost, cheapest first."""
+        snapshot = self.alternatives_snapshot(routes, vehicles, snapshot)
+        with stage('alternatives'), ThreadPoolExecutor(max_workers=min(len(routes), 4)) as pool:
+            plans = list(pool.map(
+                propagate(partial(self.plan_alternative, start_coords, end_coords, vehicles=vehicles,
+                                  optimization=optimization, snapshot=snapshot)),
+                routes
+            ))
+        return self.rank_alternatives(plans)
+
+    def alternatives_snapshot(
+            self,
+            routes: List[Dict[str, Union[float, List]]],
+            vehicles: List[Vehicle],
+            snapshot: Optional[Union[StationSnapshot, DatabaseStations]] = None
+    ) -> StationSnapshot:
+        """One station snapshot (and spatial index) shared by the plans of every alternative."""
+        snapshot = snapshot or get_snapshot()
+        if isinstance(snapshot, DatabaseStations):
+            width = max(self.corridor_width(vehicle.usable_range) for vehicle in vehicles)
+            with stage('station_query'):
+                snapshot = snapshot.near_routes([route['geometry'] for route in routes], width)
+        # Built here rather than by whichever worker thread gets there first
+        snapshot.index
+        return snapshot
+
+    def plan_alternative(
+            self,
+            start_coords: Tuple[float, float],
+            end_coords: Tuple[float, float],
+            route: Dict[str, Union[float, List]],
+            vehicles: List[Vehicle],
+            optimization: str = 'greedy',
+            snapshot: Optional[StationSnapshot] = None
+    ) -> Dict:
+        """Plan of one alternative route, or its error when no station sequence can cover it."""
+        try:
+            results = self.plan_for_vehicles(
+                start_coords, end_coords, route['geometry'], route['distance'], vehicles,
+                optimization=optimization, snapshot=snapshot, legs=route.get('legs')
+            )
+        except ValueError as e:
+            return {'route': route, 'error': str(e)}
+        return {'route': route, 'results': results}
+
+    def rank_alternatives(self, plans: List[Dict]) -> List[Dict]:
+        """Order plans by trip cost (fuel of the first vehicle plus distance and time costs); failed plans go last."""
+        for index, plan in enumerate(plans):
+            plan['index'] = index
+            if 'results' in plan:
+                plan['trip_cost'] = self.trip_cost(plan['route'], plan['results'][0])
+        ranked = sorted(plans, key=lambda plan: plan.get('trip_cost', float('inf')))
+        if 'results' not in ranked[0]:
+            raise ValueError(ranked[0]['error'])
+        return ranked
+
+    def trip_cost(self, route: Dict[str, Union[float, List]], result: Dict) -> float:
+        """Fuel cost plus the per-mile and per-hour operating costs of the route."""
+        return (
+            result['total_cost'] +
+            route['distance'] * getattr(settings, 'FUEL_ROUTER_COST_PER_MILE', 0.0) +
+            route['duration'] * getattr(settings, 'FUEL_ROUTER_COST_PER_HOUR', 0.0)
+        )
+
+    def corridor_width(self, tank_range: float) -> float:
+        """Corridor half-width (miles) searched for stations for a given tank range, the same in every mode."""
+        return tank_range * 0.2
+
+    def find_min_cost_fuel_stops(
+            self,
+            route_coordinates: List[List[float]],
+            total_distance: float,
+            tank_range: float,
+            mpg: float,
+            snapshot: Optional[StationSnapshot] = None,
+            corridor: Optional[RouteCorridor] = None,
+            start_range: Optional[float] = None,
+            min_gallons: float = 0.0,
+            end_range: float = 0.0
+    ) -> Dict[str, Union[List[Dict[str, Union[str, float, Dict[str, float]]]], float]]:
+        """Cheapest feasible fuel plan, allowing partial fills.
+
+        The vehicle leaves with ``start_range`` miles of fuel (default: full) and arrives with ``end_range``.
+
+        It chooses among the same stations as the greedy planner, those within its search radius of the route, so
+        it never pays more than the greedy plan for the same fuel.
+        """
+        width = self.corridor_width(tank_range)
+        if corridor is None or corridor.width < width:
+            corridor = self.build_corridor(route_coordinates, total_distance, width, snapshot)
+        snapshot = corridor.snapshot
+
+        rows, mileposts = corridor.within(width)
+        count('candidate_stations', rows.size)
+        purchases = solve_min_cost(
+            mileposts, snapshot.prices[rows], total_distance, tank_range,
+            tank_range if start_range is None else start_range, min_purchase=min_gallons * mpg, end_range=end_range
+        )
+
+        fuel_stops = []
+        for purchase in purchases:
+            station = snapshot.station(rows[purchase.station])
+            gallons = purchase.miles / mpg
+            fuel_stops.append({
+                'station_id': station['station_id'],
+                'name': station['name'],
+                'location': {
+                    'lat': station['lat'],
+                    'lng': station['lon']
+                },
+                'price': station['price'],
+                'distance_from_start': float(purchase.milepost),
+                'gallons': gallons,
+                'cost': station['price'] * gallons
+            })
+
+        return {
+            'fuel_stops': fuel_stops,
+            'total_cost': sum(stop['cost'] for stop in fuel_stops),
+            'total_distance': total_distance
+        }
+
     def get_stop_details(self, stops: List[Dict]) -> Dict:
         """Get detailed information about the fuel stops"""
 
@@ -1,14 +1,136 @@
 from rest_framework import serializers
+from fuel_router_app.models import VehicleProfile
+from fuel_router_app.route_optimizer import OPTIMIZATION_MODES
+from fuel_router_app.vehicle import DEFAULT_VEHICLE
+
+GEOMETRY_FORMATS = ('coordinates', 'polyline', 'none')
+
+
+class PassthroughField(serializers.Field):
+    """Outputs trusted, already JSON-ready data as is, without walking it element by element."""
+
+    def to_representation(self, value):
+        return value
+
+    def to_internal_value(self, data):
+        return data
+
+
+class VehiclePlanSerializer(serializers.Serializer):
+    vehicle = PassthroughField()
+    fuel_stops = PassthroughField()
+    total_cost = serializers.DecimalField(max_digits=10, decimal_places=4)
+
+
+class AlternativeRouteSerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    # Position in the OSRM response; 0 is the route OSRM considers best
+    index = serializers.IntegerField()
+    total_distance = serializers.FloatField()
+    duration = serializers.FloatField()
+    fuel_stops = PassthroughField(required=False)
+    total_cost = serializers.DecimalField(max_digits=10, decimal_places=4, required=False)
+    trip_cost = serializers.DecimalField(max_digits=10, decimal_places=4, required=False)
+    error = serializers.CharField(required=False)
 
 
 class RouteResponseSerializer(serializers.Serializer):
-    route_coordinates = serializers.ListField(child=serializers.ListField(child=serializers.FloatField()))
-    fuel_stops = serializers.ListField(child=serializers.DictField())
+    # Serialized from the view's own data (``RouteResponseSerializer(instance).data``), never validated, so the
+    # bulky fields skip per-element field conversion
+    route_id = serializers.CharField()
+    route_coordinates = PassthroughField(required=False)
+    route_polyline = serializers.CharField(required=False)
+    steps = PassthroughField(required=False)
+    legs = PassthroughField(required=False)
+    fuel_stops = PassthroughField()
     total_cost = serializers.DecimalField(max_digits=10, decimal_places=4)
     total_distance = serializers.FloatField()
+    vehicle = PassthroughField()
+    plans = VehiclePlanSerializer(many=True, required=False)
+    alternatives = AlternativeRouteSerializer(many=True, required=False)
     map_url = serializers.CharField()
+    debug_timings = PassthroughField(required=False)
+
+
+class VehicleSerializer(serializers.Serializer):
+    """A stored profile by name, explicit fuel parameters, or a profile with some of its parameters overridden.
 
+    Validates to a ``Vehicle``; parameters that are not given come from the profile or the default vehicle.
+    """
+    profile = serializers.CharField(max_length=100, required=False)
+    name = serializers.CharField(max_length=100, required=False)
+    tank_gallons = serializers.FloatField(min_value=1, required=False)
+    mpg = serializers.FloatField(min_value=0.1, required=False)
+    start_fuel = serializers.FloatField(min_value=0, max_value=1, required=False)
+    reserve = serializers.FloatField(min_value=0, max_value=0.9, required=False)
+    min_purchase = serializers.FloatField(min_value=0, required=False)
 
-class RouteRequestSerializer(serializers.Serializer):
+    def validate(self, attrs):
+        profile_name = attrs.pop('profile', None)
+        vehicle = DEFAULT_VEHICLE
+        if profile_name:
+            profile = VehicleProfile.objects.filter(name=profile_name).first()
+            if profile is None:
+                raise serializers.ValidationError({'profile': f"Unknown vehicle profile '{profile_name}'"})
+            vehicle = profile.as_vehicle()
+
+        vehicle = vehicle._replace(**attrs)
+        if vehicle.start_fuel <= vehicle.reserve:
+            raise serializers.ValidationError('start_fuel must be above the reserve')
+        if vehicle.min_purchase > vehicle.tank_gallons * (1 - vehicle.reserve):
+            raise serializers.ValidationError('min_purchase is larger than the usable tank')
+        return vehicle
+
+
+class TripSerializer(serializers.Serializer):
     start = serializers.CharField(max_length=255)
-    end = serializers.CharField(max_length=255)
\ No newline at end of file
+    end = serializers.CharField(max_length=255)
+    # Intermediate stops, visited in order between start and end
+    waypoints = serializers.ListField(
+        child=serializers.CharField(max_length=255), default=list, max_length=23
+    )
+    optimization = serializers.ChoiceField(choices=OPTIMIZATION_MODES, default='greedy')
+    vehicle = VehicleSerializer(default=DEFAULT_VEHICLE)
+
+
+class RouteRequestSerializer(TripSerializer):
+    geometry_format = serializers.ChoiceField(choices=GEOMETRY_FORMATS, default='coordinates')
+    simplify_tolerance = serializers.FloatField(min_value=0, default=0, help_text='Douglas–Peucker tolerance in metres')
+    include_steps = serializers.BooleanField(default=False)
+    # Stage durations and counters of this request, as in the Server-Timing header
+    debug_timings = serializers.BooleanField(default=False)
+    # Several vehicles costed on the same route; the first one is reported in the top-level fields
+    vehicles = VehicleSerializer(many=True, required=False, allow_empty=False, max_length=20)
+    # Alternative routes asked from OSRM and planned too; the cheapest trip is reported in the top-level fields
+    alternatives = serializers.IntegerField(min_value=0, max_value=3, default=0)
+
+    def validate(self, attrs):
+        if 'vehicles' in attrs and 'vehicle' in self.initial_data:
+            raise serializers.ValidationError('Pass either vehicle or vehicles, not both')
+        if attrs['alternatives'] and attrs['waypoints']:
+            # OSRM only computes alternatives between two points
+            raise serializers.ValidationError('alternatives cannot be combined with waypoints')
+        return attrs
+
+
+class StationViewportSerializer(serializers.Serializer):
+    # west,south,east,north in degrees, as in GeoJSON and OSM
+    bbox = serializers.CharField()
+    zoom = serializers.IntegerField(min_value=0, max_value=22)
+
+    def validate_bbox(self, value):
+        try:
+            west, south, east, north = (float(part) for part in value.split(','))
+        except ValueError:
+            raise serializers.ValidationError('Expected west,south,east,north')
+        if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+            raise serializers.ValidationError('Expected west <= east and south <= north, in degrees')
+        return south, west, north, east
+
+
+class BatchTripSerializer(TripSerializer):
+    trip_id = serializers.CharField(max_length=255, required=False)
+
+
+class BatchRouteRequestSerializer(serializers.Serializer):
+    trips = BatchTripSerializer(many=True, allow_empty=False)
\ No newline at end of file
@@ -0,0 +1,52 @@
+from typing import Tuple
+
+import numpy as np
+
+MILES_PER_DEGREE_LAT = 69.0
+
+
+def cell_keys(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """One int64 per (row, col) grid cell, ordered by row then column."""
+    return rows * (1 << 32) + (cols + (1 << 31))
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(start, start + count)`` for every (start, count) pair."""
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+
+class StationGridIndex:
+    """Uniform lat/lon grid over station coordinates.
+
+    Station rows (into the arrays the index was built from, see ``StationSnapshot``) are sorted by grid cell, so
+    the stations of any set of cells come from one binary search per cell instead of a pass over every station.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, cell_size: float = 0.5):
+        self.cell_size = cell_size
+        self.size = len(lats)
+
+        keys = cell_keys(self.cell(lats), self.cell(lons))
+        self.order = np.argsort(keys, kind='stable')
+        # The occupied cells, with where their stations start in ``order`` and how many there are
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def cell(self, degrees) -> np.ndarray:
+        """Grid row (of latitudes) or column (of longitudes) of each coordinate."""
+        return np.floor(np.asarray(degrees, dtype=np.float64) / self.cell_size).astype(np.int64)
+
+    def stations_in(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the stations in the cells with the given keys, and the position in ``keys`` of each one's cell.
+
+        Stations come grouped by cell, in the order of ``keys``.
+        """
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        occupied = np.flatnonzero(self.keys[found] == keys)
+        found = found[occupied]
+        counts = self.counts[found]
+        return self.order[expand_ranges(self.starts[found], counts)], np.repeat(occupied, counts)
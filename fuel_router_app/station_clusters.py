@@ -0,0 +1,153 @@
+"""
+Per-zoom station clusters for map viewports.
+
+Stations are binned on the Web Mercator grid a slippy map uses, in square cells of ``cell_pixels`` screen pixels,
+at every zoom level up to ``max_zoom``: the finest level from the stations themselves, each coarser one by merging
+the four cells below it, so the whole pyramid costs about one sort of the stations. A level keeps its clusters
+(count, centroid, minimum and average price) sorted by row-major cell key, so the clusters in a viewport are found
+with two binary searches per grid row it spans, whatever the table size. Past ``max_zoom`` the stations themselves
+are returned, found the same way from their finest-level cells.
+"""
+import math
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+TILE_PIXELS = 256
+# Latitude where the Web Mercator world square ends
+MAX_LATITUDE = 85.05112878
+
+Box = Tuple[float, float, float, float]  # (south, west, north, east)
+
+
+class ClusterLevel(NamedTuple):
+    """Clusters of one zoom level, sorted by ``keys`` (``row * cells + column``)."""
+    cells: int  # Grid cells per axis
+    keys: np.ndarray
+    counts: np.ndarray
+    lat_sums: np.ndarray
+    lon_sums: np.ndarray
+    price_sums: np.ndarray
+    min_prices: np.ndarray
+
+
+def mercator(lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Web Mercator (x, y) in [0, 1], y growing southwards as in map tiles."""
+    lats = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / math.pi) / 2.0
+    return x, y
+
+
+def cell_range(box: Box, cells: int) -> Tuple[int, int, int, int]:
+    """First and last (column, row) of the grid cells a (south, west, north, east) box touches."""
+    south, west, north, east = box
+    (x0, x1), (y0, y1) = mercator(np.array([north, south]), np.array([west, east]))
+    clip = lambda value: min(max(int(value * cells), 0), cells - 1)
+    return clip(x0), clip(x1), clip(y0), clip(y1)
+
+
+def keys_in_box(keys: np.ndarray, cells: int, box: Box) -> np.ndarray:
+    """Positions in the sorted ``keys`` of the cells inside the box, one pair of binary searches per grid row."""
+    first_column, last_column, first_row, last_row = cell_range(box, cells)
+    rows = np.arange(first_row, last_row + 1, dtype=np.int64) * cells
+    starts = np.searchsorted(keys, rows + first_column, 'left')
+    lengths = np.searchsorted(keys, rows + last_column, 'right') - starts
+    # Concatenate the ranges start..start + length of every row without a Python loop
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(int(lengths.sum()))
+
+
+def aggregate(
+        cells: int,
+        keys: np.ndarray,
+        counts: np.ndarray,
+        lat_sums: np.ndarray,
+        lon_sums: np.ndarray,
+        price_sums: np.ndarray,
+        min_prices: np.ndarray
+) -> ClusterLevel:
+    """Merge the entries that share a cell key into one cluster each."""
+    if not keys.size:
+        return ClusterLevel(cells, keys, counts, lat_sums, lon_sums, price_sums, min_prices)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return ClusterLevel(
+        cells, keys[starts],
+        np.add.reduceat(counts[order], starts),
+        np.add.reduceat(lat_sums[order], starts),
+        np.add.reduceat(lon_sums[order], starts),
+        np.add.reduceat(price_sums[order], starts),
+        np.minimum.reduceat(min_prices[order], starts),
+    )
+
+
+class StationClusters:
+    """Cluster pyramid of a station snapshot, plus the snapshot's stations sorted by their finest cell."""
+
+    def __init__(self, snapshot, max_zoom: int = 12, cell_pixels: int = 64, keep_stations: bool = True):
+        if cell_pixels not in (1, 2, 4, 8, 16, 32, 64, 128, 256):
+            # Cells must nest from one zoom level to the next
+            raise ValueError('cell_pixels must be a power of two no larger than a tile')
+        self.max_zoom = max_zoom
+        self.cell_pixels = cell_pixels
+        self.version = snapshot.version
+
+        cells = self.cells(max_zoom)
+        x, y = mercator(snapshot.lats, snapshot.lons)
+        columns = np.minimum((x * cells).astype(np.int64), cells - 1)
+        rows = np.minimum((y * cells).astype(np.int64), cells - 1)
+        station_keys = rows * cells + columns
+
+        level = aggregate(
+            cells, station_keys, np.ones(len(snapshot), dtype=np.int64), snapshot.lats.astype(np.float64),
+            snapshot.lons.astype(np.float64), snapshot.prices.astype(np.float64), snapshot.prices.astype(np.float64),
+        )
+        self.levels: List[ClusterLevel] = [level]
+        for zoom in range(max_zoom - 1, -1, -1):
+            # Each cell of a zoom level covers two by two cells of the next one
+            child_columns, child_rows = level.keys % level.cells, level.keys // level.cells
+            cells = self.cells(zoom)
+            level = aggregate(
+                cells, (child_rows // 2) * cells + child_columns // 2,
+                level.counts, level.lat_sums, level.lon_sums, level.price_sums, level.min_prices,
+            )
+            self.levels.append(level)
+        self.levels.reverse()
+
+        self.snapshot = snapshot if keep_stations else None
+        if keep_stations:
+            self.station_order = np.argsort(station_keys, kind='stable')
+            self.station_keys = station_keys[self.station_order]
+
+    def cells(self, zoom: int) -> int:
+        return (TILE_PIXELS // self.cell_pixels) << zoom
+
+    def clusters(self, zoom: int, box: Box, limit: Optional[int] = None) -> List[Dict[str, float]]:
+        """Clusters of the cells the box touches at ``zoom`` (capped at ``max_zoom``)."""
+        level = self.levels[min(max(zoom, 0), self.max_zoom)]
+        found = keys_in_box(level.keys, level.cells, box)[:limit]
+        counts = level.counts[found]
+        return [
+            {'lat': round(lat, 5), 'lon': round(lon, 5), 'count': count, 'min_price': min_price,
+             'avg_price': round(avg_price, 3)}
+            for lat, lon, count, min_price, avg_price in zip(
+                (level.lat_sums[found] / counts).tolist(), (level.lon_sums[found] / counts).tolist(),
+                counts.tolist(), level.min_prices[found].tolist(), (level.price_sums[found] / counts).tolist(),
+            )
+        ]
+
+    def stations(self, box: Box, limit: Optional[int] = None) -> List[Dict[str, float]]:
+        """The individual stations inside the box."""
+        rows = self.station_order[keys_in_box(self.station_keys, self.cells(self.max_zoom), box)]
+        south, west, north, east = box
+        lats, lons = self.snapshot.lats[rows], self.snapshot.lons[rows]
+        rows = rows[(lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)][:limit]
+        return [
+            {'station_id': station_id, 'price': price, 'lat': lat, 'lon': lon}
+            for station_id, price, lat, lon in zip(
+                self.snapshot.opis_ids[rows].tolist(), self.snapshot.prices[rows].tolist(),
+                self.snapshot.lats[rows].tolist(), self.snapshot.lons[rows].tolist(),
+            )
+        ]
@@ -0,0 +1,227 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+
+from .gazetteer import invalidate_gazetteer
+from .models import FuelStation, StationDataVersion
+
+
+class StationSnapshot:
+    """Read-only, columnar copy of the geocoded fuel stations.
+
+    Row ``i`` of every array describes the same station. Prices are plain floats, so the optimizer never
+    touches model instances or ``Decimal`` arithmetic. A snapshot is never mutated; reloads build a new one
+    and swap the module-level reference.
+    """
+
+    def __init__(
+            self,
+            opis_ids: np.ndarray,
+            names: Sequence[str],
+            lats: np.ndarray,
+            lons: np.ndarray,
+            prices: np.ndarray,
+            version: int = 0
+    ):
+        self.opis_ids = opis_ids
+        self.names = tuple(names)
+        self.lats = lats
+        self.lons = lons
+        self.prices = prices
+        self.version = version
+        self._index = None
+        self._clusters = None
+        self._index_lock = threading.Lock()
+
+    @classmethod
+    def from_queryset(cls, queryset, version: int = 0) -> 'StationSnapshot':
+        rows = list(
+            queryset.exclude(lat=None).exclude(lon=None)
+            .order_by('id')
+            .values_list('opis_id', 'name', 'lat', 'lon', 'retail_price')
+        )
+        count = len(rows)
+        return cls(
+            opis_ids=np.fromiter((row[0] for row in rows), np.int64, count),
+            names=[row[1] for row in rows],
+            lats=np.fromiter((row[2] for row in rows), np.float64, count),
+            lons=np.fromiter((row[3] for row in rows), np.float64, count),
+            prices=np.fromiter((row[4] for row in rows), np.float64, count),
+            version=version,
+        )
+
+    def __len__(self) -> int:
+        return len(self.opis_ids)
+
+    @property
+    def index(self):
+        """Spatial index over this snapshot, built on first use and shared by every request holding it."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    from .spatial_index import StationGridIndex
+                    cell_size = getattr(settings, 'FUEL_ROUTER_GRID_CELL_DEGREES', 0.5)
+                    self._index = StationGridIndex(self.lats, self.lons, cell_size)
+        return self._index
+
+    @property
+    def clusters(self):
+        """Per-zoom station clusters for map viewports, built on first use like ``index``."""
+        if self._clusters is None:
+            with self._index_lock:
+                if self._clusters is None:
+                    self._clusters = build_clusters(self)
+        return self._clusters
+
+    def station(self, i: int) -> Dict[str, Union[int, str, float]]:
+        return {
+            'station_id': int(self.opis_ids[i]),
+            'name': self.names[i],
+            'lat': float(self.lats[i]),
+            'lon': float(self.lons[i]),
+            'price': float(self.prices[i]),
+        }
+
+
+class DatabaseStations:
+    """Station source of processes that keep no snapshot (``FUEL_ROUTER_STATION_SOURCE = 'database'``).
+
+    It stands in for the snapshot where only ``version`` is read; ``RouteOptimizer.build_corridor`` swaps it for a
+    snapshot of just the stations around the route, loaded with one indexed query, so memory stays flat however
+    large the station table grows.
+    """
+
+    def __init__(self, version: int = 0):
+        self.version = version
+
+    def near_routes(self, routes: Sequence[List[List[float]]], width: float) -> StationSnapshot:
+        return StationSnapshot.from_queryset(FuelStation.objects.near_routes(routes, width), self.version)
+
+    @property
+    def clusters(self):
+        """Station clusters of this version, shared by every ``DatabaseStations`` of it.
+
+        Only the cluster pyramid is kept, not the stations; viewports past its last zoom level query the table.
+        """
+        global _database_clusters
+        clusters = _database_clusters
+        if clusters is None or clusters.version != self.version:
+            with _snapshot_lock:
+                clusters = _database_clusters
+                if clusters is None or clusters.version != self.version:
+                    snapshot = StationSnapshot.from_queryset(FuelStation.objects.all(), self.version)
+                    clusters = _database_clusters = build_clusters(snapshot, keep_stations=False)
+        return clusters
+
+
+def build_clusters(snapshot: StationSnapshot, keep_stations: bool = True):
+    from .station_clusters import StationClusters
+
+    return StationClusters(
+        snapshot,
+        max_zoom=getattr(settings, 'FUEL_ROUTER_CLUSTER_MAX_ZOOM', 12),
+        cell_pixels=getattr(settings, 'FUEL_ROUTER_CLUSTER_CELL_PIXELS', 64),
+        keep_stations=keep_stations,
+    )
+
+
+_snapshot: Optional[StationSnapshot] = None
+_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+_override: Optional[StationSnapshot] = None
+_database_stations: Optional[DatabaseStations] = None
+_database_clusters = None
+
+
+def load_snapshot() -> StationSnapshot:
+    """Build a snapshot of the current station data version and atomically make it the current one."""
+    global _snapshot, _checked_at
+    with _snapshot_lock:
+        version = StationDataVersion.current()
+        snapshot = _snapshot
+        # Threads that saw the same version bump wait here; only the first one rebuilds
+        if snapshot is not None and snapshot.version == version:
+            _checked_at = time.monotonic()
+            return snapshot
+        snapshot = _snapshot = StationSnapshot.from_queryset(FuelStation.objects.all(), version)
+        _checked_at = time.monotonic()
+    # Station cities may have changed too
+    invalidate_gazetteer()
+    return snapshot
+
+
+def get_snapshot() -> Union[StationSnapshot, DatabaseStations]:
+    """Return the current snapshot, reloading it if another process bumped the station data version.
+
+    The version is checked at most once every ``FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL`` seconds. Callers should
+    fetch the snapshot once and keep the reference for the rest of the request.
+    """
+    global _checked_at, _database_stations
+    if _override is not None:
+        return _override
+    if uses_database_stations():
+        stations = _database_stations
+        now = time.monotonic()
+        if stations is None or now - _checked_at >= getattr(settings, 'FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL', 5):
+            _checked_at = now
+            version = StationDataVersion.current()
+            if stations is not None and stations.version != version:
+                invalidate_gazetteer()
+            stations = _database_stations = DatabaseStations(version)
+        return stations
+
+    snapshot = _snapshot
+    if snapshot is None:
+        return load_snapshot()
+
+    interval = getattr(settings, 'FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+    if now - _checked_at >= interval:
+        _checked_at = now
+        if StationDataVersion.current() != snapshot.version:
+            return load_snapshot()
+    return snapshot
+
+
+@contextmanager
+def override_snapshot(snapshot: StationSnapshot):
+    """Serve ``snapshot`` from ``get_snapshot`` instead of the database (benchmarks, load tests)."""
+    global _override
+    previous, _override = _override, snapshot
+    try:
+        yield snapshot
+    finally:
+        _override = previous
+
+
+def uses_database_stations() -> bool:
+    return getattr(settings, 'FUEL_ROUTER_STATION_SOURCE', 'memory') == 'database'
+
+
+def invalidate_snapshot() -> None:
+    """Forget the in-process snapshot so the next ``get_snapshot`` call reloads it."""
+    global _snapshot, _database_stations
+    with _snapshot_lock:
+        _snapshot = None
+        _database_stations = None
+
+
+def station_data_changed(**kwargs) -> None:
+    """Signal receiver: bump the shared version so every process reloads, and drop the local snapshot."""
+    StationDataVersion.bump()
+    invalidate_snapshot()
+
+
+def preload_snapshot() -> Optional[StationSnapshot]:
+    """Load the snapshot at startup, tolerating a database that has not been migrated yet."""
+    if uses_database_stations():
+        return None
+    try:
+        return load_snapshot()
+    except DatabaseError:
+        return None
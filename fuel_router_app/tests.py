@@ -1,3 +1,1479 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import polyline
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from fuel_router_app import batch, maps, station_snapshot
+from fuel_router_app.async_optimizer import run_task
+from fuel_router_app.backends import GazetteerGeocoder, OSRMRouter, ReplayRouter, SyntheticRouter, get_router
+from fuel_router_app.benchmarks import compare, end_range, plan_summary, synthetic_route, synthetic_snapshot
+from fuel_router_app.corridor import build_corridor
+from fuel_router_app.distance import distance, ellipsoidal, get_distance_mode, haversine, path_lengths
+from fuel_router_app.fast_json import FastJSONParser, FastJSONRenderer, dumps, iter_json, loads
+from fuel_router_app.fuel_solver import InfeasibleRouteError, Purchase, next_cheaper, solve_min_cost
+from fuel_router_app.gazetteer import Gazetteer, gazetteer_loaded, invalidate_gazetteer, place_key
+from fuel_router_app.geometry import encode_polyline, simplify
+from fuel_router_app.instrumentation import Histogram, count, current_trace, propagate, stage, start_trace
+from fuel_router_app.management.commands.import_stations import Command as ImportStationsCommand
+from fuel_router_app.models import (
+    STATION_RTREE_TABLE, FuelStation, StationDataVersion, VehicleProfile, has_station_rtree
+)
+from fuel_router_app.plan_cache import PlanCache, SingleFlight, get_plan_cache, plan_key
+from fuel_router_app.route_optimizer import RouteOptimizer, geocode_ttl
+from fuel_router_app.spatial_index import StationGridIndex, cell_keys
+from fuel_router_app.station_clusters import StationClusters
+from fuel_router_app.station_snapshot import (
+    StationSnapshot, get_snapshot, invalidate_snapshot, load_snapshot, override_snapshot
+)
+from fuel_router_app.tiered_cache import MISSING, LRUCache, TieredCache, cache_ttl, get_cache
+from fuel_router_app.upstream import CircuitBreaker, CircuitOpenError, RateLimiter, Upstream
+from fuel_router_app.vehicle import DEFAULT_VEHICLE, Vehicle
+from fuel_router_app.warmup import preload, warm_up
+
+# Offline backends, no gazetteer database lookups and no shared cache tier, so tests never reach the network
+OFFLINE = {
+    'FUEL_ROUTER_GEOCODER': {'BACKEND': 'fuel_router_app.backends.GazetteerGeocoder'},
+    'FUEL_ROUTER_ROUTER': {'BACKEND': 'fuel_router_app.backends.SyntheticRouter'},
+    'FUEL_ROUTER_GAZETTEER': False,
+    'FUEL_ROUTER_SHARED_CACHE': None,
+}
+
+
+class SnapshotMixin:
+    """Serves a synthetic snapshot of ``snapshot_size`` stations from ``get_snapshot`` during each test."""
+
+    snapshot_size = 2000
+
+    def setUp(self):
+        super().setUp()
+        snapshot = override_snapshot(synthetic_snapshot(self.snapshot_size))
+        self.snapshot = snapshot.__enter__()
+        self.addCleanup(snapshot.__exit__, None, None, None)
+
+
+
+class PlanRouteMixin(SnapshotMixin):
+    """Plans trips through the API on a synthetic snapshot, each test starting with an empty plan cache."""
+
+    snapshot_size = 20000
+    url = '/api/plan-route/'
+
+    def setUp(self):
+        super().setUp()
+        get_plan_cache().cache.clear()
+
+    def post_plan(self, body, url=None, status=200):
+        response = self.client.post(url or self.url, body, content_type='application/json')
+        self.assertEqual(response.status_code, status, response.content if not response.streaming else '')
+        return loads(b''.join(response.streaming_content) if response.streaming else response.content)
+
+def make_snapshot(stations, version=1):
+    """Snapshot of (lat, lon, price) stations, with station ids 1, 2, ..."""
+    lats, lons, prices = (np.array(column, dtype=np.float64) for column in zip(*stations))
+    return StationSnapshot(
+        np.arange(1, len(stations) + 1, dtype=np.int64), [f'Station {i}' for i in range(1, len(stations) + 1)],
+        lats, lons, prices, version,
+    )
+
+
+def parallel_route(lat, west, east, step=0.05):
+    """[lon, lat] coordinates of a route due east along a parallel."""
+    return [[float(lon), lat] for lon in np.arange(west, east + step / 2, step)]
+
+
+def create_station(opis_id, lat, lon, price='3.000', city='', state=''):
+    return FuelStation.objects.create(
+        opis_id=opis_id, name=f'Station {opis_id}', address='', city=city, state=state, rack_id=0,
+        retail_price=price, lat=lat, lon=lon,
+    )
+
+
+class MinCostSolverTests(SimpleTestCase):
+    """Optima worked out by hand; ranges are miles of driving, prices per mile."""
+
+    def cost(self, purchases, prices):
+        return sum(prices[purchase.station] * purchase.miles for purchase in purchases)
+
+    def test_next_cheaper(self):
+        self.assertEqual(next_cheaper([3.0, 1.0, 2.0, 0.5, 5.0]).tolist(), [1, 3, 3, -1, -1])
+        # Equal prices are not cheaper
+        self.assertEqual(next_cheaper([2.0, 2.0, 1.0]).tolist(), [2, 2, -1])
+
+    def test_no_purchase_when_start_fuel_covers_the_trip(self):
+        self.assertEqual(solve_min_cost([10.0], [3.0], 200.0, 300.0, 250.0), [])
+
+    def test_buys_just_enough_to_reach_a_cheaper_station(self):
+        # 100 miles of fuel at departure: 50 more at mile 50 to reach the cheaper station, then the rest there
+        purchases = solve_min_cost([50.0, 150.0], [3.0, 2.0], 400.0, 300.0, 100.0)
+        self.assertEqual(purchases, [Purchase(0, 50.0, 50.0), Purchase(1, 150.0, 250.0)])
+        self.assertEqual(self.cost(purchases, [3.0, 2.0]), 650.0)
+
+    def test_fills_up_when_nothing_cheaper_is_within_reach(self):
+        # Cheapest first: fill the tank there and buy only the remaining 200 miles at the dearer station
+        purchases = solve_min_cost([0.0, 200.0], [2.0, 3.0], 500.0, 300.0, 0.0)
+        self.assertEqual(purchases, [Purchase(0, 0.0, 300.0), Purchase(1, 200.0, 200.0)])
+        self.assertEqual(self.cost(purchases, [2.0, 3.0]), 1200.0)
+
+    def test_skips_dearer_stations_within_reach_of_the_fill_up(self):
+        # From the 2.0 station a full tank reaches the 2.5 one, past the 4.0 one
+        purchases = solve_min_cost([0.0, 100.0, 250.0], [2.0, 4.0, 2.5], 450.0, 300.0, 0.0)
+        self.assertEqual(purchases, [Purchase(0, 0.0, 300.0), Purchase(2, 250.0, 150.0)])
+
+    def test_minimum_purchase_rounds_small_purchases_up(self):
+        # 50 miles are needed at mile 50, 80 are bought; the extra 30 reduce the purchase at the cheaper station
+        purchases = solve_min_cost([50.0, 150.0], [3.0, 2.0], 400.0, 300.0, 100.0, min_purchase=80.0)
+        self.assertEqual(purchases, [Purchase(0, 50.0, 80.0), Purchase(1, 150.0, 220.0)])
+
+    def test_minimum_purchase_never_overfills_the_tank(self):
+        purchases = solve_min_cost([50.0, 150.0], [3.0, 2.0], 400.0, 300.0, 100.0, min_purchase=1000.0)
+        self.assertEqual(purchases[0], Purchase(0, 50.0, 250.0))
+
+    def test_arrives_with_end_range(self):
+        purchases = solve_min_cost([0.0, 200.0], [2.0, 3.0], 500.0, 400.0, 0.0, end_range=100.0)
+        self.assertEqual(purchases, [Purchase(0, 0.0, 400.0), Purchase(1, 200.0, 200.0)])
+
+    def test_gap_longer_than_the_tank_is_infeasible(self):
+        with self.assertRaisesMessage(InfeasibleRouteError, 'No fuel station within range of mile 50.0'):
+            solve_min_cost([50.0, 400.0], [3.0, 2.0], 500.0, 300.0, 100.0)
+
+    def test_first_station_out_of_reach_is_infeasible(self):
+        with self.assertRaises(InfeasibleRouteError):
+            solve_min_cost([150.0], [3.0], 400.0, 300.0, 100.0)
+        with self.assertRaises(InfeasibleRouteError):
+            solve_min_cost([], [], 400.0, 300.0, 100.0)
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_synthetic_data_is_reproducible(self):
+        first, second = synthetic_snapshot(100, seed=3), synthetic_snapshot(100, seed=3)
+        self.assertEqual(first.lats.tolist(), second.lats.tolist())
+        self.assertEqual(first.prices.tolist(), second.prices.tolist())
+        coordinates, miles = synthetic_route(300, seed=1)
+        self.assertEqual(synthetic_route(300, seed=1), (coordinates, miles))
+        self.assertAlmostEqual(miles, 300, delta=1)
+
+    def test_plan_summary(self):
+        plan = {
+            'total_distance': 900.0,
+            'total_cost': 150.0,
+            'fuel_stops': [
+                {'distance_from_start': 400.0, 'gallons': 30.0},
+                {'distance_from_start': 700.0, 'gallons': 20.0},
+            ],
+        }
+        summary = plan_summary(plan, 500.0, 10.0)
+        self.assertEqual(summary['stops'], 2)
+        self.assertEqual(summary['cost_per_gallon'], 3.0)
+        # Leaves with 50 gallons, buys 50 and burns 90
+        self.assertEqual(summary['end_gallons'], 10.0)
+        self.assertTrue(summary['feasible'])
+        plan['fuel_stops'] = []
+        self.assertFalse(plan_summary(plan, 500.0, 10.0)['feasible'])
+
+    def test_compare_matches_rows_by_their_parameters(self):
+        baseline = {'solvers': [{'stations': 1000, 'route_miles': 800.0, 'greedy': {'ms': 10.0}},
+                                {'stations': 5000, 'route_miles': 800.0, 'greedy': {'ms': 20.0}}]}
+        current = {'solvers': [{'stations': 5000, 'route_miles': 800.0, 'greedy': {'ms': 21.0}},
+                               {'stations': 1000, 'route_miles': 800.0, 'greedy': {'ms': 12.0}}]}
+        changes = compare(baseline, current, tolerance_pct=10.0)
+        self.assertEqual(changes['/solvers/stations=1000,route_miles=800.0/greedy/ms']['change_pct'], 20.0)
+        self.assertTrue(changes['/solvers/stations=1000,route_miles=800.0/greedy/ms']['regression'])
+        self.assertFalse(changes['/solvers/stations=5000,route_miles=800.0/greedy/ms']['regression'])
+
+    def test_benchmark_command_writes_a_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.json')
+            call_command(
+                'benchmark', suite=['solvers', 'distance'], stations=[2000], route_miles=[600], repeat=1,
+                output=output,
+            )
+            with open(output) as file:
+                report = json.load(file)
+        self.assertEqual(report['meta']['options']['stations'], [2000])
+        [row] = report['solvers']
+        self.assertEqual((row['stations'], row['route_miles']), (2000, report['meta']['route_miles'][0]))
+        self.assertIn('ms', row['greedy'])
+        self.assertTrue(report['distance'])
+
+
+class DistanceTests(SimpleTestCase):
+    def test_ellipsoidal_matches_the_wgs84_reference_distances(self):
+        # One degree of latitude at 45 degrees is 111.132 km, one of longitude on the equator 111.319 km
+        self.assertAlmostEqual(float(ellipsoidal(44.5, 0.0, 45.5, 0.0)), 111.1324 / 1.609344, delta=0.01)
+        self.assertAlmostEqual(float(ellipsoidal(0.0, 0.0, 0.0, 1.0)), 111.3195 / 1.609344, delta=0.01)
+        # Half the equator
+        self.assertAlmostEqual(float(ellipsoidal(0.0, 0.0, 0.0, 180.0)), 20037.508 / 1.609344, delta=0.1)
+
+    def test_haversine_is_within_half_a_percent(self):
+        lats1, lons1 = np.array([40.64, 25.8, 47.6]), np.array([-73.78, -80.3, -122.3])
+        lats2, lons2 = np.array([33.94, 47.6, 32.8]), np.array([-118.41, -122.3, -96.8])
+        spherical, exact = haversine(lats1, lons1, lats2, lons2), ellipsoidal(lats1, lons1, lats2, lons2)
+        self.assertTrue(np.all(np.abs(spherical / exact - 1) < 0.005))
+
+    def test_coincident_points_are_zero_apart(self):
+        self.assertEqual(float(ellipsoidal(40.0, -100.0, 40.0, -100.0)), 0.0)
+        self.assertEqual(float(haversine(40.0, -100.0, 40.0, -100.0)), 0.0)
+
+    def test_arguments_broadcast(self):
+        lats = np.array([40.0, 41.0, 42.0])
+        distances = distance(lats, -100.0, 40.0, -100.0, mode='haversine')
+        self.assertEqual(distances.shape, (3,))
+        self.assertEqual(distances[0], 0.0)
+        self.assertAlmostEqual(float(distances[2]), 2 * float(distances[1]), places=6)
+
+    def test_path_lengths(self):
+        lengths = path_lengths([40.0, 40.0, 41.0], [-100.0, -99.0, -99.0])
+        self.assertEqual(lengths.shape, (2,))
+        self.assertAlmostEqual(float(lengths[0]), float(ellipsoidal(40.0, -100.0, 40.0, -99.0)))
+        self.assertAlmostEqual(float(lengths[1]), float(ellipsoidal(40.0, -99.0, 41.0, -99.0)))
+
+    @override_settings(FUEL_ROUTER_DISTANCE_MODE='haversine')
+    def test_mode_setting(self):
+        self.assertEqual(get_distance_mode(), 'haversine')
+        self.assertEqual(float(distance(0.0, 0.0, 0.0, 1.0)), float(haversine(0.0, 0.0, 0.0, 1.0)))
+        with self.settings(FUEL_ROUTER_DISTANCE_MODE='flat'), self.assertRaises(ValueError):
+            get_distance_mode()
+
+
+class StationSnapshotTests(TestCase):
+    def setUp(self):
+        invalidate_snapshot()
+        self.addCleanup(invalidate_snapshot)
+        create_station(1, 40.0, -100.0)
+
+    def test_loads_the_geocoded_stations_at_the_current_version(self):
+        create_station(2, None, None)
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot.opis_ids.tolist(), [1])
+        self.assertEqual(snapshot.prices.tolist(), [3.0])
+        self.assertEqual(snapshot.version, StationDataVersion.current())
+        self.assertEqual(snapshot.station(0)['station_id'], 1)
+        # Viewport clusters are only built when a viewport asks for them
+        self.assertIsNone(snapshot._clusters)
+
+    def test_saving_a_station_reloads_the_snapshot(self):
+        first = get_snapshot()
+        self.assertIs(get_snapshot(), first)
+        create_station(2, 41.0, -101.0)
+        second = get_snapshot()
+        self.assertEqual(second.opis_ids.tolist(), [1, 2])
+        self.assertGreater(second.version, first.version)
+
+    @override_settings(FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL=3600)
+    def test_bumps_by_other_processes_are_checked_at_an_interval(self):
+        first = get_snapshot()
+        StationDataVersion.bump()
+        self.assertIs(get_snapshot(), first)
+        with self.settings(FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL=0):
+            self.assertEqual(get_snapshot().version, first.version + 1)
+
+
+class SnapshotReloadTests(SimpleTestCase):
+    def setUp(self):
+        invalidate_snapshot()
+        self.addCleanup(invalidate_snapshot)
+
+    def test_concurrent_reloads_of_a_version_build_one_snapshot(self):
+        loads = []
+
+        def from_queryset(queryset, version=0):
+            loads.append(version)
+            time.sleep(0.05)
+            return make_snapshot([(40.0, -100.0, 3.0)], version)
+
+        with mock.patch.object(StationDataVersion, 'current', return_value=7), \
+                mock.patch.object(StationSnapshot, 'from_queryset', side_effect=from_queryset), \
+                mock.patch.object(station_snapshot, 'invalidate_gazetteer'):
+            threads = [threading.Thread(target=load_snapshot) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            snapshot = get_snapshot()
+
+        self.assertEqual(loads, [7])
+        self.assertEqual(snapshot.version, 7)
+
+
+class MinCostPlannerTests(SimpleTestCase):
+    """About 265 miles of route along the 40th parallel with a 100 mile tank, so both modes search 20 miles."""
+
+    route = parallel_route(40.0, -100.0, -95.0)
+
+    def plan(self, stations):
+        snapshot = make_snapshot(stations)
+        total_distance = build_corridor(snapshot, self.route, 1.0).total_distance
+        return RouteOptimizer().find_min_cost_fuel_stops(self.route, total_distance, 100.0, 10.0, snapshot)
+
+    def on_route(self, lon, price=3.0):
+        return 40.0, lon, price
+
+    def test_uses_stations_off_the_route_within_the_search_radius(self):
+        # The stations on the route leave a 138 mile gap; one 8 miles off bridges it
+        result = self.plan([
+            self.on_route(-99.2), (40.116, -97.8, 4.0), self.on_route(-96.6), self.on_route(-95.9),
+        ])
+        self.assertIn(2, [stop['station_id'] for stop in result['fuel_stops']])
+
+    def test_infeasible_beyond_the_search_radius(self):
+        with self.assertRaises(InfeasibleRouteError):
+            self.plan([self.on_route(-99.2), (40.435, -97.8, 4.0), self.on_route(-96.6), self.on_route(-95.9)])
+
+    def test_never_costs_more_than_greedy_for_the_same_fuel(self):
+        optimizer = RouteOptimizer()
+        for seed in range(4):
+            snapshot = synthetic_snapshot(3000, seed=seed)
+            coordinates, miles = synthetic_route(600 + 400 * seed, seed=seed)
+            start, end = (coordinates[0][1], coordinates[0][0]), (coordinates[-1][1], coordinates[-1][0])
+            for tank_range, mpg in ((500.0, 10.0), (300.0, 6.0)):
+                with self.subTest(seed=seed, tank_range=tank_range):
+                    greedy = optimizer.find_optimal_fuel_stops(
+                        start, end, coordinates, miles, tank_range, mpg, snapshot=snapshot
+                    )
+                    # Greedy fills up at every stop; min_cost has to arrive with as much fuel left over
+                    arrival = min(max(end_range(greedy, tank_range, mpg), 0.0), tank_range)
+                    min_cost = optimizer.find_min_cost_fuel_stops(
+                        coordinates, miles, tank_range, mpg, snapshot=snapshot, end_range=arrival
+                    )
+                    self.assertLessEqual(min_cost['total_cost'], greedy['total_cost'] + 1e-9)
+
+
+class StationGridIndexTests(SimpleTestCase):
+    def test_stations_in_cells(self):
+        lats = np.array([40.1, 40.2, 41.3, 40.4, -0.1])
+        lons = np.array([-99.9, -99.6, -99.9, -99.8, 0.1])
+        index = StationGridIndex(lats, lons, cell_size=0.5)
+        self.assertEqual(index.cell(lats).tolist(), [80, 80, 82, 80, -1])
+        self.assertEqual(len(index.keys), 3)
+
+        # Grouped by cell, in the order asked for; empty cells contribute nothing
+        keys = cell_keys(np.array([82, 81, 80]), np.array([-200, -200, -200]))
+        rows, positions = index.stations_in(keys)
+        self.assertEqual(rows.tolist(), [2, 0, 1, 3])
+        self.assertEqual(positions.tolist(), [0, 2, 2, 2])
+
+    def test_empty_index(self):
+        index = StationGridIndex(np.empty(0), np.empty(0))
+        rows, positions = index.stations_in(cell_keys(np.array([80]), np.array([-200])))
+        self.assertEqual((rows.size, positions.size), (0, 0))
+
+
+class CorridorTests(SimpleTestCase):
+    """About 53 miles of route along the 40th parallel; 0.1 degree of latitude is 6.9 miles."""
+
+    route = parallel_route(40.0, -100.0, -99.0, 0.1)
+
+    def test_projects_stations_within_the_width(self):
+        snapshot = make_snapshot([
+            (40.0, -99.5, 3.0),  # On the route, half way
+            (40.1, -100.0, 3.0),  # 6.9 miles north of the start
+            (41.0, -99.5, 3.0),  # 69 miles off
+            (40.0, -100.5, 3.0),  # 26 miles before the start
+        ])
+        corridor = build_corridor(snapshot, self.route, 10.0)
+
+        self.assertAlmostEqual(corridor.total_distance, 53.0, delta=0.5)
+        stations = list(corridor)
+        self.assertEqual([station.station for station in stations], [1, 0])
+        self.assertAlmostEqual(stations[0].milepost, 0.0, delta=0.1)
+        self.assertAlmostEqual(stations[0].offset, 6.9, delta=0.1)
+        self.assertAlmostEqual(stations[1].milepost, corridor.total_distance / 2, delta=0.1)
+        self.assertAlmostEqual(stations[1].offset, 0.0, delta=0.01)
+
+        self.assertEqual(corridor.rows[corridor.between(-1.0, 1.0)].tolist(), [1])
+        rows, _ = corridor.within(1.0)
+        self.assertEqual(rows.tolist(), [0])
+
+    def test_scales_mileposts_to_the_router_distance(self):
+        snapshot = make_snapshot([(40.0, -99.5, 3.0)])
+        corridor = build_corridor(snapshot, self.route, 5.0, total_distance=100.0)
+        self.assertAlmostEqual(corridor.total_distance, 100.0)
+        self.assertAlmostEqual(float(corridor.mileposts[0]), 50.0, delta=0.1)
+
+    def test_near_finds_stations_on_a_stretch_that_winds_back(self):
+        # Out along the parallel and back 3.5 miles further north: the station is beside the start, but its
+        # nearest route point is at the end of the return leg, over 100 miles further on
+        route = self.route + parallel_route(40.05, -100.0, -99.0, 0.1)[::-1]
+        snapshot = make_snapshot([(40.06, -99.99, 3.0)])
+        corridor = build_corridor(snapshot, route, 5.0)
+
+        self.assertGreater(float(corridor.mileposts[0]), 100.0)
+        self.assertEqual(corridor.rows[corridor.between(-5.0, 5.0)].tolist(), [])
+        self.assertEqual(corridor.rows[corridor.near(40.0, -100.0, 5.0)].tolist(), [0])
+        self.assertEqual(corridor.near(40.0, -99.5, 5.0).tolist(), [])
+
+
+class TieredCacheTests(SimpleTestCase):
+    def test_lru_evicts_the_least_recently_used_entry(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, MISSING, 3))
+
+    def test_lru_entries_expire(self):
+        cache = LRUCache()
+        cache.set('a', 1, -1)
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual(len(cache), 0)
+
+    def test_get_or_set_computes_once(self):
+        cache = TieredCache('test', 60, shared_alias=None)
+        calls = []
+        for _ in range(3):
+            self.assertEqual(cache.get_or_set('key', lambda: calls.append(1) or 'value'), 'value')
+        self.assertEqual(len(calls), 1)
+        stats = cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (2, 1))
+
+    def test_ttl_for_sets_the_ttl_per_value(self):
+        cache = TieredCache('test', 60, shared_alias=None)
+        cache.get_or_set('miss', lambda: None, ttl_for=lambda value: -1 if value is None else None)
+        cache.get_or_set('hit', lambda: 'value', ttl_for=lambda value: -1 if value is None else None)
+        self.assertIs(cache.get('miss'), MISSING)
+        self.assertEqual(cache.get('hit'), 'value')
+
+    def test_async_get_or_set(self):
+        cache = TieredCache('test', 60, shared_alias=None)
+
+        async def compute():
+            return 'value'
+
+        self.assertEqual(asyncio.run(cache.aget_or_set('key', compute)), 'value')
+        self.assertEqual(cache.get('key'), 'value')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    })
+    def test_shared_hits_are_promoted_to_the_local_tier(self):
+        TieredCache('test', 60).set('key', 'value')
+        cache = TieredCache('test', 60)
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        stats = cache.stats()
+        self.assertEqual((stats['shared_hits'], stats['local_hits'], stats['local_size']), (1, 1, 1))
+
+    def test_geocode_misses_get_the_short_ttl(self):
+        self.assertEqual(geocode_ttl((None, None)), cache_ttl('geocode_miss'))
+        self.assertIsNone(geocode_ttl((40.0, -100.0)))
+
+
+@override_settings(FUEL_ROUTER_CACHE_TTLS={'geocode_miss': -1}, **OFFLINE)
+class GeocodeCacheTests(SimpleTestCase):
+    def test_misses_are_cached_with_their_own_ttl(self):
+        optimizer = RouteOptimizer()
+        with mock.patch.object(optimizer.geocoder, 'geocode', wraps=optimizer.geocoder.geocode) as geocode:
+            for _ in range(2):
+                self.assertEqual(optimizer.geocode_location('Denver, CO'), (39.7392, -104.9903))
+                self.assertEqual(optimizer.geocode_location('Nowhere, ZZ'), (None, None))
+        # The miss expired at once and was asked again; the hit came from the cache
+        self.assertEqual(
+            [call.args[0] for call in geocode.call_args_list], ['Denver, CO', 'Nowhere, ZZ', 'Nowhere, ZZ']
+        )
+
+
+@override_settings(**OFFLINE)
+class AsyncPlanRouteTests(PlanRouteMixin, SimpleTestCase):
+    async_url = '/api/plan-route/async/'
+
+    def without_route_id(self, data):
+        return {key: value for key, value in data.items() if key not in ('route_id', 'map_url')}
+
+    def test_matches_the_sync_endpoint(self):
+        trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+        bodies = [
+            trip,
+            dict(trip, optimization='min_cost', geometry_format='polyline'),
+            dict(trip, waypoints=['Kansas City, MO'], vehicles=[{'tank_range': 400, 'mpg': 8}, {'mpg': 12}]),
+            dict(trip, alternatives=2, geometry_format='none'),
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                expected = self.post_plan(body)
+                get_plan_cache().cache.clear()
+                actual = self.post_plan(body, self.async_url)
+                self.assertEqual(self.without_route_id(actual), self.without_route_id(expected))
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(self.async_url).status_code, 405)
+        response = self.client.post(self.async_url, b'{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.post_plan({'start': 'Dallas, TX'}, self.async_url, status=400)
+        data = self.post_plan({'start': 'Nowhere, ZZ', 'end': 'Denver, CO'}, self.async_url, status=400)
+        self.assertEqual(data['error'], "Could not geocode 'Nowhere, ZZ'")
+
+    def test_executor_tasks_close_stale_connections(self):
+        with mock.patch('fuel_router_app.async_optimizer.close_old_connections') as close_old_connections:
+            self.assertEqual(run_task(lambda: 'plan'), 'plan')
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_spaces_slots_within_the_process(self):
+        limiter = RateLimiter(2.0)
+        waits = [limiter.reserve() for _ in range(3)]
+        self.assertEqual(waits[0], 0.0)
+        self.assertAlmostEqual(waits[1], 0.5, places=2)
+        self.assertAlmostEqual(waits[2], 1.0, places=2)
+
+    def test_no_rate_never_waits(self):
+        self.assertEqual(RateLimiter(None).reserve(), 0.0)
+
+    def test_limiters_sharing_a_lock_file_share_the_rate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'nominatim.lock')
+            # One limiter per worker process
+            first, second = RateLimiter(2.0, path), RateLimiter(2.0, path)
+            waits = [first.reserve(), second.reserve(), first.reserve()]
+        self.assertEqual(waits[0], 0.0)
+        self.assertAlmostEqual(waits[1], 0.5, places=2)
+        self.assertAlmostEqual(waits[2], 1.0, places=2)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_the_threshold_and_half_opens_after_the_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_request('osrm')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('osrm')
+
+        breaker.opened_at -= 30.0
+        self.assertEqual(breaker.state, 'half_open')
+        breaker.before_request('osrm')
+        # Only one trial request goes through while half open
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('osrm')
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_request('osrm')
+
+
+class UpstreamRetryTests(SimpleTestCase):
+    def setUp(self):
+        self.upstream = Upstream('osrm', 'http://osrm.test/', retries=2, failure_threshold=10)
+        self.upstream.session = mock.Mock()
+        sleep = mock.patch('fuel_router_app.upstream.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def response(self, status):
+        return mock.Mock(status_code=status)
+
+    def test_retries_retryable_statuses_with_backoff(self):
+        self.upstream.session.get.side_effect = [self.response(503), self.response(429), self.response(200)]
+        response = self.upstream.get('/route/v1/driving/1,2;3,4', params={'overview': 'false'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.upstream.session.get.call_count, 3)
+        self.assertEqual(self.upstream.session.get.call_args.args, ('http://osrm.test/route/v1/driving/1,2;3,4',))
+        backoffs = [args.args[0] for args in self.sleep.call_args_list if args.args[0]]
+        self.assertEqual(len(backoffs), 2)
+        self.assertTrue(0.25 <= backoffs[0] <= 0.75 and 0.5 <= backoffs[1] <= 1.5)
+        self.assertEqual(self.upstream.stats.snapshot()['retries'], 2)
+        self.assertEqual(self.upstream.breaker.failures, 0)
+
+    def test_returns_the_last_response_once_retries_are_exhausted(self):
+        self.upstream.session.get.return_value = self.response(502)
+        self.assertEqual(self.upstream.get('/route').status_code, 502)
+        self.assertEqual(self.upstream.session.get.call_count, 3)
+
+    def test_does_not_retry_client_errors(self):
+        self.upstream.session.get.return_value = self.response(400)
+        self.assertEqual(self.upstream.get('/route').status_code, 400)
+        self.assertEqual(self.upstream.session.get.call_count, 1)
+
+    def test_reraises_connection_errors_and_opens_the_circuit(self):
+        from requests import ConnectionError
+
+        self.upstream.breaker.failure_threshold = 3
+        self.upstream.session.get.side_effect = ConnectionError('refused')
+        with self.assertRaises(ConnectionError):
+            self.upstream.get('/route')
+        self.assertEqual(self.upstream.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.upstream.get('/route')
+        self.assertEqual(self.upstream.session.get.call_count, 3)
+
+
+@override_settings(FUEL_ROUTER_CACHE_TTLS={'geocode_miss': -1}, **OFFLINE)
+class ImportStationsTests(TestCase):
+    cities = {'Denver': (39.7392, -104.9903), 'Dallas': (32.7767, -96.797), 'Tulsa': (36.154, -95.9928)}
+
+    def setUp(self):
+        get_cache('geocode').local.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.csv_path = os.path.join(self.directory.name, 'prices.csv')
+        self.checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+        with open(self.csv_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['OPIS Truckstop ID', 'Truckstop Name', 'Address', 'City', 'State', 'Rack ID',
+                             'Retail Price'])
+            for opis_id, city, state in [(1, 'Denver', 'CO'), (2, 'Dallas', 'TX'), (3, 'Tulsa', 'OK')]:
+                writer.writerow([opis_id, f'Stop {opis_id}', 'I-70 EXIT 1', city, state, 100, '3.199'])
+
+    def geocode(self, location):
+        return self.cities.get(location.split(', ')[-3], (None, None))
+
+    def import_stations(self, geocode=None, **options):
+        with mock.patch.object(ImportStationsCommand, 'geocode_location', side_effect=geocode or self.geocode) as m, \
+                redirect_stdout(io.StringIO()):
+            call_command('import_stations', file=self.csv_path, checkpoint=self.checkpoint, batch_size=1,
+                         workers=1, **options)
+        return [call.args[0] for call in m.call_args_list]
+
+    def test_misses_are_cached_with_the_miss_ttl(self):
+        command = ImportStationsCommand()
+        command.geocode_cache = get_cache('geocode')
+        with mock.patch.object(command, 'geocode_location', side_effect=self.geocode) as geocode:
+            for _ in range(2):
+                self.assertEqual(command.cached_geocode('Denver, CO, USA'), self.cities['Denver'])
+                self.assertEqual(command.cached_geocode('Nowhere, ZZ, USA'), (None, None))
+        self.assertEqual(
+            [call.args[0] for call in geocode.call_args_list],
+            ['Denver, CO, USA', 'Nowhere, ZZ, USA', 'Nowhere, ZZ, USA'],
+        )
+
+    def test_resumes_an_interrupted_import_from_the_checkpoint(self):
+        def fail_after_denver(location):
+            if 'Denver' not in location:
+                raise KeyboardInterrupt
+            return self.geocode(location)
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.import_stations(fail_after_denver)
+        self.assertEqual(list(FuelStation.objects.values_list('opis_id', flat=True)), [1])
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file)['next_row'], 1)
+
+        # Rows before the checkpoint are not read again, even if their stations were since deleted
+        FuelStation.objects.all().delete()
+        queries = self.import_stations()
+        self.assertFalse(any('Denver' in query for query in queries))
+        self.assertEqual(sorted(FuelStation.objects.values_list('opis_id', flat=True)), [2, 3])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_of_another_file_or_restart_is_ignored(self):
+        with open(self.checkpoint, 'w') as file:
+            json.dump({'file': os.path.abspath(self.csv_path), 'next_row': 2}, file)
+        self.import_stations(restart=True)
+        self.assertEqual(FuelStation.objects.count(), 3)
+
+        FuelStation.objects.all().delete()
+        with open(self.checkpoint, 'w') as file:
+            json.dump({'file': '/elsewhere/prices.csv', 'next_row': 2}, file)
+        self.import_stations()
+        self.assertEqual(FuelStation.objects.count(), 3)
+
+
+@override_settings(**OFFLINE)
+class RouteMapTests(PlanRouteMixin, SimpleTestCase):
+    def test_map_is_rendered_on_the_first_request_and_cached(self):
+        data = self.post_plan({'start': 'Dallas, TX', 'end': 'Denver, CO'})
+        self.assertEqual(data['map_url'], f"http://testserver/api/maps/{data['route_id']}/")
+        with mock.patch('fuel_router_app.maps.generate_map', wraps=maps.generate_map) as generate_map:
+            for _ in range(2):
+                response = self.client.get(data['map_url'])
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'text/html')
+                self.assertIn(b'leaflet', response.content)
+        self.assertEqual(generate_map.call_count, 1)
+
+    def test_stores_the_simplified_geometry(self):
+        line = [[-100.0 + i * 0.001, 40.0] for i in range(1001)]
+        with override_settings(FUEL_ROUTER_MAP_SIMPLIFY_METERS=25.0):
+            route_id = maps.store_route(line, [])
+        self.assertEqual(get_cache('map_route').get(route_id)['geometry'], [line[0], line[-1]])
+
+    def test_unknown_route_id_is_not_found(self):
+        self.assertEqual(self.client.get('/api/maps/0123456789abcdef/').status_code, 404)
+
+
+@override_settings(FUEL_ROUTER_BATCH_WORKERS=0, **OFFLINE)
+class BatchStreamTests(PlanRouteMixin, SimpleTestCase):
+    url = '/api/plan-route/batch/'
+    trips = [
+        {'trip_id': 'a', 'start': 'Dallas, TX', 'end': 'Denver, CO'},
+        {'trip_id': 'b', 'start': 'dallas, tx', 'end': 'Denver, CO'},
+        {'trip_id': 'c', 'start': 'Dallas, TX', 'end': 'Denver, CO', 'optimization': 'min_cost'},
+        {'trip_id': 'd', 'start': 'Nowhere, ZZ', 'end': 'Denver, CO'},
+    ]
+
+    def post_batch(self, trips):
+        response = self.client.post(self.url, {'trips': trips}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return {loads(line)['trip_id']: loads(line) for line in b''.join(response.streaming_content).splitlines()}
+
+    def test_streams_one_line_per_trip(self):
+        results = self.post_batch(self.trips)
+        self.assertEqual(sorted(result['index'] for result in results.values()), [0, 1, 2, 3])
+        self.assertEqual(results['a']['total_cost'], results['b']['total_cost'])
+        self.assertLessEqual(results['c']['total_cost'], results['a']['total_cost'])
+        self.assertEqual(results['d']['error'], "Could not geocode 'Nowhere, ZZ'")
+        # In-process batches never install the pool workers' state
+        self.assertIsNone(batch._worker_state)
+
+    def test_process_pool_is_kept_for_the_snapshot(self):
+        expected = self.post_batch(self.trips)
+        self.addCleanup(batch.shutdown_pool)
+        with override_settings(FUEL_ROUTER_BATCH_WORKERS=2, FUEL_ROUTER_BATCH_START_METHOD='fork'):
+            self.assertEqual(self.post_batch(self.trips), expected)
+            pool = batch._pool
+            self.assertEqual(self.post_batch(self.trips), expected)
+            self.assertIs(batch._pool, pool)
+
+            with override_snapshot(synthetic_snapshot(self.snapshot_size)):
+                self.post_batch(self.trips[:2])
+            self.assertIsNot(batch._pool, pool)
+
+    def test_rejects_an_empty_batch(self):
+        response = self.client.post(self.url, {'trips': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(FUEL_ROUTER_BATCH_MAX_TRIPS=2)
+    def test_rejects_an_oversized_batch_before_validating_it(self):
+        with mock.patch('fuel_router_app.views.BatchRouteRequestSerializer') as serializer:
+            response = self.client.post(self.url, {'trips': [{}] * 3}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(loads(response.content), {'error': 'At most 2 trips per batch'})
+        serializer.assert_not_called()
+
+
+class GeometryTests(SimpleTestCase):
+    def test_encode_polyline_matches_the_reference_vector(self):
+        coordinates = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        encoded = encode_polyline(coordinates)
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(polyline.decode(encoded, geojson=True), [tuple(point) for point in coordinates])
+
+    def test_simplify_keeps_points_beyond_the_tolerance(self):
+        line = [[-100.0 + i * 0.001, 40.0] for i in range(101)]
+        self.assertEqual(simplify(line, 1.0), [line[0], line[-1]])
+        # East for 50 points, then north: the corner is over 1 km from the straight line
+        corner = line[:51] + [[-99.95, 40.0 + i * 0.001] for i in range(1, 51)]
+        self.assertEqual(simplify(corner, 25.0), [corner[0], corner[50], corner[-1]])
+        self.assertEqual(len(simplify(corner, 5000.0)), 2)
+        self.assertEqual(simplify(corner, 0), corner)
+
+
+@override_settings(**OFFLINE)
+class RouteGeometryOptionsTests(PlanRouteMixin, SimpleTestCase):
+    trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+
+    def test_geometry_formats(self):
+        coordinates = self.post_plan(self.trip)['route_coordinates']
+        data = self.post_plan(dict(self.trip, geometry_format='polyline'))
+        self.assertNotIn('route_coordinates', data)
+        decoded = polyline.decode(data['route_polyline'], geojson=True)
+        self.assertEqual(len(decoded), len(coordinates))
+        np.testing.assert_allclose(decoded, coordinates, atol=1e-5)
+
+        data = self.post_plan(dict(self.trip, geometry_format='none', simplify_tolerance=50))
+        self.assertFalse({'route_coordinates', 'route_polyline'} & data.keys())
+        self.post_plan(dict(self.trip, geometry_format='geojson'), status=400)
+
+    def test_simplify_tolerance(self):
+        coordinates = self.post_plan(self.trip)['route_coordinates']
+        simplified = self.post_plan(dict(self.trip, simplify_tolerance=100))['route_coordinates']
+        self.assertLess(len(simplified), len(coordinates))
+        self.assertEqual([simplified[0], simplified[-1]], [coordinates[0], coordinates[-1]])
+        self.post_plan(dict(self.trip, simplify_tolerance=-1), status=400)
+
+    def test_include_steps_asks_the_router_for_them(self):
+        get_cache('route').local.clear()
+        step = {'instruction': 'Head north', 'distance': 1.0}
+        original_route = SyntheticRouter.route
+
+        def route(router, points, steps=False):
+            return dict(original_route(router, points, steps), steps=[step] if steps else [])
+
+        with mock.patch.object(SyntheticRouter, 'route', autospec=True, side_effect=route) as router:
+            self.assertNotIn('steps', self.post_plan(self.trip))
+            get_plan_cache().cache.clear()
+            self.assertEqual(self.post_plan(dict(self.trip, include_steps=True))['steps'], [step])
+        self.assertEqual([call.args[2] for call in router.call_args_list], [False, True])
+
+
+class UpdatePricesTests(TestCase):
+    def setUp(self):
+        for opis_id, price in [(1, '3.000'), (2, '3.500')]:
+            create_station(opis_id, 40.0, -100.0, price)
+        file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        self.addCleanup(os.remove, file.name)
+        with file:
+            file.write(
+                'OPIS Truckstop ID,Truckstop Name,Retail Price\n'
+                '1,Station 1,3.1234\n'
+                '1,Station 1,9.999\n'  # Only the first row of a station counts
+                '2,Station 2,3.5\n'  # Unchanged
+                '3,Station 3,2.000\n'  # Not imported
+            )
+        self.path = file.name
+
+    def update_prices(self, **options):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('update_prices', file=self.path, **options)
+        return output.getvalue()
+
+    def prices(self):
+        return dict(FuelStation.objects.values_list('opis_id', 'retail_price'))
+
+    def test_updates_changed_prices_and_bumps_the_version(self):
+        version = StationDataVersion.current()
+        output = self.update_prices()
+        self.assertIn('Read 4 rows: 1 price changes, 1 stations not imported yet, 0 invalid prices', output)
+        self.assertEqual({opis_id: str(price) for opis_id, price in self.prices().items()}, {1: '3.123', 2: '3.500'})
+        self.assertEqual(StationDataVersion.current(), version + 1)
+
+    def test_dry_run_writes_nothing(self):
+        version, prices = StationDataVersion.current(), self.prices()
+        self.assertIn('Would update 1 fuel station prices', self.update_prices(dry_run=True))
+        self.assertEqual(self.prices(), prices)
+        self.assertEqual(StationDataVersion.current(), version)
+
+
+class PlanCacheTests(SimpleTestCase):
+    def test_plan_key_normalizes_queries_and_numbers(self):
+        self.assertEqual(
+            plan_key('  Dallas,TX ', 'Denver, CO', 1, tank_range=500, mpg=10.0),
+            plan_key('dallas, tx', 'denver,  co', 1, mpg=10, tank_range=500.0),
+        )
+        self.assertNotEqual(plan_key('Dallas, TX', 'Denver, CO', 1), plan_key('Dallas, TX', 'Denver, CO', 2))
+
+    def test_single_flight_coalesces_concurrent_calls(self):
+        flights, release, calls, results = SingleFlight(), threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'plan'
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while flights.coalesced < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['plan'] * 4)
+        self.assertEqual(flights.coalesced, 3)
+
+    def test_single_flight_shares_errors_and_forgets_them(self):
+        flights, release, errors = SingleFlight(), threading.Event(), []
+
+        def fail():
+            release.wait(5)
+            raise InfeasibleRouteError('no stations')
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except InfeasibleRouteError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while flights.coalesced < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flights.do('key', lambda: 'plan'), 'plan')
+
+    def test_async_single_flight_coalesces_calls_on_the_loop(self):
+        flights, calls = SingleFlight(), []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'plan'
+
+        async def main():
+            return await asyncio.gather(*(flights.ado('key', compute) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), ['plan'] * 3)
+        self.assertEqual((len(calls), flights.coalesced), (1, 2))
+
+    @override_settings(FUEL_ROUTER_SHARED_CACHE=None)
+    def test_plan_cache_plans_once(self):
+        cache, calls = PlanCache('test_plan'), []
+        for _ in range(2):
+            plan = cache.get_or_plan('key', lambda: calls.append(1) or {'total_cost': 1.0})
+            self.assertEqual(plan, {'total_cost': 1.0})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['local_hits'], 1)
+
+
+class VehicleTests(SimpleTestCase):
+    def test_ranges_leave_out_the_reserve(self):
+        vehicle = Vehicle(tank_gallons=100, mpg=6, start_fuel=0.5, reserve=0.1, min_purchase=20)
+        self.assertEqual(vehicle.tank_range, 600)
+        self.assertAlmostEqual(vehicle.usable_range, 540)
+        self.assertAlmostEqual(vehicle.start_range, 240)
+        self.assertEqual(vehicle.planning_kwargs()['min_gallons'], 20)
+        self.assertEqual(DEFAULT_VEHICLE.tank_range, 500)
+
+
+@override_settings(**OFFLINE)
+class VehicleProfileTests(PlanRouteMixin, TestCase):
+    trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+
+    def setUp(self):
+        super().setUp()
+        VehicleProfile.objects.create(name='reefer', tank_gallons=100, mpg=6, reserve=0.1)
+
+    def test_default_vehicle(self):
+        self.assertEqual(self.post_plan(self.trip)['vehicle'], DEFAULT_VEHICLE.as_dict())
+
+    def test_profile_with_overrides(self):
+        vehicle = self.post_plan(dict(self.trip, vehicle={'profile': 'reefer'}))['vehicle']
+        self.assertEqual((vehicle['name'], vehicle['tank_range'], vehicle['reserve']), ('reefer', 600, 0.1))
+        vehicle = self.post_plan(dict(self.trip, vehicle={'profile': 'reefer', 'mpg': 8}))['vehicle']
+        self.assertEqual((vehicle['name'], vehicle['mpg'], vehicle['tank_range']), ('reefer', 8, 800))
+
+    def test_unknown_profile_is_a_bad_request(self):
+        data = self.post_plan(dict(self.trip, vehicle={'profile': 'hovercraft'}), status=400)
+        self.assertEqual(data['vehicle']['profile'], ["Unknown vehicle profile 'hovercraft'"])
+        data = self.post_plan(dict(self.trip, vehicles=[{'mpg': 8}, {'profile': 'hovercraft'}]), status=400)
+        self.assertIn('vehicles', data)
+
+    def test_invalid_vehicles(self):
+        self.post_plan(dict(self.trip, vehicle={'start_fuel': 0.1, 'reserve': 0.2}), status=400)
+        self.post_plan(dict(self.trip, vehicle={'tank_gallons': 10, 'min_purchase': 20}), status=400)
+        self.post_plan(dict(self.trip, vehicle={'mpg': 8}, vehicles=[{'mpg': 8}]), status=400)
+
+    def test_plans_every_vehicle_on_the_route(self):
+        data = self.post_plan(dict(self.trip, vehicles=[{'profile': 'reefer'}, {'mpg': 12}]))
+        self.assertEqual([plan['vehicle']['mpg'] for plan in data['plans']], [6, 12])
+        self.assertEqual(data['vehicle'], data['plans'][0]['vehicle'])
+        self.assertEqual(data['total_cost'], data['plans'][0]['total_cost'])
+        # Twice the mileage, less than half the fuel bought
+        self.assertLess(2 * float(data['plans'][1]['total_cost']), float(data['plans'][0]['total_cost']))
+
+
+class WaypointLegsTests(SimpleTestCase):
+    """About 265 miles along the 40th parallel, through a waypoint at mile 150, with a 200 mile tank."""
+
+    route = parallel_route(40.0, -100.0, -95.0)
+
+    def plan(self, legs, optimization='min_cost'):
+        snapshot = make_snapshot([(40.0, -97.5, 3.0), (40.0, -96.5, 2.5)])
+        total_distance = build_corridor(snapshot, self.route, 1.0).total_distance
+        return RouteOptimizer().plan_fuel_stops(
+            (40.0, -100.0), (40.0, -95.0), self.route, total_distance, 200.0, 10.0, optimization=optimization,
+            snapshot=snapshot, legs=legs,
+        ), total_distance
+
+    def test_fuel_carries_over_to_the_next_leg(self):
+        result, total_distance = self.plan([{'distance': 150.0}, {'distance': 115.0}])
+        # The tank is not refilled at the waypoint: the 50 miles left after the first leg reach the cheaper station
+        [stop] = result['fuel_stops']
+        self.assertEqual((stop['station_id'], stop['leg']), (2, 1))
+        self.assertAlmostEqual(stop['gallons'], (total_distance - 200.0) / 10.0)
+
+    def test_stops_are_tagged_with_their_leg(self):
+        legs = [{'distance': 100.0}, {'distance': 165.0}]
+        for optimization in ('greedy', 'min_cost'):
+            with self.subTest(optimization=optimization):
+                result, _ = self.plan(legs, optimization)
+                without_legs, _ = self.plan(None, optimization)
+                self.assertEqual(
+                    [stop['leg'] for stop in result['fuel_stops']],
+                    [int(stop['distance_from_start'] > 100.0) for stop in result['fuel_stops']],
+                )
+                for stop in result['fuel_stops']:
+                    stop.pop('leg')
+                self.assertEqual(result, without_legs)
+
+
+@override_settings(**OFFLINE)
+class WaypointRouteTests(PlanRouteMixin, SimpleTestCase):
+    def test_reports_each_leg(self):
+        data = self.post_plan({'start': 'Dallas, TX', 'waypoints': ['Kansas City, MO'], 'end': 'Denver, CO'})
+        self.assertEqual(
+            [(leg['start'], leg['end']) for leg in data['legs']],
+            [('Dallas, TX', 'Kansas City, MO'), ('Kansas City, MO', 'Denver, CO')],
+        )
+        self.assertAlmostEqual(sum(leg['distance'] for leg in data['legs']), data['total_distance'], places=3)
+        legs = [stop['leg'] for stop in data['fuel_stops']]
+        self.assertTrue(legs)
+        self.assertEqual(legs, sorted(legs))
+        self.assertLessEqual(set(legs), {0, 1})
+
+    def test_too_many_waypoints(self):
+        self.post_plan({'start': 'Dallas, TX', 'waypoints': ['Kansas City, MO'] * 24, 'end': 'Denver, CO'}, status=400)
+
+
+class SyntheticRouterTests(SimpleTestCase):
+    points = [(32.7767, -96.797), (39.0997, -94.5786), (39.7392, -104.9903)]
+
+    def test_route_through_waypoints(self):
+        route = SyntheticRouter(spacing_miles=1.0).route(self.points)
+        self.assertEqual(len(route['legs']), 2)
+        self.assertAlmostEqual(sum(leg['distance'] for leg in route['legs']), route['distance'])
+        self.assertAlmostEqual(route['duration'], route['distance'] / 55.0)
+        self.assertEqual(route['geometry'][0], [-96.797, 32.7767])
+        self.assertEqual(route['geometry'][-1], [-104.9903, 39.7392])
+        self.assertEqual(route['geometry'].count([-94.5786, 39.0997]), 1)
+        # Densified to about one point per mile
+        self.assertLess(abs(len(route['geometry']) - route['distance']), 10)
+
+    def test_alternatives_detour_on_either_side(self):
+        start, end = (40.0, -100.0), (40.0, -95.0)
+        routes = SyntheticRouter().routes([start, end], alternatives=2)
+        self.assertEqual(len(routes), 3)
+        self.assertTrue(all(route['distance'] > routes[0]['distance'] for route in routes[1:]))
+        middles = [route['geometry'][len(route['geometry']) // 2][1] for route in routes[1:]]
+        self.assertGreater(middles[0], 40.0)
+        self.assertLess(middles[1], 40.0)
+        self.assertEqual([len(route['legs']) for route in routes], [1, 1, 1])
+        # No alternatives through via points
+        self.assertEqual(len(SyntheticRouter().routes(self.points, alternatives=2)), 1)
+
+
+class ReplayRouterTests(SimpleTestCase):
+    points = [(40.0, -100.0), (40.0, -99.8)]
+    response = {
+        'code': 'Ok',
+        'routes': [{
+            'distance': 16093.4,
+            'duration': 720,
+            'geometry': {'coordinates': [[-100.0, 40.0], [-99.8, 40.0]]},
+            'legs': [{'distance': 16093.4, 'duration': 720, 'steps': [{'name': 'I-70'}]}],
+        }],
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def record(self, steps):
+        router = OSRMRouter(record_dir=self.directory)
+        with mock.patch.object(router.upstream, 'get', return_value=mock.Mock(content=dumps(self.response))) as get:
+            route = router.route(self.points, steps)
+        self.assertEqual(get.call_args.kwargs['params']['steps'], 'true' if steps else 'false')
+        return route
+
+    def test_replays_recorded_responses(self):
+        recorded = self.record(steps=True)
+        self.assertEqual((round(recorded['distance'], 6), recorded['duration']), (10.0, 0.2))
+        replay = ReplayRouter(self.directory)
+        self.assertEqual(replay.route(self.points, steps=True), recorded)
+        # A recording with steps answers a request without them
+        self.assertEqual(replay.route(self.points), dict(recorded, steps=[]))
+
+    def test_misses_go_to_the_fallback(self):
+        self.record(steps=False)
+        with self.assertRaisesMessage(ValueError, 'no recorded response'):
+            ReplayRouter(self.directory).route(self.points, steps=True)
+        with self.assertRaises(ValueError):
+            ReplayRouter(self.directory).route([(35.0, -90.0), (36.0, -90.0)])
+
+        replay = ReplayRouter(self.directory, fallback={'BACKEND': 'fuel_router_app.backends.SyntheticRouter'})
+        self.assertEqual(replay.route(self.points, steps=True)['geometry'][0], [-100.0, 40.0])
+        self.assertEqual(len(replay.routes([(35.0, -90.0), (36.0, -90.0)], alternatives=1)), 2)
+
+    def test_failed_responses_are_not_recorded(self):
+        router = OSRMRouter(record_dir=self.directory)
+        failed = mock.Mock(content=dumps({'code': 'NoRoute', 'routes': []}))
+        with mock.patch.object(router.upstream, 'get', return_value=failed):
+            with self.assertRaises(ValueError):
+                router.route(self.points)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class OfflineBackendTests(SimpleTestCase):
+    def test_gazetteer_geocoder_falls_back_to_the_city(self):
+        geocoder = GazetteerGeocoder()
+        self.assertEqual(geocoder.geocode('Denver, CO'), (39.7392, -104.9903))
+        self.assertEqual(geocoder.geocode('1 Main St, Denver, CO, USA'), (39.7392, -104.9903))
+        self.assertEqual(geocoder.geocode('Nowhere, ZZ'), (None, None))
+
+    def test_backends_follow_the_settings(self):
+        with override_settings(FUEL_ROUTER_ROUTER={
+            'BACKEND': 'fuel_router_app.backends.SyntheticRouter', 'OPTIONS': {'speed_mph': 60.0},
+        }):
+            router = get_router()
+            self.assertIsInstance(router, SyntheticRouter)
+            self.assertEqual(router.speed_mph, 60.0)
+            self.assertIs(get_router(), router)
+        with override_settings(**OFFLINE):
+            self.assertIsNot(get_router(), router)
+
+
+class InstrumentationTests(SimpleTestCase):
+    def test_trace_sums_stages_and_counters(self):
+        with start_trace() as trace:
+            for _ in range(2):
+                with stage('test_stage'):
+                    count('test_events', 3)
+        self.assertIsNone(current_trace())
+        data = trace.as_dict()
+        self.assertEqual(data['counters'], {'test_events': 6})
+        self.assertEqual(list(data['stages_ms']), ['test_stage'])
+        self.assertRegex(trace.server_timing(), r'^test_stage;dur=\d+\.\d{3}$')
+
+    def test_propagate_carries_the_trace_into_thread_pools(self):
+        def work(n):
+            with stage('test_pooled'):
+                count('test_pooled_events', n)
+
+        with start_trace() as trace, ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(propagate(work), range(10)))
+            list(pool.map(work, range(10)))
+        self.assertEqual(trace.counters, {'test_pooled_events': 45})
+
+    def test_histogram_buckets(self):
+        histogram = Histogram(buckets=(0.01, 0.1))
+        for seconds in (0.005, 0.01, 0.05, 1.0):
+            histogram.observe('plan', seconds)
+        counts, total = histogram.snapshot()['plan']
+        self.assertEqual(counts, [2, 1, 1])
+        self.assertAlmostEqual(total, 1.065)
+
+
+@override_settings(**OFFLINE)
+class MetricsTests(PlanRouteMixin, SimpleTestCase):
+    trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+
+    def timings(self, response):
+        return dict(metric.split(';dur=') for metric in response['Server-Timing'].split(', '))
+
+    def test_server_timing_header(self):
+        response = self.client.post(self.url, self.trip, content_type='application/json')
+        timings = self.timings(response)
+        self.assertLessEqual({'request', 'validate', 'geocode', 'route', 'corridor', 'optimize', 'serialize'},
+                             timings.keys())
+        self.assertGreaterEqual(float(timings['request']), float(timings['optimize']))
+
+        get_plan_cache().cache.clear()
+        response = self.client.post('/api/plan-route/async/', self.trip, content_type='application/json')
+        self.assertIn('optimize', self.timings(response))
+
+    def test_debug_timings(self):
+        self.assertNotIn('debug_timings', self.post_plan(self.trip))
+        get_plan_cache().cache.clear()
+        timings = self.post_plan(dict(self.trip, debug_timings=True))['debug_timings']
+        self.assertIn('optimize', timings['stages_ms'])
+        self.assertGreater(timings['counters']['candidate_stations'], 0)
+
+    def test_metrics_endpoint(self):
+        self.post_plan(self.trip)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('# TYPE fuel_router_stage_seconds histogram', text)
+        self.assertRegex(text, r'fuel_router_stage_seconds_bucket\{stage="optimize",le="\+Inf"\} [1-9]')
+        self.assertRegex(text, r'fuel_router_cache_lookups_total\{cache="plan",result="misses"\} [1-9]')
+
+
+class StationRTreeTests(TestCase):
+    def setUp(self):
+        if not has_station_rtree(connection.alias):
+            self.skipTest('SQLite without R*Tree support')
+        self.stations = [
+            create_station(opis_id, lat, lon)
+            for opis_id, lat, lon in [(1, 40.0, -100.0), (2, 41.0, -101.0), (3, 35.0, -90.0)]
+        ]
+
+    def rtree_ids(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {STATION_RTREE_TABLE} ORDER BY id')
+            return [row[0] for row in cursor.fetchall()]
+
+    def opis_ids(self, queryset):
+        return sorted(queryset.values_list('opis_id', flat=True))
+
+    def test_triggers_keep_the_rtree_in_step(self):
+        self.assertEqual(self.rtree_ids(), [station.pk for station in self.stations])
+
+        station = self.stations[0]
+        station.lat, station.lon = 30.0, -80.0
+        station.save()
+        self.assertEqual(self.opis_ids(FuelStation.objects.in_bbox(29.0, -81.0, 31.0, -79.0)), [1])
+        self.assertEqual(self.opis_ids(FuelStation.objects.in_bbox(39.5, -100.5, 40.5, -99.5)), [])
+
+        self.stations[1].delete()
+        self.assertEqual(self.rtree_ids(), [self.stations[0].pk, self.stations[2].pk])
+
+    def test_in_boxes(self):
+        boxes = [(39.5, -100.5, 40.5, -99.5), (34.5, -90.5, 35.5, -89.5)]
+        self.assertEqual(self.opis_ids(FuelStation.objects.in_boxes(boxes)), [1, 3])
+        self.assertEqual(self.opis_ids(FuelStation.objects.in_boxes([])), [])
+        # Overlapping boxes return each station once
+        self.assertEqual(self.opis_ids(FuelStation.objects.in_boxes([boxes[0], boxes[0]])), [1])
+
+    def test_in_boxes_matches_the_fallback_query(self):
+        boxes = [(39.5, -101.5, 41.5, -99.5), (34.5, -90.5, 35.5, -89.5)]
+        expected = self.opis_ids(FuelStation.objects.in_boxes(boxes))
+        with mock.patch('fuel_router_app.models.has_station_rtree', return_value=False):
+            self.assertEqual(self.opis_ids(FuelStation.objects.in_boxes(boxes)), expected)
+        self.assertEqual(expected, [1, 2, 3])
+
+
+class GazetteerTests(SimpleTestCase):
+    gazetteer_rows = [
+        ('Springfield', 'IL', 39.8, -89.6),
+        ('Springfield', 'MO', 37.2, -93.3),
+        ('Dallas', 'TX', 32.8, -96.8),
+    ]
+
+    def test_place_key(self):
+        self.assertEqual(place_key('  New York,NY, USA '), 'new york, ny')
+        self.assertEqual(place_key('Dallas, Texas, United States'), 'dallas, tx')
+        self.assertEqual(place_key('Dallas'), 'dallas')
+
+    def test_lookup(self):
+        gazetteer = Gazetteer.from_rows(self.gazetteer_rows)
+        self.assertEqual(gazetteer.lookup('dallas, texas'), (32.8, -96.8))
+        self.assertEqual(gazetteer.lookup('Springfield, MO'), (37.2, -93.3))
+        # A bare city name only resolves when a single state has it
+        self.assertEqual(gazetteer.lookup('Dallas'), (32.8, -96.8))
+        self.assertIsNone(gazetteer.lookup('Springfield'))
+        self.assertIsNone(gazetteer.lookup('Austin, TX'))
+        stats = gazetteer.stats()
+        self.assertEqual((stats['exact_hits'], stats['prefix_hits'], stats['misses']), (2, 1, 2))
+
+
+@override_settings(FUEL_ROUTER_GAZETTEER=True, FUEL_ROUTER_GAZETTEER_FILE=None, FUEL_ROUTER_SHARED_CACHE=None)
+class StationGazetteerTests(TestCase):
+    def setUp(self):
+        create_station(1, 35.2, -101.8, city='Amarillo', state='TX')
+        create_station(2, 35.3, -101.9, city='Amarillo', state='TX')
+        invalidate_gazetteer()
+        self.addCleanup(invalidate_gazetteer)
+
+    def test_station_cities_are_answered_without_the_geocoder(self):
+        optimizer = RouteOptimizer()
+        with mock.patch.object(optimizer, '_fetch_geocode', return_value=(None, None)) as fetch_geocode:
+            lat, lon = optimizer.geocode_location('amarillo, texas')
+            self.assertEqual(optimizer.geocode_location('Lubbock, TX'), (None, None))
+        self.assertAlmostEqual(lat, 35.25)
+        self.assertAlmostEqual(lon, -101.85)
+        fetch_geocode.assert_called_once_with('Lubbock, TX')
+
+
+class RankAlternativesTests(SimpleTestCase):
+    def plans(self):
+        return [
+            {'route': {'distance': 100.0, 'duration': 2.0}, 'results': [{'total_cost': 100.0}]},
+            {'route': {'distance': 120.0, 'duration': 2.5}, 'error': 'No fuel stations in range'},
+            {'route': {'distance': 150.0, 'duration': 3.0}, 'results': [{'total_cost': 90.0}]},
+        ]
+
+    @override_settings(FUEL_ROUTER_COST_PER_MILE=0.4, FUEL_ROUTER_COST_PER_HOUR=40.0)
+    def test_ranks_by_trip_cost(self):
+        ranked = RouteOptimizer().rank_alternatives(self.plans())
+        self.assertEqual([plan['index'] for plan in ranked], [0, 2, 1])
+        self.assertEqual([plan.get('trip_cost') for plan in ranked], [220.0, 270.0, None])
+
+    @override_settings(FUEL_ROUTER_COST_PER_MILE=0.0, FUEL_ROUTER_COST_PER_HOUR=0.0)
+    def test_ranks_by_fuel_cost_alone_without_operating_costs(self):
+        ranked = RouteOptimizer().rank_alternatives(self.plans())
+        self.assertEqual([plan['index'] for plan in ranked], [2, 0, 1])
+
+    def test_fails_when_no_alternative_can_be_planned(self):
+        plans = [plan for plan in self.plans() if 'error' in plan]
+        with self.assertRaisesMessage(ValueError, 'No fuel stations in range'):
+            RouteOptimizer().rank_alternatives(plans)
+
+
+@override_settings(**OFFLINE)
+class AlternativeRoutesTests(PlanRouteMixin, SimpleTestCase):
+    trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+
+    def test_reports_the_cheapest_alternative(self):
+        data = self.post_plan(dict(self.trip, alternatives=2))
+        alternatives = data['alternatives']
+        self.assertEqual([alternative['rank'] for alternative in alternatives], [0, 1, 2])
+        self.assertEqual(sorted(alternative['index'] for alternative in alternatives), [0, 1, 2])
+        trip_costs = [float(alternative['trip_cost']) for alternative in alternatives]
+        self.assertEqual(trip_costs, sorted(trip_costs))
+        self.assertEqual(data['total_cost'], alternatives[0]['total_cost'])
+        self.assertEqual(data['total_distance'], alternatives[0]['total_distance'])
+        self.assertEqual(data['fuel_stops'], alternatives[0]['fuel_stops'])
+
+    def test_no_alternatives_by_default(self):
+        self.assertNotIn('alternatives', self.post_plan(self.trip))
+        self.post_plan(dict(self.trip, alternatives=4), status=400)
+
+
+class FastJSONTests(SimpleTestCase):
+    data = {
+        'route_id': 'abc',
+        'total_cost': Decimal('123.4560'),
+        'route_coordinates': [[-100.0 + i / 1000, 40.5] for i in range(50)],
+        'fuel_stops': [{'name': 'Café 66', 'price': 3.199, 'leg': None}],
+        'debug_timings': {'stages_ms': {}, 'elapsed_ms': 1.5},
+    }
+
+    def test_orjson_matches_the_stdlib_backend(self):
+        encoded = dumps(self.data)
+        with override_settings(FUEL_ROUTER_JSON_BACKEND='json'):
+            self.assertEqual(dumps(self.data), encoded)
+            self.assertEqual(loads(encoded), loads(encoded.decode()))
+        # Serializers hand the renderers costs as strings (COERCE_DECIMAL_TO_STRING)
+        serialized = dict(self.data, total_cost='123.4560')
+        self.assertEqual(dumps(serialized), JSONRenderer().render(serialized))
+        self.assertEqual(dumps({'stops': np.array([1.5, 2.0])}), b'{"stops":[1.5,2.0]}')
+
+    def test_iter_json_splices_chunks_into_one_document(self):
+        self.assertEqual(b''.join(iter_json(self.data, chunk_items=7)), dumps(self.data))
+        self.assertEqual(b''.join(iter_json({}, chunk_items=7)), b'{}')
+
+    def test_renderer(self):
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(self.data), dumps(self.data))
+        self.assertEqual(renderer.render(None), b'')
+        indented = renderer.render({'a': [1]}, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render({'a': [1]}, 'application/json; indent=2'))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"start": "Zürich"}'.encode())), {'start': 'Zürich'})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"start": '))
+
+
+@override_settings(**OFFLINE)
+class JSONResponseTests(PlanRouteMixin, SimpleTestCase):
+    trip = {'start': 'Dallas, TX', 'end': 'Denver, CO'}
+
+    def test_long_routes_are_streamed_as_the_same_document(self):
+        response = self.client.post(self.url, self.trip, content_type='application/json')
+        self.assertFalse(response.streaming)
+        with override_settings(FUEL_ROUTER_JSON_STREAM_ITEMS=100):
+            get_plan_cache().cache.clear()
+            streamed = self.client.post(self.url, self.trip, content_type='application/json')
+        self.assertTrue(streamed.streaming)
+        expected, actual = loads(response.content), loads(b''.join(streamed.streaming_content))
+        self.assertEqual(
+            {key: value for key, value in actual.items() if key not in ('route_id', 'map_url')},
+            {key: value for key, value in expected.items() if key not in ('route_id', 'map_url')},
+        )
+
+    def test_malformed_body(self):
+        response = self.client.post(self.url, b'{"start": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', loads(response.content)['detail'])
+
+
+@override_settings(FUEL_ROUTER_GAZETTEER=True, FUEL_ROUTER_GAZETTEER_FILE=None, FUEL_ROUTER_WARMUP_IMPORTS=['json'])
+class WarmUpTests(TestCase):
+    def setUp(self):
+        create_station(1, 35.2, -101.8, city='Amarillo', state='TX')
+        create_station(2, 39.7, -105.0, city='Denver', state='CO')
+        for reset in (invalidate_snapshot, invalidate_gazetteer):
+            reset()
+            self.addCleanup(reset)
+
+    def test_loads_the_snapshot_index_and_gazetteer(self):
+        timings = warm_up()
+        self.assertEqual(list(timings), ['snapshot', 'spatial_index', 'gazetteer', 'import json'])
+        snapshot = station_snapshot._snapshot
+        self.assertEqual(len(snapshot), 2)
+        self.assertIsNotNone(snapshot._index)
+        self.assertTrue(gazetteer_loaded())
+        # The first request finds everything in memory
+        with self.assertNumQueries(0):
+            self.assertIs(get_snapshot(), snapshot)
+
+    @override_settings(FUEL_ROUTER_STATION_SOURCE='database')
+    def test_database_station_source_keeps_no_snapshot(self):
+        self.assertEqual(list(warm_up()), ['snapshot', 'gazetteer', 'import json'])
+        self.assertIsNone(station_snapshot._snapshot)
+
+    @override_settings(FUEL_ROUTER_PRELOAD_SNAPSHOT=False)
+    def test_preload_can_be_turned_off(self):
+        self.assertIsNone(preload())
+        self.assertIsNone(station_snapshot._snapshot)
+        self.assertFalse(gazetteer_loaded())
+
+
+class StationClustersTests(SimpleTestCase):
+    def test_every_level_accounts_for_every_station(self):
+        snapshot = synthetic_snapshot(500)
+        clusters = StationClusters(snapshot, max_zoom=6)
+        self.assertEqual(len(clusters.levels), 7)
+        for level in clusters.levels:
+            self.assertEqual(int(level.counts.sum()), 500)
+
+    def test_clusters_and_stations_in_a_box(self):
+        snapshot = make_snapshot([(40.0, -100.0, 3.0), (40.001, -100.001, 2.0), (35.0, -90.0, 4.0)])
+        clusters = StationClusters(snapshot, max_zoom=6)
+
+        [cluster] = clusters.clusters(6, (39.0, -101.0, 41.0, -99.0))
+        self.assertEqual((cluster['count'], cluster['min_price'], cluster['avg_price']), (2, 2.0, 2.5))
+        self.assertEqual(sum(cluster['count'] for cluster in clusters.clusters(0, (-85.0, -180.0, 85.0, 180.0))), 3)
+
+        stations = clusters.stations((39.9995, -100.0005, 40.0005, -99.9995))
+        self.assertEqual([station['station_id'] for station in stations], [1])
+
+
+@override_settings(FUEL_ROUTER_CLUSTER_MAX_ZOOM=12, FUEL_ROUTER_VIEWPORT_LIMIT=5000)
+class StationViewportTests(SnapshotMixin, SimpleTestCase):
+    url = '/api/stations/'
+
+    def test_clusters_at_low_zoom(self):
+        response = self.client.get(self.url, {'bbox': '-180,-85,180,85', 'zoom': 3})
+        self.assertEqual(response.status_code, 200)
+        data = loads(response.content)
+        self.assertTrue(data['clustered'])
+        self.assertEqual(sum(cluster['count'] for cluster in data['clusters']), 2000)
+
+    def test_stations_at_high_zoom(self):
+        lat, lon = float(self.snapshot.lats[0]), float(self.snapshot.lons[0])
+        bbox = f'{lon - 0.01},{lat - 0.01},{lon + 0.01},{lat + 0.01}'
+        data = loads(self.client.get(self.url, {'bbox': bbox, 'zoom': 15}).content)
+        self.assertFalse(data['clustered'])
+        self.assertIn(int(self.snapshot.opis_ids[0]), [station['station_id'] for station in data['stations']])
+
+    @override_settings(FUEL_ROUTER_VIEWPORT_LIMIT=5)
+    def test_truncates_at_the_limit(self):
+        data = loads(self.client.get(self.url, {'bbox': '-180,-85,180,85', 'zoom': 20}).content)
+        self.assertEqual(len(data['stations']), 5)
+        self.assertTrue(data['truncated'])
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, {'bbox': '-100,30,-90,40', 'zoom': 5})
+        etag = response['ETag']
+        response = self.client.get(self.url, {'bbox': '-100,30,-90,40', 'zoom': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Invalid parameters are rejected whatever the ETag
+        response = self.client.get(self.url, {'bbox': '-90,30,-100,40', 'zoom': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 400)
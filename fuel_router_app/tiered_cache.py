@@ -0,0 +1,237 @@
+"""
+Two-tier cache for upstream results (geocoding, routes, ...).
+
+Tier 1 is a bounded in-process LRU, so repeated lookups in a worker cost a dict access. Tier 2 is a Django
+cache alias shared by every worker on the host (a file-based cache by default, so no Redis is needed and it
+survives restarts). Each named cache has its own TTL and hit/miss counters; ``get_or_set`` callers can give some
+values (e.g. failed lookups) a different TTL.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .instrumentation import trace_count
+
+MISSING = object()
+
+DEFAULT_TTLS = {
+    'geocode': 30 * 24 * 3600,
+    # Locations the geocoder did not find: soon retried, in case that was a transient upstream miss
+    'geocode_miss': 600,
+    'route': 24 * 3600,
+    'map_route': 24 * 3600,
+    'map_html': 24 * 3600,
+    'plan': 3600,
+}
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU with a per-entry expiry."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    """In-process LRU in front of a shared Django cache alias."""
+
+    def __init__(self, name: str, ttl: float, local_size: int = 1024, shared_alias: Optional[str] = 'shared'):
+        self.name = name
+        self.ttl = ttl
+        self.local = LRUCache(local_size)
+        self.shared_alias = shared_alias
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        # Lookups come from request threads and the planners' thread pools at once
+        self._stats_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        if not self.shared_alias:
+            return None
+        try:
+            return caches[self.shared_alias]
+        except InvalidCacheBackendError:
+            return None
+
+    def _shared_key(self, key: str) -> str:
+        return f'fuel_router:{self.name}:{key}'
+
+    def get(self, key: str) -> Any:
+        """Return the cached value or ``MISSING``, promoting shared-tier hits into the local LRU."""
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.hit('local')
+            return value
+
+        shared = self.shared
+        if shared is not None:
+            value = shared.get(self._shared_key(key), MISSING)
+            if value is not MISSING:
+                self.hit('shared')
+                self.local.set(key, value, self.ttl)
+                return value
+
+        with self._stats_lock:
+            self.misses += 1
+        trace_count(f'{self.name}_cache_misses')
+        return MISSING
+
+    def hit(self, tier: str) -> None:
+        with self._stats_lock:
+            if tier == 'local':
+                self.local_hits += 1
+            else:
+                self.shared_hits += 1
+        trace_count(f'{self.name}_cache_hits')
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store in both tiers for ``ttl`` seconds (default: the cache's TTL)."""
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, ttl)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self._shared_key(key), value, timeout=ttl)
+
+    def get_or_set(
+            self,
+            key: str,
+            compute: Callable[[], Any],
+            ttl_for: Optional[Callable[[Any], Optional[float]]] = None
+    ) -> Any:
+        """Cached value, or ``compute()`` stored for ``ttl_for(value)`` seconds (None: the cache's TTL)."""
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.set(key, value, ttl_for(value) if ttl_for else None)
+        return value
+
+    async def aget_or_set(
+            self,
+            key: str,
+            compute: Callable[[], Awaitable[Any]],
+            ttl_for: Optional[Callable[[Any], Optional[float]]] = None
+    ) -> Any:
+        """Async ``get_or_set``; shared-tier I/O runs in a worker thread so the event loop never blocks on it."""
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.hit('local')
+            return value
+
+        value = await sync_to_async(self.get, thread_sensitive=False)(key)
+        if value is MISSING:
+            value = await compute()
+            await sync_to_async(self.set, thread_sensitive=False)(key, value, ttl_for(value) if ttl_for else None)
+        return value
+
+    def clear(self) -> None:
+        """Drop the local tier only; shared entries expire through their TTL."""
+        self.local.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            local_hits, shared_hits, misses = self.local_hits, self.shared_hits, self.misses
+        lookups = local_hits + shared_hits + misses
+        return {
+            'local_hits': local_hits,
+            'shared_hits': shared_hits,
+            'misses': misses,
+            'hit_ratio': (local_hits + shared_hits) / lookups if lookups else 0.0,
+            'local_size': len(self.local),
+        }
+
+
+_caches: Dict[str, TieredCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str) -> TieredCache:
+    """Return the process-wide tiered cache for a data type, configured from settings on first use."""
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                local_sizes = getattr(settings, 'FUEL_ROUTER_LOCAL_CACHE_SIZES', {})
+                cache = TieredCache(
+                    name,
+                    ttl=cache_ttl(name),
+                    local_size=local_sizes.get(name, getattr(settings, 'FUEL_ROUTER_LOCAL_CACHE_SIZE', 1024)),
+                    shared_alias=getattr(settings, 'FUEL_ROUTER_SHARED_CACHE', 'shared'),
+                )
+                _caches[name] = cache
+    return cache
+
+
+def cache_ttl(name: str) -> float:
+    """TTL (seconds) of a kind of cached value, from ``FUEL_ROUTER_CACHE_TTLS`` or the defaults."""
+    return dict(DEFAULT_TTLS, **getattr(settings, 'FUEL_ROUTER_CACHE_TTLS', {})).get(name, 3600)
+
+
+@receiver(setting_changed)
+def _reset_caches(setting, **kwargs):
+    # Rebuild the caches from the new settings, e.g. under override_settings
+    if setting in ('FUEL_ROUTER_CACHE_TTLS', 'FUEL_ROUTER_LOCAL_CACHE_SIZE', 'FUEL_ROUTER_LOCAL_CACHE_SIZES',
+                   'FUEL_ROUTER_SHARED_CACHE'):
+        with _caches_lock:
+            _caches.clear()
+
+
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a free-text location query."""
+    return ' '.join(query.lower().replace(',', ', ').split()).strip(' ,')
+
+
+def query_key(query: str) -> str:
+    """Cache key for a free-text query; hashed because shared backends reject spaces and long keys."""
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+def coordinates_key(*points: Tuple[float, float], precision: int = 5) -> str:
+    """Cache key for a sequence of (lat, lon) points rounded to ``precision`` decimals (~1 m at 5)."""
+    return ';'.join(f'{round(lat, precision)},{round(lon, precision)}' for lat, lon in points)
@@ -0,0 +1,327 @@
+"""
+Shared clients for the upstream HTTP services (Nominatim, OSRM).
+
+Every upstream gets a keep-alive ``requests.Session`` with its own connection pool, connect/read timeouts,
+retries with jittered exponential backoff, a circuit breaker and a client-side rate limiter (shared by the
+processes on the host through a lock file, see ``RateLimiter``), plus latency counters. The same policy objects
+guard the async path, which shares one pooled ``httpx.AsyncClient`` per event loop. Upstreams are configured in ``settings.FUEL_ROUTER_UPSTREAMS``.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    # Imported on first use: a worker that never calls an upstream (cache hits, maps) never loads them
+    import httpx
+    import requests
+
+DEFAULT_UPSTREAMS = {
+    'nominatim': {
+        'base_url': 'https://nominatim.openstreetmap.org',
+        # Nominatim's usage policy allows at most one request per second
+        'rate_limit': 1.0,
+    },
+    'osrm': {
+        # Using public OSRM instance - you can also host your own
+        'base_url': 'http://router.project-osrm.org',
+        'rate_limit': None,
+    },
+}
+
+DEFAULT_POLICY = {
+    'connect_timeout': 3.0,
+    'read_timeout': 10.0,
+    'pool_size': 20,
+    'retries': 2,
+    'backoff': 0.5,
+    'max_backoff': 8.0,
+    'failure_threshold': 5,
+    'reset_timeout': 30.0,
+    'user_agent': 'RouteOptimizer/1.0',
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class RateLimiter:
+    """Spaces requests at least ``1 / rate`` seconds apart.
+
+    Without a ``lock_file`` the spacing only holds within this process, so N server workers together send up to
+    N times the rate. With one, each slot is claimed under an exclusive lock on that file, which holds the next
+    free slot, so every process on the host shares the budget.
+    """
+
+    def __init__(self, rate: Optional[float], lock_file: Optional[str] = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock_file = lock_file
+        self._next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Claim the next request slot and return how long the caller must wait for it."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            if self.lock_file:
+                return self._reserve_shared()
+            now = time.monotonic()
+            slot = max(now, self._next_allowed)
+            self._next_allowed = slot + self.interval
+            return slot - now
+
+    def _reserve_shared(self) -> float:
+        import fcntl
+
+        with open(self.lock_file, 'a+b') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                data = file.read()
+                # Wall-clock time: monotonic clocks are not comparable between processes
+                now = time.time()
+                slot = max(now, float(data) if data else 0.0)
+                file.seek(0)
+                file.truncate()
+                file.write(repr(slot + self.interval).encode())
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return slot - now
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets one trial request through after ``reset_timeout``."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def before_request(self, name: str) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f'{name} is unavailable (circuit open after {self.failures} failures)')
+            # Half-open: push the window forward so concurrent callers wait for this trial request
+            self.opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += 0 if ok else 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'avg_ms': 1000 * self.total_seconds / self.requests if self.requests else 0.0,
+                'max_ms': 1000 * self.max_seconds,
+            }
+
+
+class Upstream:
+    def __init__(
+        self, name: str, base_url: str, rate_limit: Optional[float] = None, rate_limit_file: Optional[str] = None,
+        **policy,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.policy = dict(DEFAULT_POLICY, **policy)
+        self.limiter = RateLimiter(rate_limit, rate_limit_file)
+        self.breaker = CircuitBreaker(self.policy['failure_threshold'], self.policy['reset_timeout'])
+        self.stats = LatencyStats()
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.policy['pool_size'])
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = self.policy['user_agent']
+
+    def url(self, path: str) -> str:
+        return f'{self.base_url}/{path.lstrip("/")}'
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.policy['backoff'] * 2 ** attempt, self.policy['max_backoff'])
+        return delay * random.uniform(0.5, 1.5)
+
+    def get(self, path: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> 'requests.Response':
+        """GET ``path`` under the upstream's base URL, retrying connection errors and retryable statuses.
+
+        The last response is returned once retries are exhausted on a retryable status, so callers keep
+        handling status codes themselves; connection errors are re-raised.
+        """
+        from requests import RequestException
+
+        timeout = (self.policy['connect_timeout'], self.policy['read_timeout'])
+        for attempt in range(self.policy['retries'] + 1):
+            self.breaker.before_request(self.name)
+            time.sleep(self.limiter.reserve())
+
+            started = time.perf_counter()
+            try:
+                response = self.session.get(self.url(path), params=params, headers=headers, timeout=timeout)
+            except RequestException:
+                self._failed(started)
+                if attempt == self.policy['retries']:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._succeeded(started)
+                    return response
+                self._failed(started)
+                if attempt == self.policy['retries']:
+                    return response
+
+            self.stats.record_retry()
+            time.sleep(self._backoff(attempt))
+
+    async def aget(self, path: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> 'httpx.Response':
+        """Async ``get`` over the shared pooled ``httpx.AsyncClient``, with the same retry and breaker policy."""
+        import httpx
+
+        client = get_async_client()
+        headers = dict({'User-Agent': self.policy['user_agent']}, **(headers or {}))
+        timeout = httpx.Timeout(self.policy['read_timeout'], connect=self.policy['connect_timeout'])
+        for attempt in range(self.policy['retries'] + 1):
+            self.breaker.before_request(self.name)
+            await asyncio.sleep(self.limiter.reserve())
+
+            started = time.perf_counter()
+            try:
+                response = await client.get(self.url(path), params=params, headers=headers, timeout=timeout)
+            except httpx.HTTPError:
+                self._failed(started)
+                if attempt == self.policy['retries']:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self._succeeded(started)
+                    return response
+                self._failed(started)
+                if attempt == self.policy['retries']:
+                    return response
+
+            self.stats.record_retry()
+            await asyncio.sleep(self._backoff(attempt))
+
+    def _succeeded(self, started: float) -> None:
+        self.stats.record(time.perf_counter() - started, ok=True)
+        self.breaker.record_success()
+
+    def _failed(self, started: float) -> None:
+        self.stats.record(time.perf_counter() - started, ok=False)
+        self.breaker.record_failure()
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """Process-wide client for a configured upstream."""
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.get(name)
+            if upstream is None:
+                config = {
+                    'connect_timeout': getattr(settings, 'FUEL_ROUTER_HTTP_CONNECT_TIMEOUT', DEFAULT_POLICY['connect_timeout']),
+                    'read_timeout': getattr(settings, 'FUEL_ROUTER_HTTP_READ_TIMEOUT', DEFAULT_POLICY['read_timeout']),
+                    'pool_size': getattr(settings, 'FUEL_ROUTER_HTTP_POOL_SIZE', DEFAULT_POLICY['pool_size']),
+                }
+                rate_limit_dir = getattr(settings, 'FUEL_ROUTER_RATE_LIMIT_DIR', None)
+                if rate_limit_dir:
+                    os.makedirs(rate_limit_dir, exist_ok=True)
+                    config['rate_limit_file'] = os.path.join(rate_limit_dir, f'{name}.lock')
+                config.update(DEFAULT_UPSTREAMS.get(name, {}))
+                config.update(getattr(settings, 'FUEL_ROUTER_UPSTREAMS', {}).get(name, {}))
+                upstream = Upstream(name, **config)
+                _upstreams[name] = upstream
+    return upstream
+
+
+def upstream_stats() -> Dict[str, Dict[str, float]]:
+    return {
+        name: dict(upstream.stats.snapshot(), circuit=upstream.breaker.state)
+        for name, upstream in _upstreams.items()
+    }
+
+
+# One pooled client per event loop: an httpx.AsyncClient cannot be shared between loops, and a sync server
+# running async views (e.g. runserver) creates a fresh loop per request.
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> 'httpx.AsyncClient':
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                getattr(settings, 'FUEL_ROUTER_HTTP_READ_TIMEOUT', DEFAULT_POLICY['read_timeout']),
+                connect=getattr(settings, 'FUEL_ROUTER_HTTP_CONNECT_TIMEOUT', DEFAULT_POLICY['connect_timeout']),
+            ),
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'FUEL_ROUTER_HTTP_POOL_SIZE', DEFAULT_POLICY['pool_size']),
+                max_keepalive_connections=getattr(settings, 'FUEL_ROUTER_HTTP_POOL_SIZE', DEFAULT_POLICY['pool_size']),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
@@ -1,6 +1,13 @@
 from django.urls import path
-from fuel_router_app.views import RoutePlannerView
+from fuel_router_app.views import (
+    BatchRoutePlannerView, RoutePlannerView, metrics, plan_route_async, route_map, station_viewport
+)
 
 urlpatterns = [
     path('plan-route/', RoutePlannerView.as_view(), name='plan-route'),
+    path('plan-route/async/', plan_route_async, name='plan-route-async'),
+    path('plan-route/batch/', BatchRoutePlannerView.as_view(), name='plan-route-batch'),
+    path('maps/<slug:route_id>/', route_map, name='route-map'),
+    path('stations/', station_viewport, name='station-viewport'),
+    path('metrics/', metrics, name='metrics'),
 ]
\ No newline at end of file
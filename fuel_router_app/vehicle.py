@@ -0,0 +1,39 @@
+from typing import Dict, NamedTuple, Optional, Union
+
+
+class Vehicle(NamedTuple):
+    """Fuel parameters of the vehicle a route is planned for."""
+    tank_gallons: float = 50.0
+    mpg: float = 10.0
+    start_fuel: float = 1.0  # Fraction of the tank that is full at departure
+    reserve: float = 0.0  # Fraction of the tank the plan never dips into
+    min_purchase: float = 0.0  # Smallest fill-up worth stopping for, in gallons
+    name: Optional[str] = None
+
+    @property
+    def tank_range(self) -> float:
+        return self.tank_gallons * self.mpg
+
+    @property
+    def usable_range(self) -> float:
+        return self.tank_range * (1 - self.reserve)
+
+    @property
+    def start_range(self) -> float:
+        return self.tank_range * (self.start_fuel - self.reserve)
+
+    def planning_kwargs(self) -> Dict[str, float]:
+        """Arguments of ``RouteOptimizer.plan_fuel_stops`` for this vehicle; the reserve is kept out of every range."""
+        return {
+            'tank_range': self.usable_range,
+            'mpg': self.mpg,
+            'start_range': self.start_range,
+            'min_gallons': self.min_purchase,
+        }
+
+    def as_dict(self) -> Dict[str, Union[str, float, None]]:
+        return dict(self._asdict(), tank_range=self.tank_range)
+
+
+# The planner's historical assumption: a 500-mile range at 10 mpg, leaving with a full tank
+DEFAULT_VEHICLE = Vehicle()
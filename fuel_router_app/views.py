@@ -1,105 +1,351 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+from fuel_router_app.async_optimizer import AsyncRouteOptimizer, run_in_executor
+from fuel_router_app.batch import plan_batch
+from fuel_router_app.fast_json import dumps, iter_json, json_response, loads, should_stream
+from fuel_router_app.geometry import encode_polyline, simplify
+from fuel_router_app.instrumentation import current_trace, render_metrics, stage
+from fuel_router_app.maps import get_map_html, store_route
+from fuel_router_app.plan_cache import get_plan_cache, plan_key
 from fuel_router_app.route_optimizer import RouteOptimizer
-import folium
-from fuel_router_app.serializers import RouteRequestSerializer, RouteResponseSerializer
+from fuel_router_app.models import FuelStation
+from fuel_router_app.station_snapshot import DatabaseStations, get_snapshot
+from fuel_router_app.tiered_cache import normalize_query
+from fuel_router_app.serializers import (
+    BatchRouteRequestSerializer, RouteRequestSerializer, RouteResponseSerializer, StationViewportSerializer
+)
 from decimal import Decimal
 from django.conf import settings
-from folium.plugins import MarkerCluster
-import os
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
 
-map_file_path = settings.BASE_DIR / 'maps/map.html'
+
+def requested_vehicles(validated_data):
+    return validated_data.get('vehicles') or [validated_data['vehicle']]
+
+
+def vehicles_key(vehicles):
+    # Everything but the display name changes the plan
+    return [tuple(vehicle)[:-1] for vehicle in vehicles]
+
+
+def waypoints_key(waypoints):
+    return [normalize_query(waypoint) for waypoint in waypoints]
+
+
+def alternatives_summary(ranked):
+    """Distance, duration and costs of each planned alternative, in rank order."""
+    summary = []
+    for rank, plan in enumerate(ranked):
+        route = plan['route']
+        item = {'rank': rank, 'index': plan['index'], 'total_distance': route['distance'], 'duration': route['duration']}
+        if 'results' in plan:
+            item.update(
+                fuel_stops=plan['results'][0]['fuel_stops'],
+                total_cost=round(Decimal(plan['results'][0]['total_cost']), 4),
+                trip_cost=round(Decimal(plan['trip_cost']), 4),
+            )
+        else:
+            item['error'] = plan['error']
+        summary.append(item)
+    return summary
+
+
+def check_geocoded(locations, points):
+    for location, point in zip(locations, points):
+        if None in point:
+            raise ValueError(f"Could not geocode '{location}'")
+    return points
 
 
 class RoutePlannerView(APIView):
     def post(self, request):
         # Validate request data using serializer
         request_serializer = RouteRequestSerializer(data=request.data)
-        request_serializer.is_valid(raise_exception=True)
+        with stage('validate'):
+            request_serializer.is_valid(raise_exception=True)
 
         start = request_serializer.validated_data['start']
         end = request_serializer.validated_data['end']
+        waypoints = request_serializer.validated_data['waypoints']
+        optimization = request_serializer.validated_data['optimization']
+        alternatives = request_serializer.validated_data['alternatives']
+        steps = request_serializer.validated_data['include_steps']
+        vehicles = requested_vehicles(request_serializer.validated_data)
         route_service = RouteOptimizer()
 
         try:
-            # Convert locations to coordinates
-            start_lat, start_lon = route_service.geocode_location(start)
-            end_lat, end_lon = route_service.geocode_location(end)
+            # Identical trips against the same station data share one plan
+            with stage('snapshot'):
+                snapshot = get_snapshot()
+            key = plan_key(
+                start, end, snapshot.version, waypoints=waypoints_key(waypoints), vehicles=vehicles_key(vehicles),
+                optimization=optimization, alternatives=alternatives, steps=steps
+            )
+            with stage('plan'):
+                plan = get_plan_cache().get_or_plan(
+                    key, lambda: self.plan_route(
+                        route_service, [start, *waypoints, end], vehicles, optimization, snapshot, alternatives, steps
+                    )
+                )
 
-            # Get route from OSRM
-            route_data = route_service.get_route(start_lat, start_lon, end_lat, end_lon)
+            with stage('serialize'):
+                data = self.serialize_response(request, plan, request_serializer.validated_data)
+                if should_stream(data):
+                    # Long routes: encode the coordinates chunk by chunk as they are sent
+                    return StreamingHttpResponse(iter_json(data), content_type='application/json')
+                return Response(data)
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=400)
 
-            # Calculate optimal stops
-            result = route_service.find_optimal_fuel_stops(
-                (start_lat, start_lon), (end_lat, end_lon),
-                route_data['geometry'], route_data['distance'], tank_range=500, mpg=10
+    def plan_route(self, route_service, locations, vehicles, optimization, snapshot, alternatives=0, steps=False):
+        """Geocode, route and plan fuel stops for one trip; the returned plan is what the plan cache stores."""
+        # Convert locations (start, waypoints, end) to coordinates
+        points = check_geocoded(locations, route_service.geocode_locations(*locations))
+
+        if alternatives:
+            # One OSRM request for the route and its alternatives, planned in parallel; the cheapest trip wins
+            routes = route_service.get_routes(points, alternatives, steps)
+            ranked = route_service.plan_alternatives(
+                points[0], points[-1], routes, vehicles, optimization=optimization, snapshot=snapshot
             )
+            route_data, results = ranked[0]['route'], ranked[0]['results']
+        else:
+            # Get route from OSRM, one leg between each pair of consecutive points
+            route_data = route_service.get_route_via(points, steps)
 
-            # Generate map
-            map_html = self.generate_map(route_data['geometry'], result['fuel_stops'])
+            # Calculate optimal stops for every vehicle over one shared route corridor, carrying fuel across legs
+            results = route_service.plan_for_vehicles(
+                points[0], points[-1],
+                route_data['geometry'], route_data['distance'], vehicles,
+                optimization=optimization, snapshot=snapshot, legs=route_data.get('legs')
+            )
 
-            # Save map to a file
-            os.makedirs(os.path.dirname(map_file_path), exist_ok=True)
-            with open(map_file_path, 'w') as file:
-                file.write(map_html)
+        # Keep what the map needs; it is rendered only if someone opens map_url
+        with stage('store_route'):
+            route_id = store_route(route_data['geometry'], results[0]['fuel_stops'])
 
-            response_data = {
-                'route_coordinates': route_data['geometry'],
-                'fuel_stops': result['fuel_stops'],
-                'total_cost': round(Decimal(result['total_cost']), 4),
-                'total_distance': result['total_distance'],
-                'map_url': str(map_file_path)
-            }
+        plan = {'route_id': route_id, 'route': route_data, 'results': results}
+        if alternatives:
+            plan['alternatives'] = alternatives_summary(ranked)
+        return plan
 
-            serializer = RouteResponseSerializer(data=response_data)
-            serializer.is_valid(raise_exception=True)
+    def serialize_response(self, request, plan, options):
+        route_id, route_data, result = plan['route_id'], plan['route'], plan['results'][0]
+        vehicles = requested_vehicles(options)
+        response_data = {
+            'route_id': route_id,
+            'fuel_stops': result['fuel_stops'],
+            'total_cost': round(Decimal(result['total_cost']), 4),
+            'total_distance': result['total_distance'],
+            'vehicle': vehicles[0].as_dict(),
+            'map_url': request.build_absolute_uri(reverse('route-map', args=[route_id]))
+        }
+        if 'vehicles' in options:
+            response_data['plans'] = [
+                {
+                    'vehicle': vehicle.as_dict(),
+                    'fuel_stops': vehicle_result['fuel_stops'],
+                    'total_cost': round(Decimal(vehicle_result['total_cost']), 4),
+                }
+                for vehicle, vehicle_result in zip(vehicles, plan['results'])
+            ]
+        if 'alternatives' in plan:
+            response_data['alternatives'] = plan['alternatives']
 
-            return Response(serializer.data)
+        geometry = route_data['geometry']
+        if options['geometry_format'] != 'none' and options['simplify_tolerance']:
+            geometry = simplify(geometry, options['simplify_tolerance'])
+        if options['geometry_format'] == 'coordinates':
+            response_data['route_coordinates'] = geometry
+        elif options['geometry_format'] == 'polyline':
+            response_data['route_polyline'] = encode_polyline(geometry)
+        if options['include_steps']:
+            response_data['steps'] = route_data['steps']
+        if options['waypoints']:
+            locations = [options['start'], *options['waypoints'], options['end']]
+            response_data['legs'] = [
+                dict(leg, start=leg_start, end=leg_end)
+                for leg, leg_start, leg_end in zip(route_data['legs'], locations, locations[1:])
+            ]
+        trace = current_trace()
+        if options['debug_timings'] and trace is not None:
+            response_data['debug_timings'] = trace.as_dict()
 
-        except Exception as e:
-            return Response({'error': str(e)}, status=400)
+        return RouteResponseSerializer(response_data).data
+
+
+class BatchRoutePlannerView(APIView):
+    """Plan many trips in one request, streaming one NDJSON line per trip as it finishes."""
+
+    def post(self, request):
+        # Reject oversized batches before validating (and looking up the vehicle profiles of) every trip
+        max_trips = getattr(settings, 'FUEL_ROUTER_BATCH_MAX_TRIPS', 1000)
+        trips = request.data.get('trips') if isinstance(request.data, dict) else None
+        if isinstance(trips, list) and len(trips) > max_trips:
+            return Response({'error': f'At most {max_trips} trips per batch'}, status=400)
+
+        request_serializer = BatchRouteRequestSerializer(data=request.data)
+        request_serializer.is_valid(raise_exception=True)
+
+        trips = request_serializer.validated_data['trips']
+        lines = (dumps(result) + b'\n' for result in plan_batch(trips))
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+async def plan_route_async(request):
+    """
+    Async counterpart of RoutePlannerView for ASGI deployments (route_planner/asgi.py).
+
+    Both endpoints are geocoded concurrently over a pooled async HTTP client, and the optimizer runs in a thread
+    pool, so a worker keeps serving other requests while upstream calls are in flight.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+
+    try:
+        payload = loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error'}, status=400)
+
+    request_serializer = RouteRequestSerializer(data=payload)
+    # Validation may look up vehicle profiles in the database
+    with stage('validate'):
+        valid = await sync_to_async(request_serializer.is_valid)()
+    if not valid:
+        return JsonResponse(request_serializer.errors, status=400)
+
+    start = request_serializer.validated_data['start']
+    end = request_serializer.validated_data['end']
+    waypoints = request_serializer.validated_data['waypoints']
+    optimization = request_serializer.validated_data['optimization']
+    alternatives = request_serializer.validated_data['alternatives']
+    steps = request_serializer.validated_data['include_steps']
+    vehicles = requested_vehicles(request_serializer.validated_data)
+    route_service = AsyncRouteOptimizer()
+    view = RoutePlannerView()
+
+    async def plan_route():
+        locations = [start, *waypoints, end]
+        points = check_geocoded(locations, await route_service.ageocode_locations(*locations))
+
+        if alternatives:
+            routes = await route_service.aget_routes(points, alternatives, steps)
+            ranked = await route_service.aplan_alternatives(
+                points[0], points[-1], routes, vehicles, optimization=optimization, snapshot=snapshot
+            )
+            route_data, results = ranked[0]['route'], ranked[0]['results']
+        else:
+            route_data = await route_service.aget_route_via(points, steps)
+
+            results = await route_service.aplan_for_vehicles(
+                points[0], points[-1],
+                route_data['geometry'], route_data['distance'], vehicles,
+                optimization=optimization, snapshot=snapshot, legs=route_data.get('legs')
+            )
+
+        with stage('store_route'):
+            route_id = await sync_to_async(store_route, thread_sensitive=False)(
+                route_data['geometry'], results[0]['fuel_stops']
+            )
+
+        plan = {'route_id': route_id, 'route': route_data, 'results': results}
+        if alternatives:
+            plan['alternatives'] = alternatives_summary(ranked)
+        return plan
+
+    try:
+        # The snapshot version check may query the database, so it runs off the event loop
+        with stage('snapshot'):
+            snapshot = await run_in_executor(get_snapshot)
+        key = plan_key(
+            start, end, snapshot.version, waypoints=waypoints_key(waypoints), vehicles=vehicles_key(vehicles),
+            optimization=optimization, alternatives=alternatives, steps=steps
+        )
+        with stage('plan'):
+            plan = await get_plan_cache().aget_or_plan(key, plan_route)
+
+        with stage('serialize'):
+            return json_response(view.serialize_response(request, plan, request_serializer.validated_data))
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+# Exempt like DRF's APIView does; the csrf_exempt decorator would wrap the coroutine in a sync function
+plan_route_async.csrf_exempt = True
+
+
+def metrics(request):
+    """Stage latency histograms and upstream/cache counters in the Prometheus text format."""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def route_map(request, route_id):
+    """Render (or serve the cached render of) the map for a planned route."""
+    html = get_map_html(route_id)
+    if html is None:
+        raise Http404('Unknown or expired route id')
+    return HttpResponse(html, content_type='text/html')
+
+
+def station_data_etag(snapshot):
+    # Viewports change only when the station data (or the clustering settings) do
+    return quote_etag('stations-{}-{}-{}'.format(
+        snapshot.version,
+        getattr(settings, 'FUEL_ROUTER_CLUSTER_MAX_ZOOM', 12),
+        getattr(settings, 'FUEL_ROUTER_CLUSTER_CELL_PIXELS', 64),
+    ))
+
+
+def cache_viewport(response):
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'FUEL_ROUTER_VIEWPORT_MAX_AGE', 0))
+    return response
+
+
+@require_safe
+def station_viewport(request):
+    """Stations, or price clusters of them, inside a map viewport (``?bbox=west,south,east,north&zoom=z``)."""
+    request_serializer = StationViewportSerializer(data=request.GET)
+    if not request_serializer.is_valid():
+        return JsonResponse(request_serializer.errors, status=400)
+    box = request_serializer.validated_data['bbox']
+    zoom = request_serializer.validated_data['zoom']
+    limit = getattr(settings, 'FUEL_ROUTER_VIEWPORT_LIMIT', 5000)
+
+    # Only a valid viewport can be answered with 304 Not Modified
+    snapshot = get_snapshot()
+    etag = station_data_etag(snapshot)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return cache_viewport(not_modified)
+
+    with stage('viewport'):
+        clusters = snapshot.clusters
+        data = {'version': snapshot.version, 'zoom': zoom, 'clustered': zoom <= clusters.max_zoom}
+        if data['clustered']:
+            items = clusters.clusters(zoom, box, limit + 1)
+            key = 'clusters'
+        elif isinstance(snapshot, DatabaseStations):
+            south, west, north, east = box
+            items = [
+                {'station_id': station_id, 'price': float(price), 'lat': lat, 'lon': lon}
+                for station_id, price, lat, lon in FuelStation.objects.in_bbox(south, west, north, east)
+                .values_list('opis_id', 'retail_price', 'lat', 'lon')[:limit + 1]
+            ]
+            key = 'stations'
+        else:
+            items = clusters.stations(box, limit + 1)
+            key = 'stations'
+        data[key] = items[:limit]
+        data['truncated'] = len(items) > limit
 
-    def generate_map(self, coordinates, fuel_stops):
-        # Create map centered on route with Google Satellite view tile layer
-        map_center = coordinates[len(coordinates) // 2]
-        m = folium.Map(location=[map_center[1], map_center[0]], zoom_start=14)
-
-        # Add route with a smoother Polyline
-        folium.PolyLine(
-            [(lat, lon) for lon, lat in coordinates],
-            weight=5,
-            color='blue',
-            opacity=0.7
-        ).add_to(m)
-
-        # Marker Cluster for fuel stops
-        marker_cluster = MarkerCluster().add_to(m)
-
-        # Start marker (Green marker for start point)
-        start_point = coordinates[0]  # First point in coordinates
-        folium.Marker(
-            [start_point[1], start_point[0]],
-            tooltip="Start",
-            popup="This is the start point!",
-            icon=folium.Icon(color='green', icon='play')
-        ).add_to(m)
-
-        # Stop marker (Red marker for stop point)
-        stop_point = coordinates[-1]  # Last point in coordinates
-        folium.Marker(
-            [stop_point[1], stop_point[0]],
-            tooltip="End",
-            popup="This is the stop point!",
-            icon=folium.Icon(color='red', icon='stop')
-        ).add_to(m)
-
-        # Add fuel stops
-        for stop in fuel_stops:
-            folium.Marker(
-                [stop['location']['lat'], stop['location']['lng']],
-                tooltip=stop['name'],
-                popup=f"{stop['name']}<br>Price: ${stop['price']}/gal",
-                icon=folium.Icon(color='blue', icon='fa-gas-pump', prefix='fa')
-            ).add_to(marker_cluster)
-
-        return m._repr_html_()
+    response = json_response(data)
+    response['ETag'] = etag
+    return cache_viewport(response)
@@ -0,0 +1,49 @@
+"""
+Startup warm-up.
+
+A worker otherwise loads the station snapshot, builds its spatial index and the gazetteer, and imports the lazily
+imported libraries (folium, requests, httpx) on its first requests. ``warm_up`` does all of that up front. The
+WSGI and ASGI entrypoints call ``preload`` (so servers warm up but ``migrate``, ``test`` and the other management
+commands do not), and with a preloading server (gunicorn's ``preload_app``, see ``gunicorn.conf.py``) it runs once
+in the master and the forked workers share the station arrays copy-on-write instead of each loading its own copy.
+"""
+import importlib
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .gazetteer import preload_gazetteer
+from .station_snapshot import preload_snapshot
+
+
+def warm_up() -> Dict[str, float]:
+    """Preload the snapshot and its index, the gazetteer and ``FUEL_ROUTER_WARMUP_IMPORTS``; returns ms per step."""
+    timings = {}
+
+    started = time.perf_counter()
+    snapshot = preload_snapshot()
+    timings['snapshot'] = time.perf_counter() - started
+
+    if snapshot is not None:
+        started = time.perf_counter()
+        snapshot.index
+        timings['spatial_index'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    preload_gazetteer()
+    timings['gazetteer'] = time.perf_counter() - started
+
+    for module in getattr(settings, 'FUEL_ROUTER_WARMUP_IMPORTS', ()):
+        started = time.perf_counter()
+        importlib.import_module(module)
+        timings[f'import {module}'] = time.perf_counter() - started
+
+    return {name: round(1000 * seconds, 3) for name, seconds in timings.items()}
+
+
+def preload() -> Optional[Dict[str, float]]:
+    """``warm_up`` when ``FUEL_ROUTER_PRELOAD_SNAPSHOT`` is on; for the server entrypoints."""
+    if getattr(settings, 'FUEL_ROUTER_PRELOAD_SNAPSHOT', True):
+        return warm_up()
+    return None
@@ -0,0 +1,26 @@
+"""
+gunicorn settings, read from the working directory:
+
+    gunicorn route_planner.wsgi
+    gunicorn route_planner.asgi -k uvicorn.workers.UvicornWorker
+
+The application is loaded once in the master, where route_planner/wsgi.py (or asgi.py) warms up the station
+snapshot, its spatial index and the gazetteer (fuel_router_app/warmup.py); every worker forked from it starts with
+them already in memory, shared copy-on-write.
+"""
+import gc
+import multiprocessing
+
+bind = '0.0.0.0:8000'
+workers = multiprocessing.cpu_count() + 1
+preload_app = True
+
+
+def when_ready(server):
+    # Database connections opened by the warm-up must not be shared by the workers
+    from django.db import connections
+
+    connections.close_all()
+    # Move the preloaded objects out of the collector's reach: collections in the workers would otherwise write
+    # to (and so copy) every page holding them
+    gc.freeze()
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its Server-Timing 'request' metric covers the whole middleware stack
+    'fuel_router_app.instrumentation.server_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,7 +88,15 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # Shared by every worker on the host and kept across restarts (geocoding and route results)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
 }
 
 # Password validation
@@ -131,3 +141,129 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+REST_FRAMEWORK = {
+    # orjson-backed when installed, DRF's stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'fuel_router_app.fast_json.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'fuel_router_app.fast_json.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Fuel router
+
+# Size (in degrees) of the grid cells used by the in-memory station spatial index
+FUEL_ROUTER_GRID_CELL_DEGREES = 0.5
+
+# Distance kernel: 'ellipsoidal' (WGS-84, Lambert's formula) or 'haversine' (spherical, fastest)
+FUEL_ROUTER_DISTANCE_MODE = 'ellipsoidal'
+
+# Load the in-memory station snapshot, its spatial index and the gazetteer when the WSGI/ASGI application is loaded
+# instead of on the first request (fuel_router_app/warmup.py). With gunicorn's preload_app this happens once, before
+# the workers fork. Management commands never warm up.
+FUEL_ROUTER_PRELOAD_SNAPSHOT = True
+
+# Lazily imported libraries to load during the warm-up anyway, e.g. ['folium', 'requests', 'httpx'] when a
+# preloading master can share them with its workers
+FUEL_ROUTER_WARMUP_IMPORTS = []
+
+# Seconds between checks of the shared station data version by each process
+FUEL_ROUTER_SNAPSHOT_CHECK_INTERVAL = 5
+
+# Where the optimizer reads stations: 'memory' (a snapshot of the whole table per process, fastest) or 'database'
+# (only the stations near each route, through the SQLite R*Tree; for processes that cannot hold the snapshot)
+FUEL_ROUTER_STATION_SOURCE = 'memory'
+
+# Non-fuel operating costs (maintenance, tyres, driver time) added to the fuel cost to rank alternative routes
+FUEL_ROUTER_COST_PER_MILE = 0.4
+FUEL_ROUTER_COST_PER_HOUR = 40.0
+
+# Upstream result caching: an in-process LRU in front of the 'shared' cache alias
+FUEL_ROUTER_SHARED_CACHE = 'shared'
+FUEL_ROUTER_LOCAL_CACHE_SIZE = 1024
+FUEL_ROUTER_LOCAL_CACHE_SIZES = {
+    # Rendered maps are large; keep only a few per worker and let the shared tier hold the rest
+    'map_html': 32,
+    'plan': 256,
+}
+FUEL_ROUTER_CACHE_TTLS = {
+    'geocode': 30 * 24 * 3600,
+    # Locations the geocoder could not find, kept briefly so a transient miss is retried soon
+    'geocode_miss': 600,
+    'route': 24 * 3600,
+    'map_route': 24 * 3600,
+    'map_html': 24 * 3600,
+    # Complete plans; keep below map_route so a cached plan's map_url stays valid
+    'plan': 3600,
+}
+
+# JSON encoding and decoding: 'orjson' (used when installed) or 'stdlib'. Responses with a list longer than
+# FUEL_ROUTER_JSON_STREAM_ITEMS (e.g. the coordinates of a long route) are streamed in chunks; 0 never streams.
+FUEL_ROUTER_JSON_BACKEND = 'orjson'
+FUEL_ROUTER_JSON_STREAM_ITEMS = 10000
+
+# Station viewport endpoint: stations are clustered on cells of CELL_PIXELS (a power of two) up to MAX_ZOOM and
+# returned one by one past it, at most VIEWPORT_LIMIT items per response. Responses carry an ETag of the station
+# data version; MAX_AGE is their Cache-Control max-age in seconds (0: revalidate every time).
+FUEL_ROUTER_CLUSTER_MAX_ZOOM = 12
+FUEL_ROUTER_CLUSTER_CELL_PIXELS = 64
+FUEL_ROUTER_VIEWPORT_LIMIT = 5000
+FUEL_ROUTER_VIEWPORT_MAX_AGE = 0
+
+# Douglas-Peucker tolerance (metres) for the route geometry kept to render maps on demand
+FUEL_ROUTER_MAP_SIMPLIFY_METERS = 25.0
+
+# Upstream HTTP clients (Nominatim, OSRM): timeouts in seconds and keep-alive pool size per host
+FUEL_ROUTER_HTTP_CONNECT_TIMEOUT = 3.0
+FUEL_ROUTER_HTTP_READ_TIMEOUT = 10.0
+FUEL_ROUTER_HTTP_POOL_SIZE = 20
+
+# Threads running the fuel stop optimizer and map rendering for the async endpoint
+FUEL_ROUTER_OPTIMIZER_WORKERS = 4
+
+# Per-upstream overrides of base_url, rate_limit (req/s), retries, backoff, failure_threshold, reset_timeout, ...
+# rate_limit is a budget for the whole host: every worker process claims its request slots from a lock file in
+# FUEL_ROUTER_RATE_LIMIT_DIR. With FUEL_ROUTER_RATE_LIMIT_DIR = None each process enforces it on its own, so the
+# gunicorn workers together (cpu_count() + 1 of them, see gunicorn.conf.py) send up to that many times the rate.
+# Neither covers several hosts sharing an upstream: give each its share of the rate.
+FUEL_ROUTER_RATE_LIMIT_DIR = BASE_DIR / 'ratelimit'
+FUEL_ROUTER_UPSTREAMS = {
+    'nominatim': {
+        'base_url': 'https://nominatim.openstreetmap.org',
+        'rate_limit': 1.0,
+    },
+    'osrm': {
+        'base_url': 'http://router.project-osrm.org',
+    },
+}
+
+# Geocoding and routing backends (fuel_router_app/backends.py). For tests, benchmarks or air-gapped deployments:
+#   FUEL_ROUTER_GEOCODER = {'BACKEND': 'fuel_router_app.backends.GazetteerGeocoder', 'OPTIONS': {'path': ...}}
+#   FUEL_ROUTER_ROUTER = {'BACKEND': 'fuel_router_app.backends.ReplayRouter', 'OPTIONS': {
+#       'directory': ..., 'fallback': {'BACKEND': 'fuel_router_app.backends.SyntheticRouter'}}}
+# OSRMRouter's record_dir option saves every OSRM response for ReplayRouter.
+FUEL_ROUTER_GEOCODER = {
+    'BACKEND': 'fuel_router_app.backends.NominatimGeocoder',
+}
+FUEL_ROUTER_ROUTER = {
+    'BACKEND': 'fuel_router_app.backends.OSRMRouter',
+    'OPTIONS': {'record_dir': None},
+}
+
+# Answer plain "City, ST" queries from an in-process gazetteer before calling the geocoder. It is built from the
+# cities of the geocoded stations plus a name,state,lat,lon places file (None to use the station cities only).
+FUEL_ROUTER_GAZETTEER = True
+FUEL_ROUTER_GAZETTEER_FILE = BASE_DIR / 'fuel_router_app' / 'data' / 'gazetteer.csv'
+
+# Batch planning: optimizer processes (0 runs trips in the request process), threads for geocoding/routing,
+# and the largest accepted batch
+FUEL_ROUTER_BATCH_WORKERS = 4
+FUEL_ROUTER_BATCH_UPSTREAM_WORKERS = 4
+FUEL_ROUTER_BATCH_MAX_TRIPS = 1000
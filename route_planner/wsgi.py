@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'route_planner.settings')
 
 application = get_wsgi_application()
+
+# Load the station data before the first request; under gunicorn's preload_app, once before the workers fork
+from fuel_router_app.warmup import preload  # noqa: E402
+
+preload()